@@ -0,0 +1,551 @@
+"""
+Бэктест стратегии ADX/DI на исторических часовых свечах.
+
+Повторяет логику монитора сигналов (SignalMonitor): правила SignalDetector,
+расчёт лотов, Stop Loss от цены входа, две доливки и закрытие по смене
+сигнала BUY → SELL. Индикаторы и переходы сигналов считаются массивами
+сразу по всей истории, а симуляция позиции перескакивает от события
+к событию, поэтому годы часовых свечей по всем тикерам считаются за секунды.
+
+Отличие от живого монитора: решения принимаются по закрытию часовой
+свечи, а монитор смотрит на незакрытую свечу и цену marketdata каждые
+MONITOR_INTERVAL_MINUTES минут.
+
+Свечи берутся из ISS и кэшируются в BACKTEST_DATA_DIR помесячно
+(закрытые месяцы скачиваются один раз).
+
+Запуск:
+    python backtest.py
+    python backtest.py --tickers SBER GAZP --start 2022-01-01 --end 2025-01-01 --save
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+# Бэктесту не нужны ключи бота и GPT — только чтобы config импортировался
+os.environ.setdefault('TELEGRAM_TOKEN', 'backtest')
+os.environ.setdefault('DATABASE_URL', 'postgresql://backtest')
+os.environ.setdefault('LLM_BACKEND', 'stub')
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    SUPPORTED_STOCKS,
+    DEPOSIT,
+    STOP_LOSS_PERCENT,
+    AVERAGING_LEVEL_1,
+    AVERAGING_LEVEL_2,
+    ADX_THRESHOLD,
+    DI_PLUS_THRESHOLD,
+    DEFAULT_ADX_PERIOD,
+    DEFAULT_EMA_PERIOD,
+    MAX_CANDLES,
+    BACKTEST_DATA_DIR,
+    BACKTEST_DEFAULT_YEARS
+)
+from indicators import TechnicalIndicators
+from candles import CandleSeries
+from moex_api import MoexApiClient, close_http_client
+from models import SignalType
+from signals import SignalDetector, calculate_lots
+from instruments import instruments
+
+logger = logging.getLogger(__name__)
+
+# Одновременных запросов к ISS при загрузке истории
+LOAD_CONCURRENCY = 4
+
+
+@dataclass(frozen=True)
+class StrategyParams:
+    """Параметры стратегии; по умолчанию — значения из config.py, как у монитора"""
+    adx_threshold: float = ADX_THRESHOLD
+    di_threshold: float = DI_PLUS_THRESHOLD
+    adx_period: int = DEFAULT_ADX_PERIOD
+    ema_period: int = DEFAULT_EMA_PERIOD
+    stop_loss_percent: float = STOP_LOSS_PERCENT
+    averaging_level_1: float = AVERAGING_LEVEL_1
+    averaging_level_2: float = AVERAGING_LEVEL_2
+
+    @property
+    def indicator_key(self) -> Tuple[int, int]:
+        """Параметры, от которых зависят индикаторы (остальные — только симуляция)"""
+        return self.adx_period, self.ema_period
+
+
+DEFAULT_PARAMS = StrategyParams()
+
+
+class CandleHistory:
+    """Часовые свечи ISS с файловым кэшем по месяцам"""
+
+    def __init__(self, data_dir: str = BACKTEST_DATA_DIR):
+        self.data_dir = data_dir
+        self.moex_client = MoexApiClient()
+        self._semaphore = asyncio.Semaphore(LOAD_CONCURRENCY)
+
+    async def load(self, ticker: str, start: date, end: date) -> Optional[CandleSeries]:
+        """
+        Свечи тикера за период [start, end) колонками.
+
+        Returns:
+            CandleSeries или None, если свечей нет
+        """
+        months: List[CandleSeries] = []
+        for month_start in self._months(start, end):
+            month = await self._load_month(ticker, month_start)
+            if month is None:
+                return None
+            months.append(month)
+
+        candles = CandleSeries.concat(months)
+        if not candles:
+            return None
+
+        # По времени и без повторов на стыках месяцев
+        _, unique = np.unique(candles.time, return_index=True)
+        candles = candles.take(unique).since(start)
+        return candles[:np.searchsorted(candles.time, np.datetime64(end, 's'))]
+
+    async def _load_month(self, ticker: str, month_start: date) -> Optional[CandleSeries]:
+        path = os.path.join(self.data_dir, ticker, f"{month_start:%Y-%m}.json")
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return CandleSeries.from_records(json.load(f))
+
+        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        async with self._semaphore:
+            candles = await self.moex_client.get_candles_range(ticker, month_start, month_end)
+
+        if candles is None:
+            return None
+
+        # Текущий месяц ещё дополняется — в кэш попадают только закрытые
+        if month_end < date.today():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(candles.to_records(), f)
+
+        return candles
+
+    @staticmethod
+    def _months(start: date, end: date) -> List[date]:
+        months = []
+        current = start.replace(day=1)
+        while current < end:
+            months.append(current)
+            current = (current + timedelta(days=32)).replace(day=1)
+        return months
+
+
+def calculate_indicators(candles: CandleSeries, params: StrategyParams = DEFAULT_PARAMS) -> Dict[str, np.ndarray]:
+    """Индикаторы на каждом баре по окну из MAX_CANDLES последних свечей, как в мониторе"""
+    return TechnicalIndicators.calculate_windowed(
+        candles.high, candles.low, candles.close, window=MAX_CANDLES,
+        adx_period=params.adx_period, ema_period=params.ema_period
+    )
+
+
+def prepare_series(
+    candles: CandleSeries,
+    params: StrategyParams = DEFAULT_PARAMS,
+    indicators: Optional[Dict[str, np.ndarray]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Индикаторы, сигналы и переходы сигналов на каждом баре.
+
+    Состояние сигнала обновляется на каждом баре, поэтому переходы не зависят
+    от позиций: buy_bars — SELL/NONE → BUY, sell_bars — BUY → SELL.
+    Готовые indicators (calculate_indicators) можно передать, чтобы не считать заново.
+    """
+    series = candles.columns()
+    series.update(indicators if indicators is not None else calculate_indicators(candles, params))
+
+    signals = SignalDetector.detect_signal_series(
+        series['adx'], series['di_plus'], series['di_minus'],
+        adx_threshold=params.adx_threshold, di_threshold=params.di_threshold,
+        ema20=series['ema20'], price=series['close']
+    )
+    previous = np.empty_like(signals)
+    previous[0] = ''
+    previous[1:] = signals[:-1]
+
+    is_buy = signals == SignalType.BUY.value
+    is_sell = signals == SignalType.SELL.value
+    series['signal'] = signals
+    series['buy_bars'] = np.flatnonzero(
+        is_buy & ((previous == SignalType.SELL.value) | (previous == SignalType.NONE.value))
+    )
+    series['sell_bars'] = np.flatnonzero(is_sell & (previous == SignalType.BUY.value))
+    return series
+
+
+def slice_series(series: Dict[str, np.ndarray], start: int, stop: int) -> Dict[str, np.ndarray]:
+    """
+    Бары [start, stop) подготовленной серии.
+
+    Индикаторы оконные, поэтому срез точен: прогрев берётся из баров до start,
+    а переход на первом баре учитывает сигнал предыдущего бара.
+    """
+    sliced = {key: value[start:stop] for key, value in series.items() if key not in ('buy_bars', 'sell_bars')}
+    for key in ('buy_bars', 'sell_bars'):
+        bars = series[key]
+        sliced[key] = bars[(bars >= start) & (bars < stop)] - start
+    return sliced
+
+
+def _first_at_or_below(prices: np.ndarray, level: float) -> Optional[int]:
+    hits = prices <= level
+    index = int(np.argmax(hits))
+    return index if hits[index] else None
+
+
+def simulate_ticker(
+    ticker: str, series: Dict[str, np.ndarray], params: StrategyParams = DEFAULT_PARAMS
+) -> Tuple[List[Dict[str, Any]], np.ndarray, np.ndarray]:
+    """
+    Симуляция позиций по тикеру.
+
+    На каждом баре порядок тот же, что в SignalMonitor._check_ticker_signal:
+    Stop Loss → доливка (не больше одной за бар) → обработка смены сигнала.
+
+    Returns:
+        (сделки в формате таблицы positions, кривая прибыли тикера в рублях по барам,
+        маска баров с открытой позицией)
+    """
+    close = series['close']
+    times = series['time']
+    buy_bars = series['buy_bars']
+    sell_bars = series['sell_bars']
+    lot_size = instruments.lot_size(ticker)
+    n = len(close)
+
+    # Для кривой прибыли: акций в позиции и средняя цена на каждом баре, реализованный P&L
+    shares = np.zeros(n)
+    average = np.zeros(n)
+    realized = np.zeros(n)
+
+    trades: List[Dict[str, Any]] = []
+    position: Optional[Dict[str, Any]] = None
+    bar = 0
+
+    while bar < n:
+        if position is None:
+            next_buy = np.searchsorted(buy_bars, bar)
+            if next_buy == len(buy_bars):
+                break
+            entry = int(buy_bars[next_buy])
+            lots = calculate_lots(close[entry], lot_size, params.stop_loss_percent)
+            bar = entry + 1
+            if lots <= 0:
+                continue
+
+            position = {
+                'ticker': ticker,
+                'position_type': 'LONG',
+                'entry_price': float(close[entry]),
+                'entry_time': pd.Timestamp(times[entry]).to_pydatetime(),
+                'entry_adx': float(series['adx'][entry]),
+                'entry_di_plus': float(series['di_plus'][entry]),
+                'entry_di_minus': float(series['di_minus'][entry]),
+                'lots': lots,
+                'average_price': float(close[entry]),
+                'averaging_count': 0,
+                '_since': entry
+            }
+            continue
+
+        entry_price = position['entry_price']
+        next_sell = np.searchsorted(sell_bars, bar)
+        sell = int(sell_bars[next_sell]) if next_sell < len(sell_bars) else None
+
+        # Уровни цены проверяются только до ближайшего сигнала SELL включительно
+        window = close[bar:(sell + 1 if sell is not None else n)]
+        stop = _first_at_or_below(window, entry_price * (1 - params.stop_loss_percent / 100))
+        averaging_level = {
+            0: params.averaging_level_1, 1: params.averaging_level_2
+        }.get(position['averaging_count'])
+        averaging = (
+            _first_at_or_below(window, entry_price * (1 - averaging_level / 100))
+            if averaging_level is not None else None
+        )
+
+        if stop is not None and (averaging is None or stop <= averaging):
+            exit_bar = bar + stop
+            _close_position(position, exit_bar, close, times, 'stop_loss', lot_size, shares, average, realized)
+            trades.append(position)
+            position = None
+            # На этом же баре после Stop Loss может прийти сигнал BUY
+            bar = exit_bar
+            continue
+
+        if averaging is not None:
+            averaging_bar = bar + averaging
+            add_lots = calculate_lots(entry_price, lot_size, params.stop_loss_percent)
+            if add_lots > 0:
+                _fill_holding(position, averaging_bar, lot_size, shares, average)
+                total_lots = position['lots'] + add_lots
+                position['average_price'] = (
+                    position['lots'] * position['average_price'] + add_lots * close[averaging_bar]
+                ) / total_lots
+                position['lots'] = total_lots
+                position['averaging_count'] += 1
+                position['_since'] = averaging_bar
+
+            if sell == averaging_bar:
+                _close_position(position, averaging_bar, close, times, 'signal', lot_size, shares, average, realized)
+                trades.append(position)
+                position = None
+            bar = averaging_bar + 1
+            continue
+
+        if sell is None:
+            break
+
+        _close_position(position, sell, close, times, 'signal', lot_size, shares, average, realized)
+        trades.append(position)
+        position = None
+        bar = sell + 1
+
+    if position is not None:
+        # Открыта на конец периода: прибыль по последней цене
+        _fill_holding(position, n, lot_size, shares, average)
+        position.update({
+            'exit_price': None,
+            'exit_time': None,
+            'exit_reason': None,
+            'profit_percent': round((close[-1] - position['average_price']) / position['average_price'] * 100, 2),
+            'profit_rub': (close[-1] - position['average_price']) * position['lots'] * lot_size,
+            'is_open': True
+        })
+        position.pop('_since')
+        trades.append(position)
+
+    equity = np.cumsum(realized) + shares * (close - average)
+    return trades, equity, shares > 0
+
+
+def _fill_holding(position: Dict[str, Any], until: int, lot_size: int, shares: np.ndarray, average: np.ndarray):
+    """Позиция в неизменном виде держалась с бара _since до бара until (не включая)"""
+    since = position['_since']
+    shares[since:until] = position['lots'] * lot_size
+    average[since:until] = position['average_price']
+
+
+def _close_position(
+    position: Dict[str, Any],
+    exit_bar: int,
+    close: np.ndarray,
+    times: np.ndarray,
+    reason: str,
+    lot_size: int,
+    shares: np.ndarray,
+    average: np.ndarray,
+    realized: np.ndarray
+):
+    _fill_holding(position, exit_bar, lot_size, shares, average)
+    exit_price = float(close[exit_bar])
+    position.pop('_since')
+    average_price = position['average_price']
+    profit_rub = (exit_price - average_price) * position['lots'] * lot_size
+    realized[exit_bar] += profit_rub
+
+    position.update({
+        'exit_price': exit_price,
+        'exit_time': pd.Timestamp(times[exit_bar]).to_pydatetime(),
+        'exit_reason': reason,
+        'profit_percent': round((exit_price - average_price) / average_price * 100, 2),
+        'profit_rub': profit_rub,
+        'is_open': False
+    })
+
+
+def _max_drawdown_percent(equity: np.ndarray) -> float:
+    if len(equity) == 0:
+        return 0.0
+    peaks = np.maximum.accumulate(equity)
+    return float(np.max((peaks - equity) / peaks) * 100)
+
+
+def summarize(
+    trades: List[Dict[str, Any]],
+    equity: np.ndarray,
+    exposure: float
+) -> Dict[str, Any]:
+    """Сводка по сделкам и кривой капитала"""
+    closed = [t for t in trades if not t['is_open']]
+    wins = [t for t in closed if t['profit_percent'] > 0]
+    total_profit = float(sum(t['profit_rub'] for t in trades))
+
+    return {
+        'trades': len(trades),
+        'closed_trades': len(closed),
+        'stop_losses': sum(1 for t in closed if t['exit_reason'] == 'stop_loss'),
+        'win_rate': round(len(wins) / len(closed) * 100, 2) if closed else 0.0,
+        'avg_profit_percent': round(float(np.mean([t['profit_percent'] for t in closed])), 2) if closed else 0.0,
+        'total_profit': round(total_profit, 2),
+        'return_percent': round(total_profit / DEPOSIT * 100, 2),
+        'max_drawdown_percent': round(_max_drawdown_percent(DEPOSIT + equity), 2),
+        'exposure_percent': round(exposure * 100, 2)
+    }
+
+
+def run_backtest(
+    history: Dict[str, CandleSeries],
+    params: StrategyParams = DEFAULT_PARAMS,
+    start: Optional[np.datetime64] = None,
+    end: Optional[np.datetime64] = None,
+    indicators_cache: Optional[Dict[Tuple[str, Tuple[int, int]], Dict[str, np.ndarray]]] = None
+) -> Dict[str, Any]:
+    """
+    Бэктест по загруженным свечам.
+
+    Args:
+        history: тикер → свечи (CandleHistory.load)
+        params: параметры стратегии
+        start, end: торговать только на барах [start, end); свечи до start
+            используются для прогрева индикаторов
+        indicators_cache: словарь для переиспользования индикаторов между
+            прогонами с одинаковыми periods (ключ — тикер и params.indicator_key)
+
+    Returns:
+        Словарь: positions (все сделки), metrics (портфель), by_ticker (сводки по тикерам)
+    """
+    started = time.perf_counter()
+    all_trades: List[Dict[str, Any]] = []
+    by_ticker: Dict[str, Dict[str, Any]] = {}
+    equity_curves = []
+    exposures = []
+    bars = 0
+
+    for ticker, candles in history.items():
+        if len(candles) < MAX_CANDLES:
+            logger.warning(f"Not enough candles for {ticker}: {len(candles)}")
+            continue
+
+        indicators = None
+        if indicators_cache is not None:
+            cache_key = (ticker, params.indicator_key)
+            indicators = indicators_cache.get(cache_key)
+            if indicators is None:
+                indicators = indicators_cache[cache_key] = calculate_indicators(candles, params)
+
+        series = prepare_series(candles, params, indicators)
+        if start is not None or end is not None:
+            times = series['time']
+            first = np.searchsorted(times, start) if start is not None else 0
+            last = np.searchsorted(times, end) if end is not None else len(times)
+            series = slice_series(series, first, last)
+            if last <= first:
+                continue
+
+        trades, equity, in_position = simulate_ticker(ticker, series, params)
+
+        # Экспозиция — доля баров с открытой позицией среди баров, где есть индикаторы
+        valid = series['signal'] != ''
+        exposure = float(in_position[valid].mean()) if valid.any() else 0.0
+
+        by_ticker[ticker] = summarize(trades, equity, exposure)
+        all_trades.extend(trades)
+        equity_curves.append(pd.Series(equity, index=series['time'], name=ticker))
+        exposures.append(exposure)
+        bars += len(equity)
+
+    if equity_curves:
+        portfolio = pd.concat(equity_curves, axis=1).sort_index().ffill().fillna(0).sum(axis=1).to_numpy()
+    else:
+        portfolio = np.zeros(0)
+
+    metrics = summarize(all_trades, portfolio, float(np.mean(exposures)) if exposures else 0.0)
+    metrics['bars'] = bars
+    metrics['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+
+    all_trades.sort(key=lambda t: t['entry_time'])
+    return {'positions': all_trades, 'metrics': metrics, 'by_ticker': by_ticker}
+
+
+def print_report(result: Dict[str, Any]):
+    metrics = result['metrics']
+    print(f"\n{'Тикер':<8}{'Сделок':>8}{'Win %':>8}{'P&L ₽':>16}{'Просадка %':>12}{'В позиции %':>13}")
+    for ticker, stats in result['by_ticker'].items():
+        print(
+            f"{ticker:<8}{stats['trades']:>8}{stats['win_rate']:>8.1f}{stats['total_profit']:>16,.0f}"
+            f"{stats['max_drawdown_percent']:>12.2f}{stats['exposure_percent']:>13.1f}"
+        )
+    print(
+        f"{'Итого':<8}{metrics['trades']:>8}{metrics['win_rate']:>8.1f}{metrics['total_profit']:>16,.0f}"
+        f"{metrics['max_drawdown_percent']:>12.2f}{metrics['exposure_percent']:>13.1f}"
+    )
+    print(
+        f"\nДоходность: {metrics['return_percent']:+.2f}% от депозита {DEPOSIT:,.0f} ₽, "
+        f"Stop Loss: {metrics['stop_losses']}, "
+        f"{metrics['bars']:,} баров за {metrics['elapsed_seconds']:.2f} с"
+    )
+
+
+async def save_run(result: Dict[str, Any], tickers: List[str], start: date, end: date) -> int:
+    """Сохранение прогона в БД для страницы /backtest/{run_id} дашборда"""
+    from database import db
+
+    await db.connect()
+    try:
+        run_id = await db.create_backtest_run(tickers, start, end, result['metrics'])
+        await db.save_backtest_positions(run_id, result['positions'])
+        return run_id
+    finally:
+        await db.disconnect()
+
+
+async def main_async(args):
+    tickers = args.tickers or list(SUPPORTED_STOCKS.keys())
+    end = args.end or date.today() + timedelta(days=1)
+    start = args.start or end.replace(year=end.year - BACKTEST_DEFAULT_YEARS)
+
+    loader = CandleHistory(args.data_dir)
+    try:
+        loaded = await asyncio.gather(*(loader.load(ticker, start, end) for ticker in tickers))
+    finally:
+        await close_http_client()
+
+    history = {ticker: candles for ticker, candles in zip(tickers, loaded) if candles is not None}
+    for ticker in tickers:
+        if ticker not in history:
+            logger.error(f"❌ No candles for {ticker}, skipped")
+
+    result = run_backtest(history)
+    print_report(result)
+
+    if args.save:
+        run_id = await save_run(result, list(history), start, end)
+        print(f"\n💾 Прогон сохранён: /backtest/{run_id}")
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest of the ADX/DI strategy on hourly MOEX candles")
+    parser.add_argument('--tickers', nargs='*', help="Тикеры (по умолчанию все из SUPPORTED_STOCKS)")
+    parser.add_argument('--start', type=_parse_date, help="Начало периода, YYYY-MM-DD")
+    parser.add_argument('--end', type=_parse_date, help="Конец периода (не включая), YYYY-MM-DD")
+    parser.add_argument('--data-dir', default=BACKTEST_DATA_DIR, help="Каталог кэша свечей ISS")
+    parser.add_argument('--save', action='store_true', help="Сохранить прогон в БД для дашборда")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING
+    )
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Бенчмарк: как задержка LLM влияет на тик check_signals и задержку алертов.
+
+Монитор сигналов прогоняется на синтетическом рынке (все тикеры дают смену
+сигнала SELL → BUY), с базой в памяти и ботом, который только записывает
+отправленные сообщения. GPT — заглушка StubLLMClient с заданным профилем.
+Сеть, PostgreSQL и ключи не нужны.
+
+Запуск:
+    python benchmark_llm.py
+    python benchmark_llm.py --profile slow --tickers 8
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List, Dict, Tuple, Any, Optional
+
+# Бенчмарку не нужны настоящие ключи и база — только чтобы config импортировался
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+os.environ.setdefault('DATABASE_URL', 'postgresql://benchmark')
+os.environ.setdefault('LLM_BACKEND', 'stub')
+
+import numpy as np
+
+import gpt_analyst as gpt_analyst_module
+import scheduler as scheduler_module
+import stock_service as stock_service_module
+from candle_engine import CandleEngine
+from candles import CandleSeries
+from config import SUPPORTED_STOCKS
+from gpt_analyst import GPTAnalyst
+from llm_backend import StubLLMClient, StubProfile
+from scheduler import SignalMonitor
+
+logger = logging.getLogger(__name__)
+
+PROFILES = {
+    'fast': StubProfile(latency_seconds=0.2, jitter_seconds=0.05, chunk_delay_seconds=0.01, seed=1),
+    'typical': StubProfile(latency_seconds=2.0, jitter_seconds=0.5, chunk_delay_seconds=0.03, seed=1),
+    'slow': StubProfile(latency_seconds=8.0, jitter_seconds=2.0, chunk_delay_seconds=0.05, seed=1),
+    'flaky': StubProfile(latency_seconds=2.0, jitter_seconds=0.5, error_rate=0.3, seed=1),
+}
+
+
+class BenchDatabase:
+    """База в памяти с теми методами, которые использует монитор сигналов"""
+
+    def __init__(self, tickers: List[str], users: int):
+        self.subscriptions = {ticker: list(range(1, users + 1)) for ticker in tickers}
+        # Предыдущий сигнал SELL — на тике будет переход в BUY
+        self.signal_states = {(ticker, 'LONG'): {'last_signal': 'SELL'} for ticker in tickers}
+        self.positions: List[Dict[str, Any]] = []
+
+    async def get_all_subscribed_tickers(self) -> List[str]:
+        return sorted(self.subscriptions)
+
+    async def get_ticker_subscribers(self, ticker: str) -> List[int]:
+        return self.subscriptions.get(ticker, [])
+
+    async def get_signal_states(self, tickers: List[str]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        return {key: state for key, state in self.signal_states.items() if key[0] in tickers}
+
+    async def update_signal_states(self, states):
+        for ticker, signal_type, signal, *_ in states:
+            self.signal_states[(ticker, signal_type)] = {'last_signal': signal}
+
+    async def has_open_position(self, user_id: int, ticker: str, position_type: str = None) -> bool:
+        return any(
+            p['user_id'] == user_id and p['ticker'] == ticker
+            and (position_type is None or p['position_type'] == position_type)
+            for p in self.positions
+        )
+
+    async def get_open_positions(self, user_id: int) -> List[Dict[str, Any]]:
+        return [p for p in self.positions if p['user_id'] == user_id]
+
+    async def open_position(self, user_id, ticker, position_type, entry_price, entry_adx, entry_di_plus, entry_di_minus, lots):
+        self.positions.append({
+            'id': len(self.positions) + 1, 'user_id': user_id, 'ticker': ticker,
+            'position_type': position_type, 'entry_price': entry_price, 'average_price': entry_price,
+            'lots': lots, 'averaging_count': 0
+        })
+        return len(self.positions)
+
+    async def close_position(self, user_id, ticker, position_type, exit_price):
+        self.positions = [
+            p for p in self.positions
+            if not (p['user_id'] == user_id and p['ticker'] == ticker and p['position_type'] == position_type)
+        ]
+
+    async def add_to_position(self, user_id, ticker, position_type, add_price, add_lots):
+        pass
+
+    async def get_gpt_analysis(self, cache_key: str) -> Optional[str]:
+        return None
+
+    async def save_gpt_analysis(self, *args):
+        pass
+
+
+class SyntheticMoexClient:
+    """Часовые свечи с устойчивым снижением: ADX и DI- выше порогов (сигнал BUY)"""
+
+    def __init__(self, start: datetime):
+        self.start = start
+
+    async def get_current_price(self, ticker: str) -> Optional[float]:
+        candles = await self.get_historical_candles(ticker)
+        return candles.last_close
+
+    async def get_historical_candles(self, ticker: str, days: int = 10, interval: int = 60) -> Optional[CandleSeries]:
+        count = days * 10
+        steps = np.where(np.arange(count) % 5 == 0, 1.001, 0.996)
+        close = (100.0 + len(ticker) * 10) * np.cumprod(steps)
+        open_price = np.r_[close[0] / steps[0], close[:-1]]
+        return CandleSeries(
+            time=np.datetime64(self.start, 's') + np.arange(count) * np.timedelta64(3600, 's'),
+            open=open_price,
+            high=np.maximum(open_price, close) * 1.002,
+            low=np.minimum(open_price, close) * 0.998,
+            close=close,
+            volume=10_000 + np.arange(count) * 100
+        )
+
+    async def get_candles_range(self, ticker: str, from_date, till_date, interval: int = 60) -> Optional[CandleSeries]:
+        candles = await self.get_historical_candles(ticker)
+        return candles.since(from_date)
+
+
+class RecordingBot:
+    """Бот, который записывает время отправки и редактирования сообщений"""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.sent: List[float] = []
+        self.edited: List[float] = []
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: str = None):
+        self.sent.append(time.perf_counter() - self.started_at)
+        return SimpleNamespace(message_id=len(self.sent), chat_id=chat_id)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, parse_mode: str = None):
+        self.edited.append(time.perf_counter() - self.started_at)
+
+
+async def run_profile(name: str, profile: StubProfile, tickers: List[str], users: int) -> Dict[str, Any]:
+    bench_db = BenchDatabase(tickers, users)
+    analyst = GPTAnalyst()
+    analyst.client = StubLLMClient(profile)
+
+    # Монитор и аналитик работают с базой в памяти и заглушкой LLM
+    scheduler_module.db = bench_db
+    scheduler_module.gpt_analyst = analyst
+    gpt_analyst_module.db = bench_db
+
+    monitor = SignalMonitor()
+    monitor._is_market_open = lambda: True
+    moex = SyntheticMoexClient(start=datetime.now() - timedelta(days=5))
+    monitor.stock_service.moex_client = moex
+    stock_service_module.candle_engine = CandleEngine(moex, base_interval=60)
+
+    started_at = time.perf_counter()
+    bot = RecordingBot(started_at)
+    await monitor.check_signals(SimpleNamespace(bot=bot))
+    tick_seconds = time.perf_counter() - started_at
+
+    # Ждём фоновые GPT запросы и дописывание анализа в алерты
+    while monitor._background_tasks or analyst._background_tasks:
+        await asyncio.gather(*monitor._background_tasks, *analyst._background_tasks, return_exceptions=True)
+    total_seconds = time.perf_counter() - started_at
+
+    return {
+        'profile': name,
+        'tick': tick_seconds,
+        'alerts': len(bot.sent),
+        'alert_p50': _median(bot.sent),
+        'alert_max': max(bot.sent, default=0.0),
+        'analysis_p50': _median(bot.edited),
+        'analysis_max': max(bot.edited, default=0.0),
+        'with_analysis': len(bot.edited),
+        'llm_requests': analyst.client.requests,
+        'llm_failures': analyst.client.failures,
+        'total': total_seconds,
+    }
+
+
+def _median(values: List[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+def print_report(results: List[Dict[str, Any]]):
+    header = (
+        f"{'profile':<8} {'tick,s':>7} {'alerts':>6} {'alert p50':>9} {'alert max':>9} "
+        f"{'gpt p50':>8} {'gpt max':>8} {'with gpt':>8} {'llm req':>7} {'llm err':>7} {'total,s':>7}"
+    )
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(
+            f"{r['profile']:<8} {r['tick']:>7.2f} {r['alerts']:>6} {r['alert_p50']:>9.2f} {r['alert_max']:>9.2f} "
+            f"{r['analysis_p50']:>8.2f} {r['analysis_max']:>8.2f} {r['with_analysis']:>8} "
+            f"{r['llm_requests']:>7} {r['llm_failures']:>7} {r['total']:>7.2f}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Signal monitor latency benchmark with a stub LLM")
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append', help="Профиль (по умолчанию все)")
+    parser.add_argument('--tickers', type=int, default=5, help="Сколько тикеров одновременно дают сигнал")
+    parser.add_argument('--users', type=int, default=3, help="Подписчиков на каждый тикер")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    tickers = list(SUPPORTED_STOCKS)[:args.tickers]
+
+    results = []
+    for name in args.profile or list(PROFILES):
+        results.append(await run_profile(name, PROFILES[name], tickers, args.users))
+    print_report(results)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
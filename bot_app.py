@@ -0,0 +1,85 @@
+import logging
+from datetime import time as dt_time
+
+from telegram.ext import Application
+
+from config import TELEGRAM_TOKEN, MONITOR_INTERVAL_MINUTES, BOT_CONCURRENT_UPDATES
+from telegram_handlers import TelegramHandlers
+from scheduler import SignalMonitor
+from database import db
+from instruments import instruments
+from moex_api import close_http_client
+from gpt_analyst import load_tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+async def post_init(application: Application):
+    """Инициализация после запуска бота"""
+    await db.connect()
+    logger.info("✅ Database connected")
+    await instruments.load()
+
+
+async def post_shutdown(application: Application):
+    """Завершение работы"""
+    await close_http_client()
+    await db.disconnect()
+    logger.info("👋 Database disconnected")
+
+
+def build_application(webhook: bool = False) -> Application:
+    """
+    Приложение бота с хендлерами и задачами мониторинга.
+
+    В режиме webhook апдейты приходят из FastAPI (web_dashboard.py), поэтому
+    Updater не создаётся, а пулом БД управляет lifespan веб-сервера.
+    """
+    builder = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(BOT_CONCURRENT_UPDATES)
+    if webhook:
+        builder = builder.updater(None)
+    else:
+        builder = builder.post_init(post_init).post_shutdown(post_shutdown)
+    application = builder.build()
+
+    # Токенизатор для бюджета промпта GPT: без tiktoken предупреждение сразу при старте
+    load_tokenizer()
+
+    handlers = TelegramHandlers()
+
+    for handler in handlers.get_handlers():
+        application.add_handler(handler)
+
+    application.add_error_handler(handlers.error_handler)
+
+    monitor = SignalMonitor()
+
+    job_queue = application.job_queue
+
+    # Проверка сигналов каждые N минут
+    job_queue.run_repeating(
+        monitor.check_signals,
+        interval=MONITOR_INTERVAL_MINUTES * 60,
+        first=60
+    )
+
+    # Скан всего рынка TQBR с тем же интервалом, со сдвигом от проверки сигналов
+    job_queue.run_repeating(
+        monitor.scan_market,
+        interval=MONITOR_INTERVAL_MINUTES * 60,
+        first=120
+    )
+
+    # Реестр инструментов из ISS до открытия торгов: 06:30 МСК (03:30 UTC)
+    job_queue.run_daily(
+        monitor.update_instruments,
+        time=dt_time(hour=3, minute=30),
+    )
+
+    # Ежедневный расчёт индекса страха и жадности в 19:00 МСК (16:00 UTC)
+    job_queue.run_daily(
+        monitor.update_fear_greed_index,
+        time=dt_time(hour=16, minute=0),
+    )
+
+    return application
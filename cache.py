@@ -0,0 +1,157 @@
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from typing import Optional, Any, Callable, Awaitable
+
+from singleflight import SingleFlight
+from config import CACHE_URL, CACHE_MEMORY_MAX_ITEMS, CACHE_MEMORY_SWEEP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryCache:
+    """
+    Кэш в памяти процесса (фолбэк без Redis и для тестов).
+
+    Размер ограничен max_items (вытесняются давно не читанные ключи), истёкшие
+    ключи вычищаются при записи не реже раза в sweep_interval секунд — ключи
+    дашборда строятся из параметров запроса, и без этого память росла бы
+    без предела.
+    """
+
+    def __init__(self, max_items: int = CACHE_MEMORY_MAX_ITEMS, sweep_interval: float = CACHE_MEMORY_SWEEP_SECONDS):
+        self.max_items = max_items
+        self.sweep_interval = sweep_interval
+        self._data: 'OrderedDict[str, tuple[float, Any]]' = OrderedDict()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    async def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        self._data[key] = (now + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def _sweep(self, now: float):
+        """Удаление всех истёкших ключей"""
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        self._next_sweep = now + self.sweep_interval
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def close(self):
+        self._data.clear()
+
+
+class RedisCache:
+    """Общий кэш между процессами/воркерами на Redis-совместимом сервере"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.client.set(key, pickle.dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class Cache:
+    """Фасад кэша: ошибки бэкенда не ломают запрос, а превращаются в промах"""
+
+    def __init__(self, url: Optional[str] = None):
+        self.backend = self._create_backend(url)
+        self._flight = SingleFlight('cache.get_or_set')
+
+    @staticmethod
+    def _create_backend(url: Optional[str]):
+        if url:
+            try:
+                backend = RedisCache(url)
+                logger.info("✅ Shared cache: Redis")
+                return backend
+            except Exception as e:
+                logger.error(f"❌ Failed to init Redis cache, falling back to in-process cache: {e}")
+
+        logger.info("Shared cache: in-process memory")
+        return InMemoryCache()
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Cache get error for {key}: {e}")
+            return None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        try:
+            await self.backend.set(key, value, ttl)
+        except Exception as e:
+            logger.error(f"Cache set error for {key}: {e}")
+
+    async def delete(self, key: str):
+        try:
+            await self.backend.delete(key)
+        except Exception as e:
+            logger.error(f"Cache delete error for {key}: {e}")
+
+    async def get_or_set(self, key: str, factory: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        """
+        Значение из кэша или результат factory(), сохранённый на ttl секунд (None не кэшируется).
+
+        Одновременные промахи по ключу в процессе считают factory() один раз.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        return await self._flight.do(key, lambda: self._fill(key, factory, ttl))
+
+    async def _fill(self, key: str, factory: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        # Пока ждали своей очереди, значение мог положить другой воркер
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        value = await factory()
+        if value is not None:
+            await self.set(key, value, ttl)
+        return value
+
+    async def close(self):
+        try:
+            await self.backend.close()
+        except Exception as e:
+            logger.error(f"Cache close error: {e}")
+
+
+# Глобальный экземпляр
+cache = Cache(CACHE_URL)
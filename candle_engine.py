@@ -0,0 +1,175 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+
+import numpy as np
+
+from moex_api import MoexApiClient
+from candles import CandleSeries
+from clock import clock
+from singleflight import SingleFlight
+from config import CANDLE_BASE_INTERVAL, CANDLE_HISTORY_DAYS, CANDLE_SESSION_ANCHOR_HOUR
+
+logger = logging.getLogger(__name__)
+
+# Таймфреймы, которые строятся из загруженных свечей (минуты)
+TIMEFRAMES = {
+    '1m': 1,
+    '10m': 10,
+    '1h': 60,
+    '4h': 240,
+    '1d': 1440,
+}
+
+# Интервалы ISS в минутах (24 — дневные свечи)
+ISS_INTERVAL_MINUTES = {1: 1, 10: 10, 60: 60, 24: 1440}
+
+_refresh_flight = SingleFlight('candle_engine.refresh')
+
+
+def bucket_starts(times: np.ndarray, minutes: int) -> np.ndarray:
+    """
+    Начала баров таймфрейма, в которые попадают моменты times (datetime64).
+
+    Дневной бар — календарный день (как дневные свечи ISS, с вечерней сессией).
+    Внутридневные бары отсчитываются от CANDLE_SESSION_ANCHOR_HOUR: часовые
+    совпадают с часовыми свечами ISS, 4h — 06/10/14/18/22, так что утренняя
+    сессия не смешивается с основной.
+    """
+    days = times.astype('datetime64[D]')
+    if minutes >= 1440:
+        return days.astype('datetime64[s]')
+
+    anchor = days.astype('datetime64[m]') + np.timedelta64(CANDLE_SESSION_ANCHOR_HOUR * 60, 'm')
+    moments = times.astype('datetime64[m]')
+    offset = (moments - anchor).astype(np.int64) % minutes
+    return (moments - offset.astype('timedelta64[m]')).astype('datetime64[s]')
+
+
+def bucket_start(moment: datetime, minutes: int) -> datetime:
+    """Начало бара таймфрейма, в который попадает moment"""
+    return bucket_starts(np.array([moment], dtype='datetime64[s]'), minutes)[0].astype(datetime)
+
+
+@dataclass
+class TickerCandles:
+    """Свечи одной акции: загруженные из ISS и построенные из них бары старших таймфреймов"""
+    base: CandleSeries = field(default_factory=CandleSeries.empty)
+    derived: Dict[int, CandleSeries] = field(default_factory=dict)
+
+
+class CandleEngine:
+    """
+    Свечи нескольких таймфреймов из одного потока ISS.
+
+    С MOEX загружается только базовый интервал (CANDLE_BASE_INTERVAL): первый
+    раз за CANDLE_HISTORY_DAYS, дальше догрузка с даты последней свечи.
+    Часовые, 4-часовые и дневные бары собираются локально и при догрузке
+    пересчитываются только начиная с бара, в который попала первая
+    изменившаяся свеча. Состояние заводится на тикер при первом обращении,
+    таймфрейм — при первом запросе.
+    """
+
+    def __init__(
+        self,
+        moex_client: Optional[MoexApiClient] = None,
+        base_interval: int = CANDLE_BASE_INTERVAL,
+        history_days: int = CANDLE_HISTORY_DAYS
+    ):
+        if base_interval not in ISS_INTERVAL_MINUTES:
+            raise ValueError(f"Unsupported ISS candle interval: {base_interval}")
+
+        self.moex_client = moex_client or MoexApiClient()
+        self.base_interval = base_interval
+        self.base_minutes = ISS_INTERVAL_MINUTES[base_interval]
+        self.history_days = history_days
+        self._tickers: Dict[str, TickerCandles] = {}
+
+    def supports(self, timeframe: str) -> bool:
+        """Таймфрейм можно построить из базового интервала"""
+        minutes = TIMEFRAMES.get(timeframe)
+        return minutes is not None and minutes >= self.base_minutes and minutes % self.base_minutes == 0
+
+    async def get_candles(self, ticker: str, timeframe: str = '1h') -> Optional[CandleSeries]:
+        """Догрузка свечей и бары таймфрейма"""
+        if not await self.refresh(ticker):
+            return None
+        return self.candles(ticker, timeframe)
+
+    async def refresh(self, ticker: str) -> bool:
+        """Догрузка базовых свечей из ISS (одна на тикер одновременно)"""
+        return await _refresh_flight.do((id(self), ticker), lambda: self._refresh(ticker))
+
+    def candles(self, ticker: str, timeframe: str) -> Optional[CandleSeries]:
+        """Бары таймфрейма по уже загруженным свечам (без запросов к ISS)"""
+        state = self._tickers.get(ticker)
+        if state is None or not len(state.base):
+            return None
+        if not self.supports(timeframe):
+            raise ValueError(f"Timeframe {timeframe} can't be built from {self.base_minutes}-minute candles")
+
+        minutes = TIMEFRAMES[timeframe]
+        if minutes == self.base_minutes:
+            return state.base
+
+        bars = state.derived.get(minutes)
+        if bars is None:
+            bars = state.derived[minutes] = self._aggregate(state.base, minutes)
+        return bars
+
+    async def _refresh(self, ticker: str) -> bool:
+        state = self._tickers.get(ticker)
+        today = clock.now().date()
+        since = state.base.datetime_at(-1).date() if state and len(state.base) else today - timedelta(days=self.history_days)
+
+        candles = await self.moex_client.get_candles_range(ticker, since, today, self.base_interval)
+        if not candles:
+            return bool(state and len(state.base))
+
+        if state is None:
+            state = self._tickers[ticker] = TickerCandles()
+        self._merge(state, candles)
+        self._prune(state, today - timedelta(days=self.history_days))
+        return True
+
+    def _merge(self, state: TickerCandles, candles: CandleSeries):
+        """Новые свечи вместо хвоста с той же даты и пересчёт затронутых баров"""
+        changed = int(np.searchsorted(state.base.time, candles.time[0]))
+        state.base = state.base.merge(candles)
+
+        for minutes, bars in list(state.derived.items()):
+            # Бары с того, в который попала первая изменившаяся свеча, собираются заново
+            start = bucket_starts(state.base.time[changed:changed + 1], minutes)[0]
+            index = np.searchsorted(state.base.time, start)
+            keep = np.searchsorted(bars.time, start)
+            state.derived[minutes] = bars[:keep].append(self._aggregate(state.base[index:], minutes))
+
+    @staticmethod
+    def _aggregate(base: CandleSeries, minutes: int) -> CandleSeries:
+        """Бары таймфрейма из базовых свечей: границы баров и reduceat по колонкам"""
+        if not len(base):
+            return CandleSeries.empty()
+
+        buckets = bucket_starts(base.time, minutes)
+        first = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        last = np.r_[first[1:], len(buckets)] - 1
+        return CandleSeries(
+            time=buckets[first],
+            open=base.open[first],
+            high=np.maximum.reduceat(base.high, first),
+            low=np.minimum.reduceat(base.low, first),
+            close=base.close[last],
+            volume=np.add.reduceat(base.volume, first)
+        )
+
+    @staticmethod
+    def _prune(state: TickerCandles, since):
+        """Свечи старше окна истории больше не нужны"""
+        state.base = state.base.since(since)
+        for minutes, bars in list(state.derived.items()):
+            state.derived[minutes] = bars.since(since)
+
+
+# Глобальный экземпляр: свечи общие для монитора, карточек в Telegram и дашборда
+candle_engine = CandleEngine()
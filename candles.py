@@ -0,0 +1,156 @@
+from datetime import datetime
+from typing import List, Dict, Any, Sequence, Iterable
+
+import numpy as np
+
+# Колонки блока candles ISS в порядке по умолчанию
+ISS_CANDLE_COLUMNS = ('open', 'close', 'high', 'low', 'value', 'volume', 'begin', 'end')
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class CandleSeries:
+    """
+    Свечи колонками: open/high/low/close — float64, volume — int64,
+    time — datetime64[s] (начало свечи).
+
+    Срез возвращает представление тех же массивов без копирования, поэтому
+    окна (последние MAX_CANDLES свечей, история до точки бэкфила) бесплатны.
+    append и concat копируют: колонки всегда непрерывные, индикаторы
+    считаются по ним напрямую.
+    """
+
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, time, open, high, low, close, volume):
+        self.time = np.asarray(time, dtype='datetime64[s]')
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.int64)
+
+    @classmethod
+    def empty(cls) -> 'CandleSeries':
+        return cls([], [], [], [], [], [])
+
+    @classmethod
+    def from_iss(
+        cls,
+        rows: Sequence[Sequence[Any]],
+        columns: Sequence[str] = ISS_CANDLE_COLUMNS,
+        volume: str = 'volume'
+    ) -> 'CandleSeries':
+        """
+        Строки блока candles ISS → колонки (без промежуточных словарей).
+
+        volume — колонка объёма: у индексов ISS объём в штуках нулевой,
+        для них берётся оборот 'value'.
+        """
+        if not rows:
+            return cls.empty()
+
+        table = np.array(rows, dtype=object)
+        index = {name: i for i, name in enumerate(columns)}
+        return cls(
+            time=table[:, index['begin']].astype('datetime64[s]'),
+            open=table[:, index['open']].astype(np.float64),
+            high=table[:, index['high']].astype(np.float64),
+            low=table[:, index['low']].astype(np.float64),
+            close=table[:, index['close']].astype(np.float64),
+            volume=table[:, index[volume]].astype(np.float64)
+        )
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict[str, Any]]) -> 'CandleSeries':
+        """Список словарей свечей (файловый кэш бэктеста) → колонки"""
+        return cls(
+            time=[record['time'] for record in records],
+            open=[record['open'] for record in records],
+            high=[record['high'] for record in records],
+            low=[record['low'] for record in records],
+            close=[record['close'] for record in records],
+            volume=[record['volume'] for record in records]
+        )
+
+    @classmethod
+    def concat(cls, parts: Iterable['CandleSeries']) -> 'CandleSeries':
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in cls.__slots__))
+
+    def append(self, other: 'CandleSeries') -> 'CandleSeries':
+        """Новая серия: свечи other после свечей этой (с копированием)"""
+        return CandleSeries.concat([self, other])
+
+    def merge(self, other: 'CandleSeries') -> 'CandleSeries':
+        """Свечи other вместо хвоста, начиная с первой свечи other (догрузка из ISS)"""
+        if not len(other):
+            return self
+        keep = np.searchsorted(self.time, other.time[0])
+        return self[:keep].append(other)
+
+    def take(self, indices: np.ndarray) -> 'CandleSeries':
+        """Свечи по индексам (с копированием)"""
+        return CandleSeries(*(getattr(self, name)[indices] for name in self.__slots__))
+
+    def copy(self) -> 'CandleSeries':
+        """Копия колонок (перед изменением свечей на месте)"""
+        return CandleSeries(*(getattr(self, name).copy() for name in self.__slots__))
+
+    def since(self, moment) -> 'CandleSeries':
+        """Свечи, начавшиеся не раньше moment (представление)"""
+        return self[np.searchsorted(self.time, np.datetime64(moment, 's')):]
+
+    def until(self, moment) -> 'CandleSeries':
+        """Свечи, начавшиеся не позже moment (представление)"""
+        return self[:np.searchsorted(self.time, np.datetime64(moment, 's'), side='right')]
+
+    def __len__(self) -> int:
+        return len(self.close)
+
+    def __getitem__(self, index: slice) -> 'CandleSeries':
+        if not isinstance(index, slice):
+            raise TypeError("CandleSeries supports slices only, use record(i) for a single candle")
+        return CandleSeries(*(getattr(self, name)[index] for name in self.__slots__))
+
+    def __repr__(self) -> str:
+        if not len(self):
+            return "CandleSeries(empty)"
+        return f"CandleSeries({len(self)} candles {self.time_str(0)} .. {self.time_str(-1)})"
+
+    @property
+    def dates(self) -> np.ndarray:
+        """Календарные даты свечей (datetime64[D])"""
+        return self.time.astype('datetime64[D]')
+
+    @property
+    def last_close(self) -> float:
+        return float(self.close[-1])
+
+    def datetime_at(self, i: int) -> datetime:
+        return self.time[i].astype(datetime)
+
+    def time_str(self, i: int) -> str:
+        """Время начала свечи в формате ISS ('YYYY-MM-DD HH:MM:SS')"""
+        return self.datetime_at(i).strftime(TIME_FORMAT)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Колонки словарём: time, open, high, low, close, volume"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """Одна свеча словарём (логи, JSON)"""
+        return {
+            'open': float(self.open[i]),
+            'close': float(self.close[i]),
+            'high': float(self.high[i]),
+            'low': float(self.low[i]),
+            'volume': int(self.volume[i]),
+            'time': self.time_str(i)
+        }
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Свечи списком словарей (файловый кэш бэктеста)"""
+        return [self.record(i) for i in range(len(self))]
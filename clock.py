@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Clock:
+    """
+    Текущее время для логики бота.
+
+    По умолчанию — системное. replay.py переключает часы на виртуальное время:
+    оно начинается с заданного момента и идёт в speed раз быстрее реального,
+    так что монитор сигналов, позиции и проверка часов работы биржи живут
+    во времени воспроизводимых данных.
+    """
+
+    def __init__(self):
+        self._origin: Optional[datetime] = None
+        self._origin_monotonic = 0.0
+        self.speed = 1.0
+
+    @property
+    def is_virtual(self) -> bool:
+        return self._origin is not None
+
+    def now(self) -> datetime:
+        if self._origin is None:
+            return datetime.now()
+        elapsed = (time.monotonic() - self._origin_monotonic) * self.speed
+        return self._origin + timedelta(seconds=elapsed)
+
+    def start_virtual(self, moment: datetime, speed: float = 1.0):
+        """Виртуальное время с момента moment, ускоренное в speed раз"""
+        self.speed = speed
+        self.set(moment)
+        logger.info(f"🕰️ Virtual clock at {moment} (x{speed:g})")
+
+    def set(self, moment: datetime):
+        """Перевод виртуальных часов (скорость сохраняется)"""
+        self._origin = moment
+        self._origin_monotonic = time.monotonic()
+
+    def reset(self):
+        """Возврат к системному времени"""
+        self._origin = None
+        self.speed = 1.0
+
+    async def sleep_until(self, moment: datetime):
+        """Ожидание момента по этим часам (в виртуальном режиме — в speed раз быстрее)"""
+        delay = (moment - self.now()).total_seconds() / self.speed
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Глобальный экземпляр часов
+clock = Clock()
@@ -13,18 +13,40 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 # OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# LLM бэкенд: 'openai' (OpenAI или совместимый сервер по OPENAI_BASE_URL) или 'stub' (заглушка без сети)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # Например, http://localhost:8100/v1 для llm_stub_server.py
+
+# Заглушка LLM (LLM_BACKEND=stub и llm_stub_server.py)
+LLM_STUB_LATENCY_SECONDS = float(os.getenv('LLM_STUB_LATENCY_SECONDS', '1.0'))
+LLM_STUB_JITTER_SECONDS = float(os.getenv('LLM_STUB_JITTER_SECONDS', '0.2'))
+LLM_STUB_ERROR_RATE = float(os.getenv('LLM_STUB_ERROR_RATE', '0'))
+LLM_STUB_CHUNK_DELAY_SECONDS = float(os.getenv('LLM_STUB_CHUNK_DELAY_SECONDS', '0.05'))
+
 if not TELEGRAM_TOKEN:
     raise ValueError("Missing TELEGRAM_TOKEN environment variable")
 
 if not DATABASE_URL:
     raise ValueError("Missing DATABASE_URL environment variable")
 
-if not OPENAI_API_KEY:
+if not OPENAI_API_KEY and LLM_BACKEND == 'openai' and not OPENAI_BASE_URL:
     raise ValueError("Missing OPENAI_API_KEY environment variable")
 
+# Режим бота: 'polling' (отдельный процесс) или 'webhook' (бот внутри web_dashboard.py, один процесс)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес сервера, например https://kotenok.example.com
+WEBHOOK_PATH = '/telegram/webhook'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '16'))  # Апдейтов обрабатывается параллельно
+
+if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+    raise ValueError("Missing WEBHOOK_URL environment variable (required for BOT_MODE=webhook)")
+
 # MOEX API настройки
-MOEX_BASE_URL = "https://iss.moex.com/iss"
+MOEX_BASE_URL = os.getenv('MOEX_BASE_URL', "https://iss.moex.com/iss")  # Например, http://localhost:8200/iss для moex_stub_server.py
+MOEX_FIXTURES_DIR = os.getenv('MOEX_FIXTURES_DIR', 'data/moex_fixtures')  # Записанные ответы ISS для moex_stub_server.py
 MOEX_TIMEOUT = 10
+MOEX_CANDLES_PAGE_SIZE = int(os.getenv('MOEX_CANDLES_PAGE_SIZE', '500'))  # Свечей в странице ответа ISS (у заменителя задаётся --page-size)
 
 # Технические индикаторы
 DEFAULT_ADX_PERIOD = 14
@@ -32,17 +54,99 @@ DEFAULT_EMA_PERIOD = 20
 HISTORY_DAYS = 10
 MAX_CANDLES = 50
 
+# Свечной движок (candle_engine.py): из ISS загружается один интервал, старшие таймфреймы строятся локально
+CANDLE_BASE_INTERVAL = int(os.getenv('CANDLE_BASE_INTERVAL', '10'))  # Интервал ISS: 1, 10 или 60 минут
+CANDLE_HISTORY_DAYS = 30  # Глубина хранимой истории (50 баров 4h — около двух недель торгов)
+CANDLE_SESSION_ANCHOR_HOUR = 10  # Внутридневные бары отсчитываются от начала основной сессии
+SIGNAL_TIMEFRAME = '1h'  # Таймфрейм индикаторов сигнала
+HTF_CONFIRMATION_TIMEFRAME = os.getenv('HTF_CONFIRMATION_TIMEFRAME') or None  # Например '4h'; без него вход не подтверждается
+
 # Пороговые значения для сигналов
 ADX_THRESHOLD = 25
 DI_PLUS_THRESHOLD = 25
 
+# Правила сигналов (rules.py). Ключ — имя правила, под ним состояние хранится в signal_states.
+# signals проверяются по порядку: сигнал правила — первый выполненный, иначе NONE.
+# В выражениях: adx, di_plus, di_minus, ema20, price; htf_adx, htf_di_plus, htf_di_minus и has_htf
+# (старший таймфрейм); ADX_THRESHOLD и DI_PLUS_THRESHOLD; and/or/not, сравнения, + - * /, abs/min/max;
+# crosses_above(a, b) и crosses_below(a, b) — пересечение с прошлой проверки (по adx, di_plus,
+# di_minus, price из signal_states). entry/exit — сигналы открытия и закрытия позиции:
+# позициями, Stop Loss и доливками управляет правило LONG, остальные правила только уведомляют
+# (включаются через SIGNAL_RULES_ENABLED: SHORT-вход совпадает с LONG SELL и даст второе уведомление).
+SIGNAL_RULES = {
+    'LONG': {
+        'entry': 'BUY',
+        'exit': 'SELL',
+        'signals': [
+            ['BUY', 'adx > ADX_THRESHOLD and di_minus > DI_PLUS_THRESHOLD and (not has_htf or htf_di_minus > htf_di_plus)'],
+            ['SELL', 'adx > ADX_THRESHOLD and di_plus > DI_PLUS_THRESHOLD and di_minus <= DI_PLUS_THRESHOLD'],
+        ],
+    },
+    'SHORT': {
+        'entry': 'SHORT',
+        'exit': 'COVER',
+        'signals': [
+            ['SHORT', 'adx > ADX_THRESHOLD and di_plus > DI_PLUS_THRESHOLD and di_minus <= DI_PLUS_THRESHOLD '
+                      'and (not has_htf or htf_di_plus > htf_di_minus)'],
+            ['COVER', 'adx > ADX_THRESHOLD and di_minus > DI_PLUS_THRESHOLD'],
+        ],
+    },
+}
+SIGNAL_RULES_FILE = os.getenv('SIGNAL_RULES_FILE')  # JSON того же вида вместо SIGNAL_RULES
+SIGNAL_RULES_ENABLED = os.getenv('SIGNAL_RULES_ENABLED', 'LONG').split(',')  # Правила, которые считает монитор (SHORT — LONG,SHORT)
+
 # Мониторинг
 MONITOR_INTERVAL_MINUTES = 20
 
+# Сканер рынка по всем акциям TQBR (market_scanner.py)
+SCANNER_MIN_TURNOVER = 20_000_000  # Минимальный оборот за день (VALTODAY), ₽
+SCANNER_MAX_INSTRUMENTS = 300  # Самых ликвидных акций в скане
+SCANNER_CONCURRENCY = 10  # Одновременных запросов свечей к MOEX
+SCANNER_TOP_N = 10  # Строк рейтинга в Telegram
+SCANNER_TICK_BUDGET_SECONDS = 60  # Дольше — предупреждение в логе
+SCANNER_CACHE_TTL_SECONDS = MONITOR_INTERVAL_MINUTES * 60  # Скан в общем кэше живёт до следующего
+
+# Кэш снимков рынка для карточек акций в Telegram
+SNAPSHOT_REFRESH_AFTER_SECONDS = 60  # Старше — отдаём и обновляем в фоне
+SNAPSHOT_MAX_STALE_SECONDS = 30 * 60  # Старше — обновляем синхронно
+
+# Веб-дашборд
+CHART_MAX_POINTS = 300  # Максимум точек на серию графика (LTTB)
+CHART_MAX_POINTS_LIMIT = 2000  # Верхняя граница для параметра points в API
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))  # Количество воркеров uvicorn
+WEB_PORT = int(os.getenv('PORT', '8000'))
+
+# Общий кэш (Redis-совместимый URL; без него — кэш в памяти процесса)
+CACHE_URL = os.getenv('CACHE_URL')
+CACHE_MEMORY_MAX_ITEMS = 1000  # Ключей в кэше процесса без Redis (LRU)
+CACHE_MEMORY_SWEEP_SECONDS = 60  # Как часто вычищать истёкшие ключи из кэша процесса
+DASHBOARD_CACHE_TTL_SECONDS = 30  # Посчитанные секции дашборда
+QUOTE_CACHE_TTL_SECONDS = 20  # Котировки открытых позиций
+
 # OpenAI GPT настройки
 GPT_MODEL = "gpt-5-mini"
 GPT_MAX_TOKENS = 2000  # Увеличено для reasoning
 GPT_TEMPERATURE = 0.7
+GPT_PROMPT_VERSION = 2  # Увеличивать при изменении промптов: инвалидирует кэш анализов
+GPT_PROMPT_TOKEN_BUDGET = 700  # Бюджет на системный + пользовательский промпт (токены)
+GPT_PROMPT_MAX_CANDLES = 20  # Свечей в промпте, если влезают в бюджет
+GPT_PROMPT_MIN_CANDLES = 8  # Меньше не урезаем даже при превышении бюджета
+GPT_TOKENIZER_ENCODING = "o200k_base"  # Кодировка tiktoken для подсчёта токенов
+GPT_MEMORY_CACHE_SIZE = 200  # Анализов в памяти процесса (поверх кэша в PostgreSQL)
+GPT_CACHE_RETENTION_DAYS = 30  # Сколько хранить анализы в PostgreSQL
+GPT_REQUEST_TIMEOUT_SECONDS = 20  # Жёсткий дедлайн запроса к GPT (включая подстраховочный)
+GPT_STREAM_TIMEOUT_SECONDS = 45  # Дедлайн потокового ответа целиком
+GPT_MAX_RETRIES = 1  # Повторы внутри SDK (в пределах дедлайна)
+GPT_CIRCUIT_FAILURE_THRESHOLD = 5  # Ошибок подряд, после которых GPT временно не вызывается
+GPT_CIRCUIT_RESET_SECONDS = 120  # Пауза перед пробным запросом
+GPT_HEDGE_ENABLED = True  # Второй запрос, если первый дольше перцентиля задержки
+GPT_HEDGE_PERCENTILE = 95
+GPT_HEDGE_MIN_SAMPLES = 20  # Без достаточной статистики подстраховка не включается
+GPT_BATCH_MAX_TICKERS = 8  # Тикеров в одном пакетном запросе к GPT
+GPT_BATCH_TOKENS_PER_TICKER = 300  # Запас токенов ответа на каждый тикер пакета
+GPT_STREAM_EDIT_INTERVAL_SECONDS = 1.5  # Не чаще одного редактирования сообщения за интервал (лимиты Telegram)
+GPT_PRECOMPUTE_MARGIN = 3.0  # Заранее считать анализ, если до порога ADX/DI осталось не больше N пунктов
+GPT_PRECOMPUTE_PRICE_MARGIN_PERCENT = 0.5  # ...или цена в N% от уровня доливки
 
 # Мани-менеджмент
 DEPOSIT = 10_000_000  # Депозит в рублях
@@ -51,7 +155,17 @@ STOP_LOSS_PERCENT = 5.0  # Stop Loss в процентах от цены вхо
 AVERAGING_LEVEL_1 = 2.0  # Первая доливка при -2% от входа
 AVERAGING_LEVEL_2 = 4.0  # Вторая доливка при -4% от входа
 
-# Поддерживаемые акции
+# Бэктест (backtest.py)
+BACKTEST_DATA_DIR = os.getenv('BACKTEST_DATA_DIR', 'data/iss')  # Файловый кэш свечей ISS по месяцам
+BACKTEST_DEFAULT_YEARS = 3  # Глубина истории по умолчанию
+OPTIMIZER_RESULTS_DIR = os.getenv('OPTIMIZER_RESULTS_DIR', 'data/optimizer')  # Таблицы результатов optimizer.py
+
+# Реестр инструментов (instruments.py): метаданные акций TQBR из ISS, хранятся в БД
+INSTRUMENTS_REFRESH_HOURS = 24  # Старше — реестр перезагружается из ISS при старте
+INSTRUMENTS_DEFAULT_EMOJI = '📊'
+
+# Избранные акции: меню бота, графики дашборда, тикеры по умолчанию для бэктеста.
+# Название и эмодзи отсюда важнее ISS; остальные метаданные берутся из реестра
 SUPPORTED_STOCKS = {
     'SBER': {
         'name': 'Сбербанк',
@@ -1,36 +1,141 @@
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+from datetime import datetime, timedelta
 
 import asyncpg
 
-from config import DATABASE_URL
+from config import DATABASE_URL, GPT_CACHE_RETENTION_DAYS
+from subscription_index import SubscriptionIndex
+from clock import clock
 
 logger = logging.getLogger(__name__)
 
+# Канал NOTIFY об изменениях подписок (payload: "<id процесса>:add:<user_id>:<ticker>" / "...:remove:...")
+SUBSCRIPTIONS_CHANNEL = 'subscriptions_changed'
+
+# Пауза перед переподключением LISTEN после обрыва
+LISTEN_RECONNECT_SECONDS = 5
+
 
 class Database:
     """Класс для работы с PostgreSQL"""
     
-    def __init__(self):
+    def __init__(self, database_url: str = DATABASE_URL):
+        self.database_url = database_url
         self.pool: Optional[asyncpg.Pool] = None
+        self.subscriptions = SubscriptionIndex()
+        # Свои изменения подписок применяются сразу, их NOTIFY пропускаем:
+        # запоздавший "add" после быстрой отписки вернул бы подписку в индекс
+        self._notify_source = uuid.uuid4().hex
+        self._listen_conn: Optional[asyncpg.Connection] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
     
     async def connect(self):
         """Создание пула подключений"""
         try:
-            self.pool = await asyncpg.create_pool(DATABASE_URL, min_size=2, max_size=10)
+            self.pool = await asyncpg.create_pool(self.database_url, min_size=2, max_size=10)
             logger.info("✅ Connected to PostgreSQL")
             await self._init_schema()
         except Exception as e:
             logger.error(f"❌ Failed to connect to PostgreSQL: {e}")
             raise
+        
+        try:
+            await self._start_subscription_sync()
+        except Exception as e:
+            # Без индекса подписки читаются из БД — работать можно
+            logger.error(f"❌ Failed to start subscription sync: {e}")
+            self._schedule_listen_reconnect()
     
     async def disconnect(self):
         """Закрытие пула подключений"""
+        if self._reconnect_task and not self._reconnect_task.done():
+            self._reconnect_task.cancel()
+        await self._close_listen_connection()
+        self.subscriptions.invalidate()
+        
         if self.pool:
             await self.pool.close()
             logger.info("Disconnected from PostgreSQL")
     
+    # ========== SUBSCRIPTION SYNC ==========
+    
+    async def _start_subscription_sync(self):
+        """LISTEN на изменения подписок и загрузка индекса.
+        
+        Слушать начинаем до чтения снимка: изменения, пришедшие во время
+        загрузки, применяются поверх него.
+        """
+        self.subscriptions.begin_load()
+        
+        self._listen_conn = await asyncpg.connect(self.database_url)
+        await self._listen_conn.add_listener(SUBSCRIPTIONS_CHANNEL, self._on_subscription_notify)
+        self._listen_conn.add_termination_listener(self._on_listen_terminated)
+        
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT user_id, ticker FROM subscriptions")
+        self.subscriptions.finish_load((row['user_id'], row['ticker']) for row in rows)
+    
+    def _on_subscription_notify(self, connection, pid: int, channel: str, payload: str):
+        try:
+            source, op, user_id, ticker = payload.split(':', 3)
+            if source == self._notify_source:
+                return
+            self.subscriptions.apply(op, int(user_id), ticker)
+        except ValueError:
+            logger.warning(f"Invalid subscription notification: {payload}")
+    
+    def _on_listen_terminated(self, connection):
+        logger.warning("⚠️ Subscription LISTEN connection lost, falling back to queries")
+        self.subscriptions.invalidate()
+        self._listen_conn = None
+        self._schedule_listen_reconnect()
+    
+    def _schedule_listen_reconnect(self):
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_listen())
+    
+    async def _reconnect_listen(self):
+        while self.pool is not None and not self.pool.is_closing():
+            await asyncio.sleep(LISTEN_RECONNECT_SECONDS)
+            try:
+                await self._close_listen_connection()
+                await self._start_subscription_sync()
+                logger.info("✅ Subscription sync restored")
+                return
+            except Exception as e:
+                logger.error(f"❌ Subscription sync reconnect failed: {e}")
+    
+    async def _close_listen_connection(self):
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is None or conn.is_closed():
+            return
+        conn.remove_termination_listener(self._on_listen_terminated)
+        await conn.close()
+    
+    async def _notify_subscription(self, conn: asyncpg.Connection, op: str, user_id: int, ticker: str):
+        """Оповещение остальных процессов (доставляется после коммита транзакции)"""
+        await conn.execute(
+            "SELECT pg_notify($1, $2)", SUBSCRIPTIONS_CHANNEL, f"{self._notify_source}:{op}:{user_id}:{ticker}"
+        )
+    
+    @asynccontextmanager
+    async def advisory_lock(self, key: int):
+        """Неблокирующая сессионная advisory-блокировка.
+        
+        Отдаёт True, если блокировка получена; соединение удерживается до выхода из контекста.
+        """
+        async with self.pool.acquire() as conn:
+            acquired = await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", key)
+    
     async def _init_schema(self):
         """Инициализация схемы БД"""
         async with self.pool.acquire() as conn:
@@ -143,7 +248,7 @@ class Database:
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS signal_states (
                     ticker VARCHAR(10) NOT NULL,
-                    signal_type VARCHAR(10) NOT NULL,
+                    signal_type VARCHAR(32) NOT NULL,
                     last_signal VARCHAR(10) NOT NULL,
                     last_adx DECIMAL(5, 2),
                     last_di_plus DECIMAL(5, 2),
@@ -193,6 +298,9 @@ class Database:
                     logger.info("✅ Migration: signal_states migrated successfully")
                 else:
                     logger.info("✅ signal_states already has correct structure")
+                
+                # signal_type — имя правила сигналов (rules.py), может быть длиннее 10 символов
+                await conn.execute("ALTER TABLE signal_states ALTER COLUMN signal_type TYPE VARCHAR(32)")
                     
             except Exception as e:
                 logger.warning(f"Migration warning for signal_states: {e}")
@@ -203,6 +311,10 @@ class Database:
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_user_id ON positions(user_id)")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_is_open ON positions(is_open)")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_position_type ON positions(position_type)")
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_positions_closed_feed
+                ON positions(exit_time DESC, id DESC) WHERE is_open = FALSE
+            """)
             
             # 6. Таблица истории индекса страха и жадности
             await conn.execute("""
@@ -221,8 +333,114 @@ class Database:
                 )
             """)
             
+            # 7. Кэш GPT анализов
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS gpt_analysis_cache (
+                    cache_key VARCHAR(255) PRIMARY KEY,
+                    ticker VARCHAR(10) NOT NULL,
+                    candle_time VARCHAR(32),
+                    prompt_version INTEGER NOT NULL,
+                    analysis TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await conn.execute(
+                "DELETE FROM gpt_analysis_cache WHERE created_at < $1",
+                clock.now() - timedelta(days=GPT_CACHE_RETENTION_DAYS)
+            )
+            
+            # 8. Прогоны бэктеста (backtest.py) и их сделки в формате positions
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS backtest_runs (
+                    id SERIAL PRIMARY KEY,
+                    tickers TEXT NOT NULL,
+                    start_date DATE NOT NULL,
+                    end_date DATE NOT NULL,
+                    trades INTEGER NOT NULL DEFAULT 0,
+                    win_rate DECIMAL(5, 2),
+                    total_profit DECIMAL(16, 2),
+                    return_percent DECIMAL(10, 2),
+                    max_drawdown_percent DECIMAL(10, 2),
+                    exposure_percent DECIMAL(5, 2),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS backtest_positions (
+                    id SERIAL PRIMARY KEY,
+                    run_id INTEGER NOT NULL REFERENCES backtest_runs(id) ON DELETE CASCADE,
+                    ticker VARCHAR(10) NOT NULL,
+                    position_type VARCHAR(10) DEFAULT 'LONG',
+                    entry_price DECIMAL(10, 2) NOT NULL,
+                    entry_time TIMESTAMP NOT NULL,
+                    entry_adx DECIMAL(5, 2),
+                    entry_di_plus DECIMAL(5, 2),
+                    entry_di_minus DECIMAL(5, 2),
+                    lots INTEGER NOT NULL DEFAULT 0,
+                    average_price DECIMAL(10, 2),
+                    averaging_count INTEGER DEFAULT 0,
+                    exit_price DECIMAL(10, 2),
+                    exit_time TIMESTAMP,
+                    exit_reason VARCHAR(16),
+                    profit_percent DECIMAL(10, 2),
+                    is_open BOOLEAN DEFAULT FALSE
+                )
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_backtest_positions_run 
+                ON backtest_positions(run_id, entry_time)
+            """)
+            
+            # 9. Реестр инструментов (метаданные ISS, instruments.py)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS instruments (
+                    ticker VARCHAR(16) PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    full_name TEXT,
+                    lot_size INTEGER NOT NULL DEFAULT 1,
+                    board VARCHAR(12) NOT NULL,
+                    status VARCHAR(4) NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
             logger.info("✅ Database schema initialized")
     
+    # ========== INSTRUMENTS ==========
+    
+    async def get_instruments(self) -> List[Dict[str, Any]]:
+        """Все инструменты реестра"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM instruments ORDER BY ticker")
+            return [dict(row) for row in rows]
+    
+    async def save_instruments(self, instruments: List[Dict[str, Any]]):
+        """Замена реестра свежими метаданными: пропавшие из ISS инструменты помечаются неторгуемыми"""
+        if not instruments:
+            return
+        
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    """
+                    INSERT INTO instruments (ticker, name, full_name, lot_size, board, status, updated_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ON CONFLICT (ticker) DO UPDATE
+                    SET name = EXCLUDED.name, full_name = EXCLUDED.full_name, lot_size = EXCLUDED.lot_size,
+                        board = EXCLUDED.board, status = EXCLUDED.status, updated_at = EXCLUDED.updated_at
+                    """,
+                    [
+                        (item['ticker'], item['name'], item['full_name'], item['lot_size'],
+                         item['board'], item['status'], clock.now())
+                        for item in instruments
+                    ]
+                )
+                await conn.execute(
+                    "UPDATE instruments SET status = 'N' WHERE NOT (ticker = ANY($1::varchar[]))",
+                    [item['ticker'] for item in instruments]
+                )
+        logger.info(f"✅ Saved {len(instruments)} instruments")
+    
     # ========== USERS ==========
     
     async def add_user(self, user_id: int, username: str = None, first_name: str = None):
@@ -244,10 +462,13 @@ class Database:
         """Добавление подписки. Возвращает True если подписка добавлена"""
         try:
             async with self.pool.acquire() as conn:
-                await conn.execute(
-                    "INSERT INTO subscriptions (user_id, ticker) VALUES ($1, $2)",
-                    user_id, ticker
-                )
+                async with conn.transaction():
+                    await conn.execute(
+                        "INSERT INTO subscriptions (user_id, ticker) VALUES ($1, $2)",
+                        user_id, ticker
+                    )
+                    await self._notify_subscription(conn, 'add', user_id, ticker)
+            self.subscriptions.apply('add', user_id, ticker)
             return True
         except asyncpg.UniqueViolationError:
             return False
@@ -255,14 +476,22 @@ class Database:
     async def remove_subscription(self, user_id: int, ticker: str) -> bool:
         """Удаление подписки. Возвращает True если подписка была удалена"""
         async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                "DELETE FROM subscriptions WHERE user_id = $1 AND ticker = $2",
-                user_id, ticker
-            )
+            async with conn.transaction():
+                result = await conn.execute(
+                    "DELETE FROM subscriptions WHERE user_id = $1 AND ticker = $2",
+                    user_id, ticker
+                )
+                if result != "DELETE 0":
+                    await self._notify_subscription(conn, 'remove', user_id, ticker)
+            if result != "DELETE 0":
+                self.subscriptions.apply('remove', user_id, ticker)
             return result != "DELETE 0"
     
     async def get_user_subscriptions(self, user_id: int) -> List[str]:
         """Получение списка подписок пользователя"""
+        if self.subscriptions.loaded:
+            return self.subscriptions.user_tickers(user_id)
+        
         async with self.pool.acquire() as conn:
             rows = await conn.fetch(
                 "SELECT ticker FROM subscriptions WHERE user_id = $1 ORDER BY ticker",
@@ -272,6 +501,9 @@ class Database:
     
     async def is_subscribed(self, user_id: int, ticker: str) -> bool:
         """Проверка подписки"""
+        if self.subscriptions.loaded:
+            return self.subscriptions.is_subscribed(user_id, ticker)
+        
         async with self.pool.acquire() as conn:
             result = await conn.fetchval(
                 "SELECT EXISTS(SELECT 1 FROM subscriptions WHERE user_id = $1 AND ticker = $2)",
@@ -281,6 +513,9 @@ class Database:
     
     async def get_ticker_subscribers(self, ticker: str) -> List[int]:
         """Получение списка подписчиков на акцию"""
+        if self.subscriptions.loaded:
+            return self.subscriptions.ticker_users(ticker)
+        
         async with self.pool.acquire() as conn:
             rows = await conn.fetch(
                 "SELECT user_id FROM subscriptions WHERE ticker = $1",
@@ -290,6 +525,9 @@ class Database:
     
     async def get_all_subscribed_tickers(self) -> List[str]:
         """Получение всех акций, на которые есть подписки"""
+        if self.subscriptions.loaded:
+            return self.subscriptions.tickers()
+        
         async with self.pool.acquire() as conn:
             rows = await conn.fetch(
                 "SELECT DISTINCT ticker FROM subscriptions ORDER BY ticker"
@@ -318,7 +556,7 @@ class Database:
                 VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $4, 0)
                 RETURNING id
                 """,
-                user_id, ticker, position_type, entry_price, datetime.now(), entry_adx, entry_di_plus, entry_di_minus, lots
+                user_id, ticker, position_type, entry_price, clock.now(), entry_adx, entry_di_plus, entry_di_minus, lots
             )
             return position_id
     
@@ -379,7 +617,7 @@ class Database:
             
             await conn.execute(
                 query,
-                user_id, ticker, exit_price, datetime.now(), position_type
+                user_id, ticker, exit_price, clock.now(), position_type
             )
     
     async def get_open_positions(self, user_id: int) -> List[Dict[str, Any]]:
@@ -464,7 +702,73 @@ class Database:
                     last_price = $7,
                     updated_at = $8
                 """,
-                ticker, signal_type, signal, adx, di_plus, di_minus, price, datetime.now()
+                ticker, signal_type, signal, adx, di_plus, di_minus, price, clock.now()
+            )
+    
+    async def get_signal_states(self, tickers: List[str]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Состояния всех правил по тикерам одним запросом: (тикер, правило) → строка"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT * FROM signal_states WHERE ticker = ANY($1::varchar[])",
+                tickers
+            )
+            return {(row['ticker'], row['signal_type']): dict(row) for row in rows}
+    
+    async def update_signal_states(self, states: List[Tuple[str, str, str, float, float, float, float]]):
+        """
+        Состояния сигналов пачкой (один запрос на тик монитора).
+        
+        Элемент: (тикер, правило, сигнал, ADX, DI+, DI-, цена).
+        """
+        if not states:
+            return
+        
+        now = clock.now()
+        async with self.pool.acquire() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO signal_states 
+                (ticker, signal_type, last_signal, last_adx, last_di_plus, last_di_minus, last_price, updated_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                ON CONFLICT (ticker, signal_type) DO UPDATE
+                SET last_signal = EXCLUDED.last_signal,
+                    last_adx = EXCLUDED.last_adx,
+                    last_di_plus = EXCLUDED.last_di_plus,
+                    last_di_minus = EXCLUDED.last_di_minus,
+                    last_price = EXCLUDED.last_price,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [(*state, now) for state in states]
+            )
+    
+    # ========== GPT ANALYSIS CACHE ==========
+    
+    async def get_gpt_analysis(self, cache_key: str) -> Optional[str]:
+        """Закэшированный GPT анализ по ключу"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT analysis FROM gpt_analysis_cache WHERE cache_key = $1",
+                cache_key
+            )
+    
+    async def save_gpt_analysis(
+        self,
+        cache_key: str,
+        ticker: str,
+        candle_time: Optional[str],
+        prompt_version: int,
+        analysis: str
+    ):
+        """Сохранение GPT анализа в кэш"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO gpt_analysis_cache (cache_key, ticker, candle_time, prompt_version, analysis, created_at)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET analysis = $5, created_at = $6
+                """,
+                cache_key, ticker, candle_time, prompt_version, analysis, clock.now()
             )
     
     # ========== FEAR & GREED INDEX ==========
@@ -475,7 +779,7 @@ class Database:
         target_date: date object. Если None - используется сегодняшняя дата.
         """
         if target_date is None:
-            target_date = datetime.now().date()
+            target_date = clock.now().date()
         elif isinstance(target_date, str):
             target_date = datetime.strptime(target_date, '%Y-%m-%d').date()
         
@@ -585,8 +889,19 @@ class Database:
             return dict(row) if row else None
     
     async def get_fear_greed_history(self, days: int = 90) -> List[Dict[str, Any]]:
-        """Получение истории индекса за N дней"""
+        """Получение истории индекса за N дней (days <= 0 — вся история)"""
         async with self.pool.acquire() as conn:
+            if days <= 0:
+                rows = await conn.fetch(
+                    """
+                    SELECT date, value, label, volatility_score, momentum_score,
+                           sma_deviation_score, breadth_score, safe_haven_score, rsi_score
+                    FROM fear_greed_history
+                    ORDER BY date ASC
+                    """
+                )
+                return [dict(row) for row in rows]
+            
             rows = await conn.fetch(
                 """
                 SELECT date, value, label, volatility_score, momentum_score,
@@ -689,30 +1004,49 @@ class Database:
                 )
             return [dict(row) for row in rows]
     
-    async def get_all_closed_positions_web(self, limit: int = 50, username: str = None, position_type: str = None) -> List[Dict[str, Any]]:
-        """Получение всех закрытых позиций для веб-дашборда"""
+    def _closed_positions_web_filter(
+        self,
+        username: str = None,
+        position_type: str = None,
+        before: Optional[Tuple[datetime, int]] = None
+    ) -> Tuple[str, List[Any]]:
+        """WHERE-условие ленты закрытых сделок и его параметры"""
+        where_conditions = ["p.is_open = FALSE"]
+        params = []
+        
+        if username:
+            params.append(username)
+            where_conditions.append(f"u.username = ${len(params)}")
+        
+        if position_type:
+            params.append(position_type)
+            where_conditions.append(f"p.position_type = ${len(params)}")
+        
+        if before:
+            # Keyset-курсор: строки строго после (exit_time, id) в порядке DESC
+            params.extend(before)
+            where_conditions.append(f"(p.exit_time, p.id) < (${len(params) - 1}, ${len(params)})")
+        
+        return " AND ".join(where_conditions), params
+    
+    async def get_all_closed_positions_web(
+        self,
+        limit: int = 50,
+        username: str = None,
+        position_type: str = None,
+        before: Optional[Tuple[datetime, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Получение закрытых позиций для веб-дашборда.
+        
+        before: (exit_time, id) последней показанной сделки — следующая страница ленты.
+        """
         async with self.pool.acquire() as conn:
-            where_conditions = ["p.is_open = FALSE"]
-            params = []
-            param_idx = 1
-            
-            if username:
-                where_conditions.append(f"u.username = ${param_idx}")
-                params.append(username)
-                param_idx += 1
-            
-            if position_type:
-                where_conditions.append(f"p.position_type = ${param_idx}")
-                params.append(position_type)
-                param_idx += 1
-            
+            where_clause, params = self._closed_positions_web_filter(username, position_type, before)
             params.append(limit)
-            limit_param = f"${param_idx}"
-            
-            where_clause = " AND ".join(where_conditions)
             
             query = f"""
                 SELECT 
+                    p.id,
                     p.user_id,
                     COALESCE(u.username, 'unknown') as username,
                     COALESCE(u.first_name, 'Unknown') as first_name,
@@ -722,13 +1056,38 @@ class Database:
                 FROM positions p
                 LEFT JOIN users u ON p.user_id = u.user_id
                 WHERE {where_clause}
-                ORDER BY p.exit_time DESC
-                LIMIT {limit_param}
+                ORDER BY p.exit_time DESC, p.id DESC
+                LIMIT ${len(params)}
             """
             
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
     
+    async def iter_closed_positions_web(
+        self,
+        username: str = None,
+        position_type: str = None,
+        prefetch: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое чтение всех закрытых позиций серверным курсором (для выгрузки в CSV)"""
+        where_clause, params = self._closed_positions_web_filter(username, position_type)
+        
+        query = f"""
+            SELECT 
+                p.id, p.ticker, p.position_type, p.entry_price, p.exit_price,
+                p.profit_percent, p.entry_time, p.exit_time,
+                p.lots, p.average_price, p.averaging_count
+            FROM positions p
+            LEFT JOIN users u ON p.user_id = u.user_id
+            WHERE {where_clause}
+            ORDER BY p.exit_time DESC, p.id DESC
+        """
+        
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(query, *params, prefetch=prefetch):
+                    yield dict(row)
+    
     async def get_global_monthly_statistics(self, year: int, month: int, username: str = None, position_type: str = None) -> Dict[str, Any]:
         """Получение глобальной статистики за месяц"""
         async with self.pool.acquire() as conn:
@@ -1100,6 +1459,70 @@ class Database:
                 'data': result,
                 'start_date': start_date
             }
+    
+    # ========== BACKTEST ==========
+    
+    async def create_backtest_run(self, tickers: List[str], start_date, end_date, metrics: Dict[str, Any]) -> int:
+        """Сохранение сводки прогона бэктеста. Возвращает ID прогона"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                INSERT INTO backtest_runs
+                (tickers, start_date, end_date, trades, win_rate, total_profit,
+                 return_percent, max_drawdown_percent, exposure_percent)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                RETURNING id
+                """,
+                ','.join(tickers), start_date, end_date, metrics['trades'], metrics['win_rate'],
+                metrics['total_profit'], metrics['return_percent'],
+                metrics['max_drawdown_percent'], metrics['exposure_percent']
+            )
+    
+    async def save_backtest_positions(self, run_id: int, positions: List[Dict[str, Any]]):
+        """Пакетное сохранение сделок прогона (COPY)"""
+        if not positions:
+            return
+        
+        columns = [
+            'run_id', 'ticker', 'position_type', 'entry_price', 'entry_time', 'entry_adx',
+            'entry_di_plus', 'entry_di_minus', 'lots', 'average_price', 'averaging_count',
+            'exit_price', 'exit_time', 'exit_reason', 'profit_percent', 'is_open'
+        ]
+        records = [
+            (run_id,) + tuple(
+                round(position[column], 2) if isinstance(position[column], float) else position[column]
+                for column in columns[1:]
+            )
+            for position in positions
+        ]
+        
+        async with self.pool.acquire() as conn:
+            await conn.copy_records_to_table('backtest_positions', records=records, columns=columns)
+        logger.info(f"✅ Saved {len(records)} backtest positions for run {run_id}")
+    
+    async def get_backtest_runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние прогоны бэктеста"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT * FROM backtest_runs ORDER BY created_at DESC LIMIT $1",
+                limit
+            )
+            return [dict(row) for row in rows]
+    
+    async def get_backtest_run(self, run_id: int) -> Optional[Dict[str, Any]]:
+        """Сводка прогона бэктеста"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM backtest_runs WHERE id = $1", run_id)
+            return dict(row) if row else None
+    
+    async def get_backtest_positions(self, run_id: int) -> List[Dict[str, Any]]:
+        """Сделки прогона бэктеста в порядке открытия"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT * FROM backtest_positions WHERE run_id = $1 ORDER BY entry_time",
+                run_id
+            )
+            return [dict(row) for row in rows]
 
 
 # Глобальный экземпляр базы данных
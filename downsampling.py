@@ -0,0 +1,87 @@
+import logging
+from datetime import datetime, date
+from typing import List, Dict, Any, Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets: индексы точек, сохраняющих форму ряда.
+
+    Первая и последняя точки сохраняются всегда, из каждого промежуточного
+    бакета берётся точка с максимальной площадью треугольника.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold <= 2:
+        return [0, n - 1]
+
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Среднее по следующему бакету
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            next_start, next_end = n - 1, n
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        # Текущий бакет
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        max_idx = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                max_idx = j
+
+        indices.append(max_idx)
+        a = max_idx
+
+    indices.append(n - 1)
+    return indices
+
+
+def _to_number(value: Any) -> float:
+    """Приведение оси X (дата, datetime, строка YYYY-MM-DD) к числу"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return float(value.toordinal())
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def downsample(
+    points: List[Dict[str, Any]],
+    max_points: int,
+    x_key: str,
+    y_key: str,
+    x_func: Callable[[Any], float] = _to_number
+) -> List[Dict[str, Any]]:
+    """
+    Прореживание списка точек графика до max_points методом LTTB.
+
+    Если точек меньше лимита, список возвращается без изменений.
+    Остальные поля точек (например, объём) берутся из выбранных точек.
+    """
+    if not max_points or len(points) <= max_points:
+        return points
+
+    xs = [x_func(p[x_key]) for p in points]
+    ys = [float(p[y_key]) for p in points]
+
+    selected = [points[i] for i in lttb_indices(xs, ys, max_points)]
+    logger.debug(f"📉 Downsampled {len(points)} → {len(selected)} points ({y_key})")
+    return selected
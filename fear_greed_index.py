@@ -1,10 +1,12 @@
 import logging
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 
-import httpx
+import numpy as np
 
 from config import MOEX_BASE_URL, MOEX_TIMEOUT
+from moex_api import get_http_client
+from candles import CandleSeries
 
 logger = logging.getLogger(__name__)
 
@@ -102,12 +104,17 @@ class FearGreedIndex:
             logger.error(f"Error calculating Fear & Greed Index: {e}", exc_info=True)
             return None
 
-    async def backfill_history(self, days: int = 180) -> List[Dict[str, Any]]:
+    async def backfill_history(
+        self,
+        days: int = 180,
+        on_progress: Optional[Callable[[int, int], None]] = None
+    ) -> List[Dict[str, Any]]:
         """
         Бэкфил исторических значений индекса за последние N дней.
         
         Использует дневные свечи IMOEX и USD/RUB.
         Breadth исторически недоступен, подставляется нейтральное 50.
+        on_progress(processed, total) вызывается по ходу расчёта точек.
         """
         try:
             # Загружаем побольше свечей чтобы было из чего считать
@@ -121,18 +128,24 @@ class FearGreedIndex:
                 )
                 return []
 
-            usdrub_candles = usdrub_candles or []
+            usdrub_candles = usdrub_candles or CandleSeries.empty()
+            imoex_dates = imoex_candles.dates
+            usdrub_dates = usdrub_candles.dates
 
             # Минимум 130 свечей нужно перед каждой точкой расчёта
             min_candles = 130
             results = []
 
+            total = len(imoex_candles) + 1 - min_candles
             for i in range(min_candles, len(imoex_candles) + 1):
-                slice_candles = imoex_candles[:i]
-                point_date = slice_candles[-1]['date']  # 'YYYY-MM-DD'
+                if on_progress:
+                    on_progress(i - min_candles, total)
+                
+                slice_candles = imoex_candles[:i]  # Представление без копирования
+                point_date = str(imoex_dates[i - 1])  # 'YYYY-MM-DD'
 
                 # USD/RUB до этой даты включительно
-                usdrub_slice = [c for c in usdrub_candles if c['date'] <= point_date]
+                usdrub_slice = usdrub_candles[:np.searchsorted(usdrub_dates, imoex_dates[i - 1], side='right')]
 
                 vol = self._calc_volatility_score(slice_candles)
                 mom = self._calc_momentum_score(slice_candles)
@@ -165,6 +178,9 @@ class FearGreedIndex:
                     },
                 })
 
+            if on_progress:
+                on_progress(total, total)
+            
             results = results[-days:]
             logger.info(f"📊 Backfilled {len(results)} historical F&G values")
             return results
@@ -175,8 +191,8 @@ class FearGreedIndex:
 
     # ========== ЗАГРУЗКА ДАННЫХ ==========
 
-    async def _get_imoex_daily_candles(self, days: int = 200) -> Optional[List[Dict]]:
-        """Дневные свечи индекса IMOEX"""
+    async def _get_imoex_daily_candles(self, days: int = 200) -> Optional[CandleSeries]:
+        """Дневные свечи индекса IMOEX (объём — оборот в рублях)"""
         try:
             to_date = datetime.now()
             from_date = to_date - timedelta(days=days)
@@ -189,27 +205,15 @@ class FearGreedIndex:
                 'iss.meta': 'off',
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                response.raise_for_status()
-                data = response.json()
+            response = await get_http_client().get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
 
             if 'candles' not in data or not data['candles']['data']:
                 logger.error("No IMOEX candle data received")
                 return None
 
-            columns = data['candles']['columns']
-            candles = []
-            for row in data['candles']['data']:
-                candle = dict(zip(columns, row))
-                candles.append({
-                    'open': float(candle['open']),
-                    'close': float(candle['close']),
-                    'high': float(candle['high']),
-                    'low': float(candle['low']),
-                    'volume': float(candle['value']),
-                    'date': candle['begin'][:10],
-                })
+            candles = CandleSeries.from_iss(data['candles']['data'], data['candles']['columns'], volume='value')
 
             logger.info(f"IMOEX: loaded {len(candles)} daily candles")
             return candles
@@ -218,7 +222,7 @@ class FearGreedIndex:
             logger.error(f"Error fetching IMOEX candles: {e}")
             return None
 
-    async def _get_usdrub_daily_candles(self, days: int = 30) -> Optional[List[Dict]]:
+    async def _get_usdrub_daily_candles(self, days: int = 30) -> Optional[CandleSeries]:
         """Дневные свечи USD/RUB"""
         try:
             to_date = datetime.now()
@@ -235,26 +239,15 @@ class FearGreedIndex:
                 'iss.meta': 'off',
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                response.raise_for_status()
-                data = response.json()
+            response = await get_http_client().get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
 
             if 'candles' not in data or not data['candles']['data']:
                 logger.error("No USD/RUB candle data received")
                 return None
 
-            columns = data['candles']['columns']
-            candles = []
-            for row in data['candles']['data']:
-                candle = dict(zip(columns, row))
-                candles.append({
-                    'open': float(candle['open']),
-                    'close': float(candle['close']),
-                    'high': float(candle['high']),
-                    'low': float(candle['low']),
-                    'date': candle['begin'][:10],
-                })
+            candles = CandleSeries.from_iss(data['candles']['data'], data['candles']['columns'])
 
             logger.info(f"USD/RUB: loaded {len(candles)} daily candles")
             return candles
@@ -274,10 +267,9 @@ class FearGreedIndex:
                 'iss.meta': 'off',
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                response.raise_for_status()
-                data = response.json()
+            response = await get_http_client().get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
 
             if 'marketdata' not in data or not data['marketdata']['data']:
                 logger.warning("No marketdata in breadth response")
@@ -325,23 +317,19 @@ class FearGreedIndex:
 
     # ========== РАСЧЁТ КОМПОНЕНТОВ ==========
 
-    def _calc_volatility_score(self, candles: List[Dict]) -> float:
+    def _calc_volatility_score(self, candles: CandleSeries) -> float:
         """
         Волатильность (0-100, 100 = жадность/низкая вол, 0 = страх/высокая вол).
         Сравнение 20-дневной волатильности с 90-дневной.
         """
-        closes = [c['close'] for c in candles]
-        returns = [(closes[i] - closes[i - 1]) / closes[i - 1] for i in range(1, len(closes))]
+        closes = candles.close[-91:]
+        returns = np.diff(closes) / closes[:-1]
 
         if len(returns) < 90:
             return 50.0
 
-        def std(values):
-            mean = sum(values) / len(values)
-            return (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5
-
-        vol_20 = std(returns[-20:])
-        vol_90 = std(returns[-90:])
+        vol_20 = float(returns[-20:].std())
+        vol_90 = float(returns[-90:].std())
 
         if vol_90 == 0:
             return 50.0
@@ -354,7 +342,7 @@ class FearGreedIndex:
         score = 100 - (ratio - 0.5) * (100 / 1.5)
         return max(0.0, min(100.0, score))
 
-    def _calc_momentum_score(self, candles: List[Dict]) -> float:
+    def _calc_momentum_score(self, candles: CandleSeries) -> float:
         """
         Моментум / объёмы (0-100).
         Высокий объём на росте = жадность, на падении = страх.
@@ -362,34 +350,34 @@ class FearGreedIndex:
         if len(candles) < 90:
             return 50.0
 
-        closes = [c['close'] for c in candles]
-        volumes = [c['volume'] for c in candles]
+        closes = candles.close
+        volumes = candles.volume
 
-        avg_vol_5 = sum(volumes[-5:]) / 5
-        avg_vol_90 = sum(volumes[-90:]) / 90
+        avg_vol_5 = float(volumes[-5:].mean())
+        avg_vol_90 = float(volumes[-90:].mean())
 
         if avg_vol_90 == 0:
             return 50.0
 
         vol_ratio = avg_vol_5 / avg_vol_90
 
-        price_return = (closes[-1] - closes[-6]) / closes[-6]
+        price_return = float((closes[-1] - closes[-6]) / closes[-6])
 
         score = 50 + price_return * 500 * min(vol_ratio, 2.0)
         return max(0.0, min(100.0, score))
 
-    def _calc_sma_deviation_score(self, candles: List[Dict]) -> float:
+    def _calc_sma_deviation_score(self, candles: CandleSeries) -> float:
         """
         Отклонение от SMA-125 (0-100).
         Выше SMA = жадность, ниже = страх.
         """
-        closes = [c['close'] for c in candles]
+        closes = candles.close
 
         if len(closes) < 125:
             return 50.0
 
-        sma_125 = sum(closes[-125:]) / 125
-        current_price = closes[-1]
+        sma_125 = float(closes[-125:].mean())
+        current_price = float(closes[-1])
         deviation = (current_price - sma_125) / sma_125 * 100
 
         # -10% → 0, 0% → 50, +10% → 100
@@ -411,7 +399,7 @@ class FearGreedIndex:
         rising = sum(1 for change in breadth_data.values() if change > 0)
         return (rising / total) * 100
 
-    def _calc_safe_haven_score(self, usdrub_candles: Optional[List[Dict]]) -> float:
+    def _calc_safe_haven_score(self, usdrub_candles: Optional[CandleSeries]) -> float:
         """
         Safe Haven — USD/RUB (0-100).
         Рубль слабеет (USD растёт) = страх, укрепляется = жадность.
@@ -419,8 +407,8 @@ class FearGreedIndex:
         if not usdrub_candles or len(usdrub_candles) < 6:
             return 50.0
 
-        current = usdrub_candles[-1]['close']
-        past = usdrub_candles[-6]['close']
+        current = float(usdrub_candles.close[-1])
+        past = float(usdrub_candles.close[-6])
         change = (current - past) / past * 100
 
         # +5% (рубль упал) → 0 (страх)
@@ -429,22 +417,19 @@ class FearGreedIndex:
         score = 50 - change * 10
         return max(0.0, min(100.0, score))
 
-    def _calc_rsi_score(self, candles: List[Dict]) -> float:
+    def _calc_rsi_score(self, candles: CandleSeries) -> float:
         """
         RSI(14) индекса IMOEX (0-100).
         RSI < 30 → 0 (страх), RSI > 70 → 100 (жадность).
         """
-        closes = [c['close'] for c in candles]
+        closes = candles.close
 
         if len(closes) < 15:
             return 50.0
 
-        gains = []
-        losses = []
-        for i in range(1, len(closes)):
-            diff = closes[i] - closes[i - 1]
-            gains.append(max(0, diff))
-            losses.append(max(0, -diff))
+        diff = np.diff(closes)
+        gains = np.maximum(diff, 0).tolist()
+        losses = np.maximum(-diff, 0).tolist()
 
         period = 14
         if len(gains) < period:
@@ -3,7 +3,16 @@ from typing import List, Dict, Any
 from datetime import datetime
 
 from models import StockData, Signal
-from config import SUPPORTED_STOCKS
+from instruments import instruments
+from config import ADX_THRESHOLD, DI_PLUS_THRESHOLD
+
+SIGNAL_EMOJI = {
+    'BUY': '🟢',
+    'SELL': '🔴',
+    'SHORT': '🔻',
+    'COVER': '🔺',
+    'NONE': '⚪'
+}
 
 
 class MessageFormatter:
@@ -12,19 +21,12 @@ class MessageFormatter:
     @staticmethod
     def format_stock_message(stock_data: StockData) -> str:
         """Форматирование информации об акции"""
-        stock_info = SUPPORTED_STOCKS.get(stock_data.info.ticker, {})
-        stock_name = stock_info.get('name', stock_data.info.ticker)
-        stock_emoji = stock_info.get('emoji', '📊')
+        stock_name = instruments.name(stock_data.info.ticker)
+        stock_emoji = instruments.emoji(stock_data.info.ticker)
         
         long_signal = stock_data.signals.get('LONG')
         
-        signal_emoji = {
-            'BUY': '🟢',
-            'SELL': '🔴',
-            'NONE': '⚪'
-        }
-        
-        long_emoji = signal_emoji.get(long_signal.signal_type.value, '⚪')
+        long_emoji = SIGNAL_EMOJI.get(long_signal.signal_type.value, '⚪')
         long_text = long_signal.signal_type.value
         
         message = (
@@ -34,7 +36,23 @@ class MessageFormatter:
             f"• ADX: {stock_data.technical.adx:.2f}\n"
             f"• DI+: {stock_data.technical.di_plus:.2f}\n"
             f"• DI-: {stock_data.technical.di_minus:.2f}\n\n"
-            f"🎯 <b>Сигнал LONG:</b> {long_emoji} {long_text}\n\n"
+        )
+        
+        htf = stock_data.htf_technical
+        if htf is not None:
+            message += (
+                f"📐 <b>Старший ТФ ({stock_data.htf_timeframe}):</b> "
+                f"ADX {htf.adx:.2f} | DI+ {htf.di_plus:.2f} | DI- {htf.di_minus:.2f}\n\n"
+            )
+        
+        message += f"🎯 <b>Сигнал LONG:</b> {long_emoji} {long_text}\n"
+        for rule, signal in stock_data.signals.items():
+            if rule != 'LONG':
+                rule_emoji = SIGNAL_EMOJI.get(signal.signal_type.value, '⚪')
+                message += f"🎯 <b>Сигнал {rule}:</b> {rule_emoji} {signal.signal_type.value}\n"
+        
+        message += (
+            f"\n"
             f"📋 <b>Условия LONG:</b>\n"
             f"✅ ВХОД LONG: ADX > 25 AND DI- > 25\n"
             f"✅ ВЫХОД LONG: ADX > 25 AND DI+ > 25\n"
@@ -73,6 +91,39 @@ class MessageFormatter:
         
         return message
     
+    @staticmethod
+    def format_rule_signal_notification(
+        signal: Signal,
+        rule: str,
+        is_entry: bool,
+        stock_name: str,
+        stock_emoji: str,
+        gpt_analysis: str = None
+    ) -> str:
+        """Уведомление о сигнале правила без позиции (SHORT/COVER и т.д.)"""
+        signal_type = signal.signal_type.value
+        title = f"СИГНАЛ {signal_type}" if signal_type == rule else f"СИГНАЛ {signal_type} ({rule})"
+        
+        message = (
+            f"{SIGNAL_EMOJI.get(signal_type, '⚪')} <b>{title}!</b>\n\n"
+            f"{stock_emoji} <b>{signal.ticker} - {stock_name}</b>\n\n"
+            f"💰 <b>Цена:</b> {signal.price:.2f} ₽\n\n"
+            f"📈 <b>Индикаторы:</b>\n"
+            f"• ADX: {signal.adx:.2f}\n"
+            f"• DI+: {signal.di_plus:.2f}\n"
+            f"• DI-: {signal.di_minus:.2f}"
+        )
+        
+        if gpt_analysis:
+            import html
+            gpt_analysis_escaped = html.escape(gpt_analysis)
+            message += f"\n\n🤖 <b>GPT АНАЛИЗ:</b>\n{gpt_analysis_escaped}"
+        
+        action = "вход" if is_entry else "выход"
+        message += f"\n\nℹ️ Сигнал на {action} по правилу {rule}, позиция ботом не ведётся."
+        
+        return message
+    
     @staticmethod
     def format_long_sell_signal_notification(
         signal: Signal, 
@@ -216,7 +267,11 @@ class MessageFormatter:
     @staticmethod
     def format_stocks_selection() -> str:
         """Сообщение для выбора акции"""
-        return "📈 Выберите акцию для анализа:\n\n⭐ - подписка активна"
+        return (
+            "📈 Выберите акцию для анализа:\n\n"
+            "⭐ - подписка активна\n"
+            "🔎 Любую другую акцию TQBR можно найти, отправив её тикер (например, YDEX)"
+        )
     
     @staticmethod
     def format_loading_message() -> str:
@@ -247,9 +302,8 @@ class MessageFormatter:
                 lots = pos.get('lots', 0)
                 averaging_count = pos.get('averaging_count', 0)
                 
-                stock_info = SUPPORTED_STOCKS.get(ticker, {})
-                stock_name = stock_info.get('name', ticker)
-                stock_emoji = stock_info.get('emoji', '📊')
+                stock_name = instruments.name(ticker)
+                stock_emoji = instruments.emoji(ticker)
                 
                 current_price = None
                 profit_percent = 0.0
@@ -300,9 +354,8 @@ class MessageFormatter:
                 lots = pos.get('lots', 0)
                 averaging_count = pos.get('averaging_count', 0)
                 
-                stock_info = SUPPORTED_STOCKS.get(ticker, {})
-                stock_name = stock_info.get('name', ticker)
-                stock_emoji = stock_info.get('emoji', '📊')
+                stock_name = instruments.name(ticker)
+                stock_emoji = instruments.emoji(ticker)
                 
                 profit_emoji = "📈" if profit_percent > 0 else "📉"
                 profit_sign = "+" if profit_percent > 0 else ""
@@ -330,20 +383,72 @@ class MessageFormatter:
     @staticmethod
     def format_subscription_status(ticker: str, is_subscribed: bool) -> str:
         """Статус подписки на акцию"""
-        stock_info = SUPPORTED_STOCKS.get(ticker, {})
-        stock_name = stock_info.get('name', ticker)
-        stock_emoji = stock_info.get('emoji', '📊')
+        stock_name = instruments.name(ticker)
+        stock_emoji = instruments.emoji(ticker)
         
         if is_subscribed:
             return f"✅ Вы подписались на уведомления {stock_emoji} <b>{ticker} - {stock_name}</b>"
         else:
             return f"❌ Вы отписались от уведомлений {stock_emoji} <b>{ticker} - {stock_name}</b>"
     
+    @staticmethod
+    def format_scanner_results(scan: Dict[str, Any], limit: int) -> str:
+        """Рейтинг сетапов LONG по всему рынку из market_scanner"""
+        signal_icons = {'BUY': '🟢', 'SELL': '🔴'}
+        
+        message = (
+            f"🔭 <b>Сканер рынка</b> ({scan['computed_at'].strftime('%H:%M')})\n"
+            f"Акций в скане: {scan['ranked']}\n\n"
+            f"🟢 ВХОД LONG: ADX > {ADX_THRESHOLD} и DI- > {DI_PLUS_THRESHOLD}\n\n"
+        )
+        
+        if not scan['rows']:
+            return message + "Нет данных для рейтинга"
+        
+        for i, row in enumerate(scan['rows'][:limit], 1):
+            icon = signal_icons.get(row['signal'], '⚪')
+            change = f" ({row['change_percent']:+.2f}%)" if row['change_percent'] is not None else ""
+            message += (
+                f"{i}. {icon} <b>{row['ticker']}</b> {row['name']} — {row['price']:.2f} ₽{change}\n"
+                f"    ADX {row['adx']:.1f} | DI+ {row['di_plus']:.1f} | DI- {row['di_minus']:.1f}\n"
+            )
+        
+        return message
+    
     @staticmethod
     def format_error_message(error_text: str) -> str:
         """Сообщение об ошибке"""
         return f"❌ <b>Ошибка:</b> {error_text}"
     
+    @staticmethod
+    def format_rule_based_analysis(
+        price: float,
+        ema20: float,
+        adx: float,
+        di_plus: float,
+        di_minus: float
+    ) -> str:
+        """Комментарий из 3 строк по индикаторам — когда GPT недоступен"""
+        trend = "выше EMA20, рост" if price > ema20 else "ниже EMA20, снижение"
+        support = min(price, ema20) * 0.98
+        resistance = max(price, ema20) * 1.02
+        
+        if adx > ADX_THRESHOLD and di_minus > DI_PLUS_THRESHOLD:
+            signal_line = f"Сигнал на вход — ADX {adx:.0f}, DI- {di_minus:.0f}."
+            action_line = f"ПОКУПАТЬ около {price:.2f}. Цель {resistance:.2f}, стоп {support:.2f}."
+        elif adx > ADX_THRESHOLD and di_plus > DI_PLUS_THRESHOLD:
+            signal_line = f"Сигнал на выход — ADX {adx:.0f}, DI+ {di_plus:.0f}."
+            action_line = f"ЖДАТЬ отката к {support:.2f} для нового входа."
+        else:
+            signal_line = f"Сигнала нет — ADX {adx:.0f}, DI- {di_minus:.0f} (нужно >{DI_PLUS_THRESHOLD})."
+            action_line = f"ЖДАТЬ пробоя {resistance:.2f}. Стоп {support:.2f}."
+        
+        return (
+            f"📊 Цена {price:.2f} {trend}. Поддержка {support:.2f}, сопротивление {resistance:.2f}.\n"
+            f"🤖 {signal_line}\n"
+            f"💡 {action_line}"
+        )
+    
     @staticmethod
     def format_help_message() -> str:
         """Справочное сообщение"""
@@ -352,6 +457,7 @@ class MessageFormatter:
             "🤖 <b>Команды:</b>\n"
             "/start - Главное меню\n"
             "/positions - Мои позиции\n"
+            "/scan - Сканер всего рынка\n"
             "/help - Эта справка\n\n"
             "📊 <b>Логика сигналов LONG:</b>\n"
             "✅ ВХОД LONG: ADX > 25 AND DI- > 25\n"
@@ -1,52 +1,476 @@
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple, Set
 import json
 
-from openai import AsyncOpenAI
+import numpy as np
 
-from config import OPENAI_API_KEY, GPT_MODEL, GPT_MAX_TOKENS, GPT_TEMPERATURE, ADX_THRESHOLD, DI_PLUS_THRESHOLD
+from config import (
+    GPT_MODEL,
+    GPT_MAX_TOKENS,
+    GPT_TEMPERATURE,
+    GPT_PROMPT_VERSION,
+    GPT_MEMORY_CACHE_SIZE,
+    GPT_PROMPT_TOKEN_BUDGET,
+    GPT_PROMPT_MAX_CANDLES,
+    GPT_PROMPT_MIN_CANDLES,
+    GPT_TOKENIZER_ENCODING,
+    GPT_BATCH_MAX_TICKERS,
+    GPT_BATCH_TOKENS_PER_TICKER,
+    GPT_REQUEST_TIMEOUT_SECONDS,
+    GPT_STREAM_TIMEOUT_SECONDS,
+    GPT_CIRCUIT_FAILURE_THRESHOLD,
+    GPT_CIRCUIT_RESET_SECONDS,
+    GPT_HEDGE_ENABLED,
+    GPT_HEDGE_PERCENTILE,
+    GPT_HEDGE_MIN_SAMPLES,
+    ADX_THRESHOLD,
+    DI_PLUS_THRESHOLD
+)
 from models import StockData
+from candles import CandleSeries
+from database import db
+from singleflight import SingleFlight
+from llm_backend import create_llm_client
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged
+from formatters import MessageFormatter
 
 logger = logging.getLogger(__name__)
 
+# Один запрос к GPT на ключ кэша, сколько бы пользователей ни нажали кнопку одновременно
+_analysis_flight = SingleFlight('gpt.analyze_stock')
+
 
 class GPTAnalyst:
     """Класс для анализа акций с помощью GPT"""
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.client = create_llm_client()
         self.model = GPT_MODEL
+        self.prompt_version = GPT_PROMPT_VERSION
+        self._memory_cache: OrderedDict = OrderedDict()
+        self._streams: Dict[str, '_AnalysisStream'] = {}
+        self._latest_by_bar: Dict[str, str] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._pending_batch: Dict[str, asyncio.Future] = {}
+        self.breaker = CircuitBreaker('gpt', GPT_CIRCUIT_FAILURE_THRESHOLD, GPT_CIRCUIT_RESET_SECONDS)
+        self.latency = LatencyTracker()
     
-    async def analyze_stock(self, stock_data: StockData, candles_data: List[Dict[str, Any]]) -> Optional[str]:
+    async def analyze_stock(self, stock_data: StockData, candles_data: CandleSeries) -> Optional[str]:
         """
-        Анализ акции с помощью GPT
+        Анализ акции с помощью GPT (с кэшированием)
+        
+        Анализ кэшируется по тикеру, последней свече, округлённым индикаторам
+        и версии промпта: пока новая свеча не закрылась и индикаторы не сдвинулись,
+        повторный запрос отдаётся из кэша.
         
         Args:
             stock_data: Данные акции с индикаторами
             candles_data: Список последних свечей
             
         Returns:
-            Текст анализа от GPT или None при ошибке
+            Текст анализа от GPT; если GPT недоступен (ошибка, дедлайн,
+            разомкнут предохранитель) — комментарий по индикаторам
+        """
+        cache_key = self.get_cache_key(stock_data, candles_data)
+        
+        cached = await self.get_cached_analysis(cache_key)
+        if cached:
+            logger.info(f"⚡ GPT анализ для {stock_data.info.ticker} из кэша ({cache_key})")
+            return cached
+        
+        analysis = await self._analyze_uncached(cache_key, stock_data, candles_data)
+        return analysis or self.fallback_analysis(stock_data)
+    
+    async def _analyze_uncached(
+        self,
+        cache_key: str,
+        stock_data: StockData,
+        candles_data: CandleSeries
+    ) -> Optional[str]:
+        # Если этот анализ уже идёт потоком — ждём его результат
+        stream = self._streams.get(cache_key)
+        if stream is not None:
+            async for text, is_final in stream.follow():
+                if is_final:
+                    return text
+            return None
+        
+        # Если ключ сейчас считается пакетным запросом — ждём его
+        pending = self._pending_batch.get(cache_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        
+        return await _analysis_flight.do(
+            cache_key, lambda: self._analyze_and_cache(cache_key, stock_data, candles_data)
+        )
+    
+    def fallback_analysis(self, stock_data: StockData) -> str:
+        """Комментарий по индикаторам вместо GPT (не кэшируется)"""
+        logger.warning(f"🧯 GPT недоступен для {stock_data.info.ticker}, отдаём комментарий по индикаторам")
+        return MessageFormatter.format_rule_based_analysis(
+            stock_data.price.current_price,
+            stock_data.technical.ema20,
+            stock_data.technical.adx,
+            stock_data.technical.di_plus,
+            stock_data.technical.di_minus
+        )
+    
+    async def _complete(self, **kwargs):
+        """
+        Запрос к LLM с предохранителем и жёстким дедлайном.
+        
+        Если ответ дольше обычного (перцентиль задержки), параллельно
+        отправляется подстраховочный запрос и берётся первый ответ.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("GPT circuit breaker is open")
+        
+        hedge_after = None
+        if GPT_HEDGE_ENABLED and not kwargs.get('stream'):
+            hedge_after = self.latency.percentile(GPT_HEDGE_PERCENTILE, GPT_HEDGE_MIN_SAMPLES)
+        
+        started_at = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                hedged(lambda: self.client.chat.completions.create(**kwargs), hedge_after),
+                timeout=GPT_REQUEST_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise TimeoutError(f"GPT did not respond within {GPT_REQUEST_TIMEOUT_SECONDS}s")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        
+        if not kwargs.get('stream'):
+            self.breaker.record_success()
+            self.latency.record(time.monotonic() - started_at)
+        return response
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние предохранителя и задержки GPT"""
+        return {
+            'circuit': self.breaker.stats(),
+            'latency': self.latency.stats(),
+        }
+    
+    def get_cache_key(self, stock_data: StockData, candles_data: CandleSeries) -> str:
+        """Ключ кэша: тикер, время последней свечи, округлённые индикаторы, версия промпта"""
+        technical = stock_data.technical
+        candle_time = candles_data.time_str(-1) if candles_data else 'none'
+        return (
+            f"{stock_data.info.ticker}|{candle_time}|"
+            f"{technical.adx:.0f}|{technical.di_plus:.0f}|{technical.di_minus:.0f}|"
+            f"v{self.prompt_version}"
+        )
+    
+    async def get_cached_analysis(self, cache_key: str) -> Optional[str]:
+        """Анализ из памяти процесса или из PostgreSQL"""
+        analysis = self._memory_cache.get(cache_key)
+        if analysis:
+            self._memory_cache.move_to_end(cache_key)
+            return analysis
+        
+        try:
+            analysis = await db.get_gpt_analysis(cache_key)
+        except Exception as e:
+            logger.error(f"Error reading GPT analysis cache: {e}")
+            return None
+        
+        if analysis:
+            self._remember(cache_key, analysis)
+        return analysis
+    
+    def _remember(self, cache_key: str, analysis: str):
+        """LRU-кэш анализов в памяти процесса"""
+        self._memory_cache[cache_key] = analysis
+        self._memory_cache.move_to_end(cache_key)
+        while len(self._memory_cache) > GPT_MEMORY_CACHE_SIZE:
+            self._memory_cache.popitem(last=False)
+        
+        # Последний анализ по свече тикера — для сигналов, где индикаторы чуть сдвинулись
+        self._latest_by_bar[self._bar_key(cache_key)] = analysis
+        while len(self._latest_by_bar) > GPT_MEMORY_CACHE_SIZE:
+            self._latest_by_bar.pop(next(iter(self._latest_by_bar)))
+    
+    @staticmethod
+    def _bar_key(cache_key: str) -> str:
+        """Часть ключа кэша: тикер и время последней свечи"""
+        return "|".join(cache_key.split("|")[:2])
+    
+    async def get_ready_analysis(self, stock_data: StockData, candles_data: CandleSeries) -> Optional[str]:
+        """
+        Уже готовый анализ без запроса к GPT.
+        
+        Точное совпадение ключа кэша, иначе последний анализ по той же свече
+        (например, посчитанный заранее, когда тикер подходил к порогу сигнала).
+        """
+        cache_key = self.get_cache_key(stock_data, candles_data)
+        cached = await self.get_cached_analysis(cache_key)
+        if cached:
+            return cached
+        return self._latest_by_bar.get(self._bar_key(cache_key))
+    
+    def precompute(self, stock_data: StockData, candles_data: CandleSeries):
+        """Фоновый расчёт анализа заранее, чтобы он был готов к моменту сигнала"""
+        cache_key = self.get_cache_key(stock_data, candles_data)
+        if cache_key in self._memory_cache:
+            return
+        
+        logger.info(f"🔮 Предварительный GPT анализ для {stock_data.info.ticker}")
+        task = asyncio.create_task(self.analyze_stock(stock_data, candles_data))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _analyze_and_cache(
+        self,
+        cache_key: str,
+        stock_data: StockData,
+        candles_data: CandleSeries
+    ) -> Optional[str]:
+        """Запрос к GPT и сохранение результата в кэш"""
+        analysis = await self._request_analysis(stock_data, candles_data)
+        if not analysis:
+            return None
+        
+        await self._store(cache_key, stock_data, candles_data, analysis)
+        return analysis
+    
+    async def _store(
+        self,
+        cache_key: str,
+        stock_data: StockData,
+        candles_data: CandleSeries,
+        analysis: str
+    ):
+        """Сохранение анализа в память процесса и в PostgreSQL"""
+        self._remember(cache_key, analysis)
+        try:
+            await db.save_gpt_analysis(
+                cache_key,
+                stock_data.info.ticker,
+                candles_data.time_str(-1) if candles_data else None,
+                self.prompt_version,
+                analysis
+            )
+        except Exception as e:
+            logger.error(f"Error saving GPT analysis to cache: {e}")
+    
+    async def analyze_batch(
+        self,
+        items: List[Tuple[StockData, CandleSeries]]
+    ) -> Dict[str, Optional[str]]:
+        """
+        Анализ нескольких акций одним запросом к GPT.
+        
+        Для акций без готового анализа блоки свечей и индикаторов отправляются
+        вместе, ответ приходит JSON по схеме (тикер → анализ). Пока пакет
+        выполняется, analyze_stock по тем же ключам ждёт его результат.
+        Тикеры, которых нет в ответе или если ответ не разобрался,
+        анализируются обычными одиночными запросами.
+        
+        Returns:
+            Словарь тикер → текст анализа (None при ошибке)
+        """
+        return await self._complete_batch(*self._reserve_batch(items))
+    
+    def precompute_batch(self, items: List[Tuple[StockData, CandleSeries]]):
+        """Фоновый пакетный анализ; ключи резервируются сразу, до запуска задачи"""
+        results, waiting, pending = self._reserve_batch(items)
+        if not pending:
+            return
+        
+        logger.info(f"🔮 Предварительный пакетный GPT анализ для {', '.join(s.info.ticker for _, s, _ in pending)}")
+        task = asyncio.create_task(self._complete_batch(results, waiting, pending))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def _reserve_batch(self, items: List[Tuple[StockData, CandleSeries]]):
         """
+        Разбор пакета без ожиданий: готовые анализы, уже идущие запросы
+        и ключи, которые резервируются под пакетный запрос.
+        """
+        loop = asyncio.get_running_loop()
+        results: Dict[str, Optional[str]] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        pending: List[Tuple[str, StockData, CandleSeries]] = []
+        
+        for stock_data, candles_data in items:
+            ticker = stock_data.info.ticker
+            cache_key = self.get_cache_key(stock_data, candles_data)
+            
+            if cache_key in self._memory_cache:
+                results[ticker] = self._memory_cache[cache_key]
+            elif cache_key in self._pending_batch:
+                waiting[ticker] = self._pending_batch[cache_key]
+            elif cache_key in self._streams or _analysis_flight.is_running(cache_key):
+                waiting[ticker] = asyncio.ensure_future(self.analyze_stock(stock_data, candles_data))
+            else:
+                self._pending_batch[cache_key] = loop.create_future()
+                pending.append((cache_key, stock_data, candles_data))
+        
+        return results, waiting, pending
+    
+    async def _complete_batch(
+        self,
+        results: Dict[str, Optional[str]],
+        waiting: Dict[str, asyncio.Future],
+        pending: List[Tuple[str, StockData, CandleSeries]]
+    ) -> Dict[str, Optional[str]]:
         try:
-            # Формируем промпт для GPT
-            prompt = self._create_prompt(stock_data, candles_data)
+            # Что-то могло найтись в PostgreSQL (посчитано другим процессом)
+            to_request = []
+            for cache_key, stock_data, candles_data in pending:
+                cached = await self.get_cached_analysis(cache_key)
+                if cached:
+                    results[stock_data.info.ticker] = cached
+                    self._resolve_pending(cache_key, cached)
+                else:
+                    to_request.append((cache_key, stock_data, candles_data))
             
+            for start in range(0, len(to_request), GPT_BATCH_MAX_TICKERS):
+                chunk = to_request[start:start + GPT_BATCH_MAX_TICKERS]
+                results.update(await self._analyze_chunk(chunk))
+        
+        finally:
+            # Ожидающие не должны зависнуть, даже если пакет упал с ошибкой
+            for cache_key, _, _ in pending:
+                self._resolve_pending(cache_key, None)
+        
+        for ticker, future in waiting.items():
+            try:
+                results[ticker] = await asyncio.shield(future)
+            except Exception as e:
+                logger.error(f"❌ Ошибка ожидания GPT анализа для {ticker}: {e}")
+                results[ticker] = None
+        
+        return results
+    
+    def _resolve_pending(self, cache_key: str, analysis: Optional[str]):
+        future = self._pending_batch.pop(cache_key, None)
+        if future is not None and not future.done():
+            future.set_result(analysis)
+    
+    async def _analyze_chunk(
+        self,
+        chunk: List[Tuple[str, StockData, CandleSeries]]
+    ) -> Dict[str, Optional[str]]:
+        """Один пакетный запрос; недостающие тикеры — одиночными запросами"""
+        if len(chunk) > 1:
+            analyses = await self._request_batch([(stock_data, candles) for _, stock_data, candles in chunk])
+        else:
+            analyses = {}
+        
+        results: Dict[str, Optional[str]] = {}
+        fallback = []
+        for cache_key, stock_data, candles_data in chunk:
+            analysis = analyses.get(stock_data.info.ticker)
+            if analysis:
+                await self._store(cache_key, stock_data, candles_data, analysis)
+                results[stock_data.info.ticker] = analysis
+                self._resolve_pending(cache_key, analysis)
+            else:
+                fallback.append((cache_key, stock_data, candles_data))
+        
+        if not fallback:
+            return results
+        
+        if len(chunk) > 1:
+            logger.warning(
+                f"⚠️ Пакетный GPT анализ без ответа для "
+                f"{', '.join(s.info.ticker for _, s, _ in fallback)}, запрашиваем по одному"
+            )
+        
+        # Резерв снимается, чтобы одиночные запросы не ждали сами себя
+        futures = {cache_key: self._pending_batch.pop(cache_key, None) for cache_key, _, _ in fallback}
+        try:
+            single = await asyncio.gather(
+                *(self.analyze_stock(stock_data, candles) for _, stock_data, candles in fallback),
+                return_exceptions=True
+            )
+            for (_, stock_data, _), analysis in zip(fallback, single):
+                if isinstance(analysis, Exception):
+                    logger.error(f"❌ Ошибка GPT анализа для {stock_data.info.ticker}: {analysis}")
+                    analysis = None
+                results[stock_data.info.ticker] = analysis
+        finally:
+            for cache_key, stock_data, _ in fallback:
+                future = futures[cache_key]
+                if future is not None and not future.done():
+                    future.set_result(results.get(stock_data.info.ticker))
+        
+        return results
+    
+    async def _request_batch(
+        self,
+        items: List[Tuple[StockData, CandleSeries]]
+    ) -> Dict[str, str]:
+        """Пакетный запрос к GPT со структурированным ответом; при ошибке — пустой словарь"""
+        tickers = [stock_data.info.ticker for stock_data, _ in items]
+        try:
+            logger.info(f"🤖 Запрашиваем пакетный GPT анализ для {', '.join(tickers)}...")
+            
+            response = await self._complete(
+                model=self.model,
+                messages=self._build_batch_messages(items),
+                max_completion_tokens=GPT_MAX_TOKENS + GPT_BATCH_TOKENS_PER_TICKER * len(items),
+                reasoning_effort="minimal",
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "ticker_analyses",
+                        "strict": True,
+                        "schema": _BATCH_RESPONSE_SCHEMA
+                    }
+                }
+            )
+            
+            if response.usage:
+                logger.info(
+                    f"🧮 Токены пакета ({len(items)} тикеров): prompt={response.usage.prompt_tokens}, "
+                    f"completion={response.usage.completion_tokens}"
+                )
+            
+            if not response.choices or not response.choices[0].message.content:
+                logger.error(f"⚠️ GPT вернул пустой пакетный ответ для {', '.join(tickers)}")
+                return {}
+            
+            return self._parse_batch_response(response.choices[0].message.content, tickers)
+        
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного запроса к GPT для {', '.join(tickers)}: {e}")
+            return {}
+    
+    @staticmethod
+    def _parse_batch_response(content: str, tickers: List[str]) -> Dict[str, str]:
+        """Разбор JSON ответа; берутся только запрошенные тикеры с непустым анализом"""
+        try:
+            data = json.loads(content)
+            analyses = {
+                item['ticker'].upper(): item['analysis'].strip()
+                for item in data['analyses']
+            }
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"⚠️ Не удалось разобрать пакетный ответ GPT: {e}")
+            return {}
+        
+        return {ticker: analyses[ticker] for ticker in tickers if analyses.get(ticker)}
+    
+    async def _request_analysis(self, stock_data: StockData, candles_data: CandleSeries) -> Optional[str]:
+        """Запрос анализа к GPT"""
+        try:
             logger.info(f"🤖 Запрашиваем GPT анализ для {stock_data.info.ticker}...")
             
             # Отправляем запрос к GPT
-            response = await self.client.chat.completions.create(
+            response = await self._complete(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self._get_system_prompt()
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                messages=self._build_messages(stock_data, candles_data),
                 max_completion_tokens=GPT_MAX_TOKENS,
                 reasoning_effort="minimal"  # Минимальное reasoning для экономии токенов
             )
@@ -63,6 +487,11 @@ class GPTAnalyst:
             analysis = response.choices[0].message.content.strip()
             
             logger.info(f"✅ GPT анализ получен для {stock_data.info.ticker}")
+            if response.usage:
+                logger.info(
+                    f"🧮 Токены {stock_data.info.ticker}: prompt={response.usage.prompt_tokens}, "
+                    f"completion={response.usage.completion_tokens}"
+                )
             logger.info(f"📝 Длина ответа: {len(analysis)} символов")
             logger.info(f"📄 Текст ответа: {analysis[:200]}...")  # Первые 200 символов
             
@@ -76,78 +505,339 @@ class GPTAnalyst:
             logger.error(f"❌ Ошибка при запросе к GPT для {stock_data.info.ticker}: {e}")
             return None
     
+    async def stream_analysis(
+        self,
+        stock_data: StockData,
+        candles_data: CandleSeries
+    ) -> AsyncIterator[Tuple[str, bool]]:
+        """
+        Потоковый анализ: отдаёт пары (накопленный текст, финальный ли он).
+        
+        Из кэша ответ приходит сразу одним финальным элементом. Одновременные
+        потоки по одному ключу читают один запрос к GPT; если ключ уже считается
+        пакетным или обычным запросом, его результат приходит одним финальным
+        элементом. Если запрос не удался
+        или не уложился в дедлайн, финальным приходит комментарий по индикаторам.
+        """
+        cache_key = self.get_cache_key(stock_data, candles_data)
+        
+        cached = await self.get_cached_analysis(cache_key)
+        if cached:
+            logger.info(f"⚡ GPT анализ для {stock_data.info.ticker} из кэша ({cache_key})")
+            yield cached, True
+            return
+        
+        stream = self._streams.get(cache_key)
+        if stream is None and (cache_key in self._pending_batch or _analysis_flight.is_running(cache_key)):
+            # Этот бар уже считается пакетом монитора или обычным запросом — ждём его,
+            # а не платим за второй запрос к GPT
+            logger.info(f"🔗 GPT анализ для {stock_data.info.ticker} уже запрошен, ждём его ({cache_key})")
+            analysis = await self._analyze_uncached(cache_key, stock_data, candles_data)
+            yield analysis or self.fallback_analysis(stock_data), True
+            return
+        
+        if stream is None:
+            stream = _AnalysisStream()
+            self._streams[cache_key] = stream
+            task = asyncio.create_task(self._produce_stream(cache_key, stream, stock_data, candles_data))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        
+        async for text, is_final in stream.follow():
+            yield text, is_final
+            if is_final:
+                return
+        
+        # Поток оборвался без результата — комментарий по индикаторам
+        yield self.fallback_analysis(stock_data), True
+    
+    async def _produce_stream(
+        self,
+        cache_key: str,
+        stream: '_AnalysisStream',
+        stock_data: StockData,
+        candles_data: CandleSeries
+    ):
+        """Чтение потокового ответа GPT и раздача его подписчикам"""
+        ticker = stock_data.info.ticker
+        analysis = None
+        try:
+            logger.info(f"🤖 Запрашиваем потоковый GPT анализ для {ticker}...")
+            analysis = await self._read_stream(stream, stock_data, candles_data)
+            
+            if analysis:
+                logger.info(f"✅ Потоковый GPT анализ получен для {ticker} ({len(analysis)} символов)")
+                await self._store(cache_key, stock_data, candles_data, analysis)
+            else:
+                logger.warning(f"⚠️ GPT вернул пустой потоковый ответ для {ticker}")
+        
+        except Exception as e:
+            logger.error(f"❌ Ошибка потокового запроса к GPT для {ticker}: {e}")
+        
+        finally:
+            self._streams.pop(cache_key, None)
+            await stream.finish(analysis)
+    
+    async def _read_stream(
+        self,
+        stream: '_AnalysisStream',
+        stock_data: StockData,
+        candles_data: CandleSeries
+    ) -> Optional[str]:
+        response = await self._complete(
+            model=self.model,
+            messages=self._build_messages(stock_data, candles_data),
+            max_completion_tokens=GPT_MAX_TOKENS,
+            reasoning_effort="minimal",
+            stream=True
+        )
+        
+        try:
+            text = await asyncio.wait_for(self._consume_stream(response, stream), timeout=GPT_STREAM_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise TimeoutError(f"GPT stream did not finish within {GPT_STREAM_TIMEOUT_SECONDS}s")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        
+        self.breaker.record_success()
+        return text.strip() or None
+    
+    @staticmethod
+    async def _consume_stream(response, stream: '_AnalysisStream') -> str:
+        text = ""
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                text += delta
+                await stream.publish(text)
+        return text
+    
+    def _build_messages(self, stock_data: StockData, candles_data: CandleSeries) -> List[Dict[str, str]]:
+        """Сообщения запроса к GPT"""
+        return [
+            {
+                "role": "system",
+                "content": self._get_system_prompt()
+            },
+            {
+                "role": "user",
+                "content": self._create_prompt(stock_data, candles_data)
+            }
+        ]
+    
+    def _build_batch_messages(self, items: List[Tuple[StockData, CandleSeries]]) -> List[Dict[str, str]]:
+        """Сообщения пакетного запроса: общий системный промпт и блоки по каждой акции"""
+        blocks = "\n\n".join(
+            self._create_prompt(stock_data, candles_data) for stock_data, candles_data in items
+        )
+        return [
+            {
+                "role": "system",
+                "content": self._get_system_prompt() + "\n" + _BATCH_INSTRUCTION
+            },
+            {
+                "role": "user",
+                "content": blocks
+            }
+        ]
+    
     def _get_system_prompt(self) -> str:
-        """Системный промпт для GPT"""
-        return """Ты опытный трейдер. Анализируй КРАТКО.
-
-СТРОГИЙ ФОРМАТ (ровно 3 строки с эмодзи):
-📊 [тренд + уровни, макс 15 слов]
-🤖 [сигнал есть/нет, макс 10 слов]
-💡 [ПОКУПАТЬ/ЖДАТЬ + цены, макс 15 слов]
-
-ПРИМЕР:
+        """Системный промпт для GPT (неизменный между запросами)"""
+        return f"""Ты опытный трейдер. Отвечай КРАТКО, ровно 3 строки:
+📊 [тренд + уровни, до 15 слов]
+🤖 [сигнал есть/нет, до 10 слов]
+💡 [ПОКУПАТЬ/ЖДАТЬ + цены, до 15 слов]
+Пример:
 📊 Цена 115 около EMA20, боковик. Поддержка 114, сопротивление 117.
 🤖 Сигнала нет — DI- = 23 (нужно >25 для входа).
 💡 ЖДАТЬ пробоя 117. Цель 119, стоп 114.
-
-ПРАВИЛА:
-- НЕ используй символ рубля ₽ - пиши просто числа
-- Вместо "автосигнала" пиши "сигнала"
-- Вместо "подтверждения" пиши "пробоя"
-
-ЗАПРЕЩЕНО:
-- Больше 3 строк
-- Эмодзи кроме 📊🤖💡
-- Слова "система", "бот", "условие", "автосигнал"
-- Подробности про объёмы, волатильность, свечи"""
+Сигналы: вход LONG при ADX>{ADX_THRESHOLD} и DI->{DI_PLUS_THRESHOLD}, выход при ADX>{ADX_THRESHOLD} и DI+>{DI_PLUS_THRESHOLD}.
+Свечи: dt — часов от предыдущей, c — закрытие, o/h/l — отклонение от c, v — объём в тыс.
+Без ₽, других эмодзи, слов "система", "бот", "условие", "автосигнал"; "подтверждение" → "пробой"; без подробностей про объёмы и свечи."""
     
-    def _create_prompt(self, stock_data: StockData, candles_data: List[Dict[str, Any]]) -> str:
-        """Создание промпта для GPT"""
+    def _create_prompt(self, stock_data: StockData, candles_data: CandleSeries) -> str:
+        """
+        Компактный промпт в пределах GPT_PROMPT_TOKEN_BUDGET.
+        
+        Если промпт не влезает в бюджет, отбрасываются самые старые свечи
+        (но не меньше GPT_PROMPT_MIN_CANDLES).
+        """
+        recent_candles = candles_data[-GPT_PROMPT_MAX_CANDLES:]
+        system_tokens = count_tokens(self._get_system_prompt())
+        
+        while True:
+            prompt = self._render_prompt(stock_data, recent_candles)
+            tokens = system_tokens + count_tokens(prompt)
+            if tokens <= GPT_PROMPT_TOKEN_BUDGET or len(recent_candles) <= GPT_PROMPT_MIN_CANDLES:
+                break
+            recent_candles = recent_candles[1:]
         
-        # Берем последние 20 свечей для анализа
-        recent_candles = candles_data[-20:] if len(candles_data) > 20 else candles_data
+        logger.info(
+            f"🧮 Промпт {stock_data.info.ticker}: ~{tokens} токенов, "
+            f"{len(recent_candles)} свечей (бюджет {GPT_PROMPT_TOKEN_BUDGET})"
+        )
+        return prompt
+    
+    def _render_prompt(self, stock_data: StockData, candles: CandleSeries) -> str:
+        decimals = _price_decimals(stock_data.price.current_price)
+        tech = stock_data.technical
         
-        # Форматируем свечи
-        candles_text = self._format_candles(recent_candles)
+        return (
+            f"{stock_data.info.ticker} ({stock_data.info.name})\n"
+            f"{self._format_candles(candles, decimals)}\n"
+            f"Цена {stock_data.price.current_price:.{decimals}f} EMA20 {tech.ema20:.{decimals}f} "
+            f"ADX {tech.adx:.0f} DI+ {tech.di_plus:.0f} DI- {tech.di_minus:.0f}"
+        )
+    
+    def _format_candles(self, candles: CandleSeries, decimals: int = 2) -> str:
+        """
+        Свечи в виде CSV: время первой свечи абсолютное, дальше — шаг в часах,
+        open/high/low — отклонение от close той же свечи.
+        """
+        if not candles:
+            return ""
         
-        # Формируем промпт
-        prompt = f"""Проанализируй {stock_data.info.ticker} ({stock_data.info.name}):
+        hours = np.diff(candles.time, prepend=candles.time[:1]) / np.timedelta64(1, 'h')
+        lines = [f"с {candles.datetime_at(0):%d.%m %H:%M}", "dt,c,o,h,l,v"]
+        
+        for dt, c, o, h, l, v in zip(
+            hours.tolist(), candles.close.tolist(), candles.open.tolist(),
+            candles.high.tolist(), candles.low.tolist(), candles.volume.tolist()
+        ):
+            lines.append(",".join([
+                f"{dt:g}",
+                f"{c:.{decimals}f}",
+                _format_delta(o - c, decimals),
+                _format_delta(h - c, decimals),
+                _format_delta(l - c, decimals),
+                f"{v / 1000:.0f}"
+            ]))
+        
+        return "\n".join(lines)
 
-СВЕЧИ (последние 20):
-{candles_text}
 
-ТЕКУЩАЯ СИТУАЦИЯ:
-• Цена: {stock_data.price.current_price:.2f} ₽
-• EMA20: {stock_data.technical.ema20:.2f} ₽
-• ADX: {stock_data.technical.adx:.2f}
-• DI+: {stock_data.technical.di_plus:.2f}
-• DI-: {stock_data.technical.di_minus:.2f}
+_BATCH_INSTRUCTION = (
+    "Акций несколько: для каждой верни ticker и analysis — ровно 3 строки в формате выше."
+)
 
-СИСТЕМА БОТА (для справки):
-Сигнал ВХОДА в LONG: ADX > {ADX_THRESHOLD} AND DI- > {DI_PLUS_THRESHOLD}
-Сигнал ВЫХОДА из LONG: ADX > {ADX_THRESHOLD} AND DI+ > {DI_PLUS_THRESHOLD}
+_BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analyses": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "ticker": {"type": "string"},
+                    "analysis": {"type": "string"}
+                },
+                "required": ["ticker", "analysis"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["analyses"],
+    "additionalProperties": False
+}
 
-Дай свой профессиональный анализ."""
-        
-        return prompt
+
+def count_tokens(text: str) -> int:
+    """
+    Число токенов текста.
     
-    def _format_candles(self, candles: List[Dict[str, Any]]) -> str:
-        """Форматирование свечей для промпта"""
-        lines = []
-        for i, candle in enumerate(candles, 1):
-            time = candle['time']
-            o = candle['open']
-            h = candle['high']
-            l = candle['low']
-            c = candle['close']
-            v = candle['volume']
+    Точный подсчёт через tiktoken (requirements.txt); если кодировку загрузить
+    не удалось — оценка (в русском тексте токен в среднем около 3 символов).
+    """
+    encoding = load_tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 3 + 1
+
+
+_encoding = None
+_encoding_loaded = False
+
+
+def load_tokenizer():
+    """
+    Кодировка tiktoken для count_tokens (загружается один раз).
+    
+    Вызывается при старте приложения, чтобы отсутствие tiktoken или файла
+    кодировки было видно сразу, а не при первом промпте.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(GPT_TOKENIZER_ENCODING)
+            logger.info(f"✅ Tokenizer {GPT_TOKENIZER_ENCODING} loaded")
+        except Exception as e:
+            logger.warning(
+                f"⚠️ tiktoken недоступен ({e}): GPT_PROMPT_TOKEN_BUDGET проверяется по приблизительной "
+                f"оценке токенов, установите tiktoken (requirements.txt)"
+            )
+    return _encoding
+
+
+def _price_decimals(price: float) -> int:
+    """Знаков после запятой: столько, сколько значимо для цены такого масштаба"""
+    if price >= 1000:
+        return 0
+    if price >= 100:
+        return 1
+    if price >= 1:
+        return 2
+    return 4
+
+
+def _format_delta(value: float, decimals: int) -> str:
+    text = f"{value:.{decimals}f}"
+    # "0.00"/"-0.00" → "0" экономит токены на каждой строке
+    return "0" if float(text) == 0 else text
+
+
+class _AnalysisStream:
+    """Потоковый ответ GPT, который могут читать несколько подписчиков"""
+    
+    def __init__(self):
+        self.text = ""
+        self.result: Optional[str] = None
+        self.done = False
+        self._changed = asyncio.Condition()
+    
+    async def publish(self, text: str):
+        async with self._changed:
+            self.text = text
+            self._changed.notify_all()
+    
+    async def finish(self, result: Optional[str]):
+        async with self._changed:
+            self.result = result
+            self.done = True
+            self._changed.notify_all()
+    
+    async def follow(self) -> AsyncIterator[Tuple[str, bool]]:
+        seen = None
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or self.text != seen)
+                text, done, result = self.text, self.done, self.result
             
-            # Определяем цвет свечи
-            color = "🟢" if c > o else "🔴" if c < o else "⚪"
+            if done:
+                if result:
+                    yield result, True
+                return
             
-            lines.append(f"{i}. {time} {color} O:{o:.2f} H:{h:.2f} L:{l:.2f} C:{c:.2f} V:{v}")
-        
-        return "\n".join(lines)
+            seen = text
+            yield text, False
 
 
 # Глобальный экземпляр
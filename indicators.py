@@ -1,9 +1,12 @@
 import logging
-from typing import Dict, List, Any
+from typing import Dict, Any
 
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 
-from config import DEFAULT_ADX_PERIOD, DEFAULT_EMA_PERIOD
+from candles import CandleSeries
+from config import DEFAULT_ADX_PERIOD, DEFAULT_EMA_PERIOD, MAX_CANDLES
 
 logger = logging.getLogger(__name__)
 
@@ -101,28 +104,156 @@ class TechnicalIndicators:
         }
     
     @classmethod
-    def calculate_all_indicators(cls, candles_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Расчет всех индикаторов для свечных данных"""
-        if len(candles_data) < 30:
-            logger.error(f"Insufficient data: {len(candles_data)} candles (need at least 30)")
+    def calculate_all_indicators(cls, candles: CandleSeries) -> Dict[str, Any]:
+        """Расчет всех индикаторов на последней свече (колонки серии без DataFrame)"""
+        if len(candles) < 30:
+            logger.error(f"Insufficient data: {len(candles)} candles (need at least 30)")
             return None
         
-        # Преобразуем в DataFrame
-        df = pd.DataFrame(candles_data)
+        batch = cls.calculate_batch(candles.high[np.newaxis], candles.low[np.newaxis], candles.close[np.newaxis])
+        result = {key: float(values[0]) for key, values in batch.items()}
         
-        # Расчет EMA20
-        df['ema20'] = cls.calculate_ema(df)
+        logger.info(f"📊 ADX: {result['adx']:.2f}, DI+: {result['di_plus']:.2f}, DI-: {result['di_minus']:.2f}")
         
-        # Расчет ADX
-        adx_data = cls.calculate_adx(df)
+        return result
+    
+    @staticmethod
+    def calculate_windowed(
+        high: np.ndarray,
+        low: np.ndarray,
+        close: np.ndarray,
+        window: int = MAX_CANDLES,
+        adx_period: int = DEFAULT_ADX_PERIOD,
+        ema_period: int = DEFAULT_EMA_PERIOD
+    ) -> Dict[str, np.ndarray]:
+        """
+        Индикаторы на каждом баре истории так, как их видит монитор:
+        по окну из последних window свечей (calculate_all_indicators на окне).
+        
+        Все окна считаются разом: окна — строки 2-D массива, сглаживание Уайлдера
+        идёт по столбцам одновременно для всех строк. Для баров, где окно ещё
+        не набралось, значения NaN.
+        
+        Returns:
+            Словарь массивов длины len(close): ema20, adx, di_plus, di_minus
+        """
+        high = np.asarray(high, dtype=float)
+        low = np.asarray(low, dtype=float)
+        close = np.asarray(close, dtype=float)
+        n = len(close)
+        result = {key: np.full(n, np.nan) for key in ('ema20', 'adx', 'di_plus', 'di_minus')}
+        
+        steps = window - 1  # TR/DM внутри окна считаются со второй свечи
+        if n < window or steps < adx_period:
+            return result
+        
+        # TR и DM по всей истории: значение j использует свечи j-1 и j
+        prev_close = close[:-1]
+        tr = np.maximum.reduce([
+            high[1:] - low[1:],
+            np.abs(high[1:] - prev_close),
+            np.abs(low[1:] - prev_close)
+        ])
+        up_move = high[1:] - high[:-1]
+        down_move = low[:-1] - low[1:]
+        dm_plus = np.where(up_move > down_move, np.maximum(up_move, 0), 0.0)
+        dm_minus = np.where(down_move > up_move, np.maximum(down_move, 0), 0.0)
         
-        last_row = df.iloc[-1]
+        # Строка r — окно свечей r..r+window-1 (TR/DM с индексами r+1..r+window-1)
+        tr_w = sliding_window_view(tr, steps)
+        dmp_w = sliding_window_view(dm_plus, steps)
+        dmm_w = sliding_window_view(dm_minus, steps)
         
-        logger.info(f"📊 ADX: {adx_data['adx']:.2f}, DI+: {adx_data['di_plus']:.2f}, DI-: {adx_data['di_minus']:.2f}")
+        last = slice(window - 1, n)
+        adx, di_plus, di_minus = TechnicalIndicators._adx_rows(tr_w, dmp_w, dmm_w, adx_period)
+        result['adx'][last] = adx
+        result['di_plus'][last] = di_plus
+        result['di_minus'][last] = di_minus
+        result['ema20'][last] = sliding_window_view(close, window) @ TechnicalIndicators._ema_weights(window, ema_period)
+        
+        return result
+    
+    @staticmethod
+    def calculate_batch(
+        high: np.ndarray,
+        low: np.ndarray,
+        close: np.ndarray,
+        adx_period: int = DEFAULT_ADX_PERIOD,
+        ema_period: int = DEFAULT_EMA_PERIOD
+    ) -> Dict[str, np.ndarray]:
+        """
+        Индикаторы на последней свече для многих инструментов разом.
+        
+        Строка 2-D массива — свечи одного инструмента (одинаковой длины,
+        например последние MAX_CANDLES), результат совпадает с
+        calculate_ema и calculate_adx по каждой строке.
+        
+        Returns:
+            Словарь массивов длины числа строк: ema20, adx, di_plus, di_minus
+        """
+        high = np.asarray(high, dtype=float)
+        low = np.asarray(low, dtype=float)
+        close = np.asarray(close, dtype=float)
+        rows, window = close.shape
         
+        if window - 1 < adx_period:
+            return {key: np.full(rows, np.nan) for key in ('ema20', 'adx', 'di_plus', 'di_minus')}
+        
+        prev_close = close[:, :-1]
+        tr = np.maximum.reduce([
+            high[:, 1:] - low[:, 1:],
+            np.abs(high[:, 1:] - prev_close),
+            np.abs(low[:, 1:] - prev_close)
+        ])
+        up_move = high[:, 1:] - high[:, :-1]
+        down_move = low[:, :-1] - low[:, 1:]
+        dm_plus = np.where(up_move > down_move, np.maximum(up_move, 0), 0.0)
+        dm_minus = np.where(down_move > up_move, np.maximum(down_move, 0), 0.0)
+        
+        adx, di_plus, di_minus = TechnicalIndicators._adx_rows(tr, dm_plus, dm_minus, adx_period)
         return {
-            'ema20': last_row['ema20'],
-            'adx': adx_data['adx'],
-            'di_plus': adx_data['di_plus'],
-            'di_minus': adx_data['di_minus']
+            'ema20': close @ TechnicalIndicators._ema_weights(window, ema_period),
+            'adx': adx,
+            'di_plus': di_plus,
+            'di_minus': di_minus
         }
+    
+    @staticmethod
+    def _adx_rows(tr: np.ndarray, dm_plus: np.ndarray, dm_minus: np.ndarray, adx_period: int):
+        """
+        ADX, DI+ и DI- на последнем шаге каждой строки TR/DM.
+        
+        Сглаживание Уайлдера как в calculate_adx: первое значение — среднее,
+        дальше s = s - s/period + x; идёт по столбцам сразу для всех строк.
+        """
+        steps = tr.shape[1]
+        s_tr = tr[:, :adx_period].mean(axis=1)
+        s_dmp = dm_plus[:, :adx_period].mean(axis=1)
+        s_dmm = dm_minus[:, :adx_period].mean(axis=1)
+        
+        dx_count = steps - adx_period + 1
+        dx = np.empty((len(s_tr), dx_count))
+        
+        for k in range(dx_count):
+            if k > 0:
+                col = adx_period + k - 1
+                s_tr = s_tr - s_tr / adx_period + tr[:, col]
+                s_dmp = s_dmp - s_dmp / adx_period + dm_plus[:, col]
+                s_dmm = s_dmm - s_dmm / adx_period + dm_minus[:, col]
+            
+            with np.errstate(divide='ignore', invalid='ignore'):
+                di_plus = np.where(s_tr > 0, s_dmp / s_tr * 100, 0.0)
+                di_minus = np.where(s_tr > 0, s_dmm / s_tr * 100, 0.0)
+                di_sum = di_plus + di_minus
+                dx[:, k] = np.where(di_sum > 0, np.abs(di_plus - di_minus) / di_sum * 100, 0.0)
+        
+        adx = dx[:, -adx_period:].mean(axis=1) if dx_count >= adx_period else dx.mean(axis=1)
+        return adx, di_plus, di_minus
+    
+    @staticmethod
+    def _ema_weights(window: int, ema_period: int) -> np.ndarray:
+        """Веса цен окна, с которыми EMA (adjust=False) даёт значение на последней свече"""
+        alpha = 2 / (ema_period + 1)
+        weights = alpha * (1 - alpha) ** np.arange(window - 1, -1, -1)
+        weights[0] = (1 - alpha) ** (window - 1)
+        return weights
@@ -0,0 +1,142 @@
+import logging
+from datetime import timedelta
+from typing import Optional, Dict, List, Any
+
+from models import Instrument
+from moex_api import get_http_client
+from database import db
+from clock import clock
+from config import (
+    MOEX_BASE_URL,
+    MOEX_TIMEOUT,
+    SUPPORTED_STOCKS,
+    INSTRUMENTS_REFRESH_HOURS,
+    INSTRUMENTS_DEFAULT_EMOJI
+)
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentRegistry:
+    """
+    Реестр акций TQBR: название, размер лота, режим торгов и статус из ISS.
+
+    Метаданные хранятся в PostgreSQL и раз в сутки обновляются из ISS
+    (один запрос к доске TQBR). В памяти — только эти строки: свечи,
+    индикаторы, снимки и подписки заводятся по тикеру при первом обращении.
+    Пока реестр не загружен (бэктест, replay, недоступная БД), известны
+    акции из SUPPORTED_STOCKS.
+    """
+
+    def __init__(self):
+        self.base_url = MOEX_BASE_URL
+        self.timeout = MOEX_TIMEOUT
+        self._instruments: Dict[str, Instrument] = {}
+
+    def get(self, ticker: str) -> Optional[Instrument]:
+        """Инструмент по тикеру (None — неизвестный тикер)"""
+        ticker = ticker.upper()
+        instrument = self._instruments.get(ticker)
+        if instrument is None and ticker in SUPPORTED_STOCKS:
+            info = SUPPORTED_STOCKS[ticker]
+            instrument = Instrument(ticker=ticker, name=info['name'], lot_size=info['lot_size'], emoji=info['emoji'])
+        return instrument
+
+    def is_supported(self, ticker: str) -> bool:
+        """По тикеру можно получать данные и подписываться"""
+        instrument = self.get(ticker)
+        return instrument is not None and instrument.is_traded
+
+    def name(self, ticker: str) -> str:
+        instrument = self.get(ticker)
+        return instrument.name if instrument else ticker
+
+    def emoji(self, ticker: str) -> str:
+        instrument = self.get(ticker)
+        return instrument.emoji if instrument else INSTRUMENTS_DEFAULT_EMOJI
+
+    def lot_size(self, ticker: str) -> int:
+        instrument = self.get(ticker)
+        return instrument.lot_size if instrument else 1
+
+    def featured(self) -> List[Instrument]:
+        """Избранные акции из SUPPORTED_STOCKS (меню бота)"""
+        return [self.get(ticker) for ticker in SUPPORTED_STOCKS]
+
+    async def load(self, refresh_if_stale: bool = True):
+        """
+        Реестр из БД; если он пуст или устарел — обновление из ISS.
+
+        refresh_if_stale=False — только чтение БД (старт веб-воркеров не ждёт ISS).
+        """
+        try:
+            rows = await db.get_instruments()
+            self._replace(rows)
+            logger.info(f"📇 Instrument registry loaded: {len(rows)} instruments")
+
+            stale_before = clock.now() - timedelta(hours=INSTRUMENTS_REFRESH_HOURS)
+            if refresh_if_stale and (not rows or max(row['updated_at'] for row in rows) < stale_before):
+                await self.refresh()
+        except Exception as e:
+            logger.error(f"❌ Failed to load instrument registry: {e}")
+
+    async def refresh(self) -> bool:
+        """Метаданные акций TQBR из ISS → БД и память"""
+        try:
+            rows = await self._fetch_securities()
+            if not rows:
+                logger.warning("⚠️ ISS returned no TQBR securities, registry unchanged")
+                return False
+
+            await db.save_instruments(rows)
+            self._replace(rows)
+            logger.info(f"✅ Instrument registry refreshed: {len(rows)} instruments")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Failed to refresh instrument registry: {e}")
+            return False
+
+    async def _fetch_securities(self) -> List[Dict[str, Any]]:
+        url = f"{self.base_url}/engines/stock/markets/shares/boards/TQBR/securities.json"
+        params = {
+            'iss.meta': 'off',
+            'iss.only': 'securities',
+            'securities.columns': 'SECID,SHORTNAME,SECNAME,LOTSIZE,BOARDID,STATUS'
+        }
+
+        response = await get_http_client().get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()['securities']
+
+        rows = []
+        for values in data['data']:
+            record = dict(zip(data['columns'], values))
+            rows.append({
+                'ticker': record['SECID'],
+                'name': record['SHORTNAME'] or record['SECID'],
+                'full_name': record['SECNAME'],
+                'lot_size': int(record['LOTSIZE'] or 1),
+                'board': record['BOARDID'],
+                'status': record['STATUS'] or 'A',
+            })
+        return rows
+
+    def _replace(self, rows: List[Dict[str, Any]]):
+        """Новый набор инструментов; название и эмодзи избранных акций — из SUPPORTED_STOCKS"""
+        instruments = {}
+        for row in rows:
+            featured = SUPPORTED_STOCKS.get(row['ticker'], {})
+            instruments[row['ticker']] = Instrument(
+                ticker=row['ticker'],
+                name=featured.get('name', row['name']),
+                lot_size=row['lot_size'],
+                board=row['board'],
+                status=row['status'],
+                full_name=row['full_name'],
+                emoji=featured.get('emoji', INSTRUMENTS_DEFAULT_EMOJI)
+            )
+        self._instruments = instruments
+
+
+# Глобальный экземпляр
+instruments = InstrumentRegistry()
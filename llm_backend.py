@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Dict, Any, AsyncIterator, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from config import (
+    LLM_BACKEND,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    LLM_STUB_LATENCY_SECONDS,
+    LLM_STUB_JITTER_SECONDS,
+    LLM_STUB_ERROR_RATE,
+    LLM_STUB_CHUNK_DELAY_SECONDS,
+    GPT_REQUEST_TIMEOUT_SECONDS,
+    GPT_MAX_RETRIES
+)
+from formatters import MessageFormatter
+
+logger = logging.getLogger(__name__)
+
+
+def create_llm_client():
+    """
+    Клиент LLM по настройке LLM_BACKEND.
+
+    'openai' — AsyncOpenAI (OPENAI_BASE_URL позволяет указать совместимый сервер,
+    например llm_stub_server.py); 'stub' — заглушка в процессе, без сети.
+    У обоих один интерфейс: client.chat.completions.create(...).
+    """
+    if LLM_BACKEND == 'stub':
+        logger.info("🧪 LLM backend: in-process stub")
+        return StubLLMClient(StubProfile.from_config())
+
+    if OPENAI_BASE_URL:
+        logger.info(f"LLM backend: OpenAI-compatible server at {OPENAI_BASE_URL}")
+    # Локальному совместимому серверу ключ не нужен, но SDK требует непустой
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY or "local",
+        base_url=OPENAI_BASE_URL,
+        # Общий дедлайн задаёт GPTAnalyst; SDK не должен ретраить дольше него
+        timeout=GPT_REQUEST_TIMEOUT_SECONDS,
+        max_retries=GPT_MAX_RETRIES
+    )
+
+
+@dataclass
+class StubProfile:
+    """Поведение заглушки: задержка ответа, доля ошибок, скорость потока"""
+    latency_seconds: float = 1.0
+    jitter_seconds: float = 0.0
+    error_rate: float = 0.0
+    chunk_delay_seconds: float = 0.05
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_config(cls) -> 'StubProfile':
+        return cls(
+            latency_seconds=LLM_STUB_LATENCY_SECONDS,
+            jitter_seconds=LLM_STUB_JITTER_SECONDS,
+            error_rate=LLM_STUB_ERROR_RATE,
+            chunk_delay_seconds=LLM_STUB_CHUNK_DELAY_SECONDS
+        )
+
+
+class StubLLMError(openai.APIConnectionError):
+    """Искусственный сбой заглушки (клиент видит его как ошибку соединения)"""
+
+    def __init__(self):
+        super().__init__(
+            message="Stub LLM injected failure",
+            request=httpx.Request("POST", "http://llm-stub/v1/chat/completions")
+        )
+
+
+class StubLLMClient:
+    """
+    Заглушка OpenAI-клиента: детерминированные ответы из 3 строк
+    по индикаторам из промпта, с настраиваемой задержкой, ошибками и потоком.
+    """
+
+    def __init__(self, profile: Optional[StubProfile] = None):
+        self.profile = profile or StubProfile()
+        self.chat = _StubChat(self)
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(self.profile.seed)
+
+    async def close(self):
+        pass
+
+    async def complete(self, **kwargs):
+        """Аналог chat.completions.create"""
+        self.requests += 1
+        await asyncio.sleep(self._latency())
+
+        if self._random.random() < self.profile.error_rate:
+            self.failures += 1
+            raise StubLLMError()
+
+        messages = kwargs.get('messages', [])
+        model = kwargs.get('model', 'stub')
+        if kwargs.get('response_format', {}).get('type') == 'json_schema':
+            content = stub_batch_answer(messages)
+        else:
+            content = stub_answer(messages)
+
+        if kwargs.get('stream'):
+            return self._stream(content, model)
+        return _completion(content, model, messages)
+
+    def _latency(self) -> float:
+        jitter = self._random.uniform(-self.profile.jitter_seconds, self.profile.jitter_seconds)
+        return max(0.0, self.profile.latency_seconds + jitter)
+
+    async def _stream(self, content: str, model: str) -> AsyncIterator[ChatCompletionChunk]:
+        completion_id = _completion_id(content)
+        created = int(time.time())
+        for piece in re.findall(r'\S+\s*', content):
+            await asyncio.sleep(self.profile.chunk_delay_seconds)
+            yield _chunk(completion_id, created, model, {"content": piece}, None)
+        yield _chunk(completion_id, created, model, {}, "stop")
+
+
+class _StubChat:
+    def __init__(self, client: StubLLMClient):
+        self.completions = _StubCompletions(client)
+
+
+class _StubCompletions:
+    def __init__(self, client: StubLLMClient):
+        self._client = client
+
+    async def create(self, **kwargs):
+        return await self._client.complete(**kwargs)
+
+
+def stub_answer(messages: List[Dict[str, str]]) -> str:
+    """Ответ из 3 строк по последнему пользовательскому сообщению"""
+    return _analysis_for_block(_user_content(messages))
+
+
+def stub_batch_answer(messages: List[Dict[str, str]]) -> str:
+    """JSON-ответ пакетного запроса: анализ для каждого блока акции"""
+    analyses = []
+    for block in _user_content(messages).split("\n\n"):
+        if block.strip():
+            analyses.append({
+                "ticker": block.split()[0],
+                "analysis": _analysis_for_block(block)
+            })
+    return json.dumps({"analyses": analyses}, ensure_ascii=False)
+
+
+def _user_content(messages: List[Dict[str, str]]) -> str:
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            return message.get('content', '')
+    return ''
+
+
+def _number(pattern: str, text: str) -> Optional[float]:
+    match = re.search(pattern, text)
+    return float(match.group(1)) if match else None
+
+
+def _analysis_for_block(block: str) -> str:
+    price = _number(r'Цена\s+([\d.]+)', block)
+    ema = _number(r'EMA20\s+([\d.]+)', block)
+    adx = _number(r'ADX\s+([\d.]+)', block)
+    di_plus = _number(r'DI\+\s+([\d.]+)', block)
+    di_minus = _number(r'DI-\s+([\d.]+)', block)
+
+    if None in (price, ema, adx, di_plus, di_minus):
+        return (
+            "📊 Данных недостаточно для оценки тренда.\n"
+            "🤖 Сигнала нет.\n"
+            "💡 ЖДАТЬ обновления данных."
+        )
+
+    return MessageFormatter.format_rule_based_analysis(price, ema, adx, di_plus, di_minus)
+
+
+def _completion_id(content: str) -> str:
+    return "chatcmpl-stub-" + hashlib.blake2b(content.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def _completion(content: str, model: str, messages: List[Dict[str, str]]) -> ChatCompletion:
+    prompt_chars = sum(len(m.get('content', '')) for m in messages)
+    return ChatCompletion.model_validate({
+        "id": _completion_id(content),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content}
+        }],
+        "usage": {
+            "prompt_tokens": prompt_chars // 3,
+            "completion_tokens": len(content) // 3,
+            "total_tokens": (prompt_chars + len(content)) // 3
+        }
+    })
+
+
+def _chunk(completion_id: str, created: int, model: str, delta: Dict[str, Any], finish_reason) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    })
@@ -0,0 +1,87 @@
+"""
+Локальный OpenAI-совместимый сервер-заглушка для GPTAnalyst.
+
+Запуск:
+    python llm_stub_server.py --port 8100 --latency 2 --error-rate 0.1
+
+Бот направляется на него через OPENAI_BASE_URL=http://localhost:8100/v1.
+"""
+import argparse
+import logging
+import os
+
+# Заглушке не нужны ключи бота и база — только чтобы config импортировался
+os.environ.setdefault('TELEGRAM_TOKEN', 'llm-stub')
+os.environ.setdefault('DATABASE_URL', 'postgresql://llm-stub')
+os.environ.setdefault('LLM_BACKEND', 'stub')
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from llm_backend import StubLLMClient, StubProfile, StubLLMError
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def create_app(profile: StubProfile) -> FastAPI:
+    """FastAPI приложение с эндпоинтом /v1/chat/completions"""
+    app = FastAPI(title="LLM Stub")
+    client = StubLLMClient(profile)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        try:
+            result = await client.complete(**body)
+        except StubLLMError:
+            return JSONResponse(
+                {"error": {"message": "Stub LLM injected failure", "type": "server_error"}},
+                status_code=500
+            )
+
+        if not body.get('stream'):
+            return JSONResponse(result.model_dump(exclude_none=True))
+
+        async def events():
+            async for chunk in result:
+                yield f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": client.requests, "failures": client.failures}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM stub server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=1.0, help="Задержка ответа, секунды")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Разброс задержки, секунды")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов с ошибкой 500")
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help="Пауза между чанками потока")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    profile = StubProfile(
+        latency_seconds=args.latency,
+        jitter_seconds=args.jitter,
+        error_rate=args.error_rate,
+        chunk_delay_seconds=args.chunk_delay,
+        seed=args.seed
+    )
+    logger.info(f"🧪 LLM stub on http://{args.host}:{args.port}/v1 ({profile})")
+    uvicorn.run(create_app(profile), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
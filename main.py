@@ -1,12 +1,8 @@
 import logging
-from datetime import time as dt_time
 from telegram import Update
-from telegram.ext import Application
 
-from config import TELEGRAM_TOKEN, MONITOR_INTERVAL_MINUTES
-from telegram_handlers import TelegramHandlers
-from scheduler import SignalMonitor
-from database import db
+from config import MONITOR_INTERVAL_MINUTES, BOT_MODE, WEB_PORT
+from bot_app import build_application
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,46 +12,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def post_init(application: Application):
-    """Инициализация после запуска бота"""
-    await db.connect()
-    logger.info("✅ Database connected")
-
+def main():
+    """Основная функция запуска бота"""
+    if BOT_MODE == 'webhook':
+        # Бот, мониторинг и дашборд в одном процессе: апдейты приходят в FastAPI
+        import uvicorn
 
-async def post_shutdown(application: Application):
-    """Завершение работы"""
-    await db.disconnect()
-    logger.info("👋 Database disconnected")
+        logger.info("🤖 Revushiy Kotenok Bot: webhook mode, serving bot and dashboard")
+        uvicorn.run("web_dashboard:app", host="0.0.0.0", port=WEB_PORT, reload=False, workers=1)
+        return
 
+    application = build_application()
 
-def main():
-    """Основная функция запуска бота"""
-    application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
-    
-    handlers = TelegramHandlers()
-    
-    for handler in handlers.get_handlers():
-        application.add_handler(handler)
-    
-    application.add_error_handler(handlers.error_handler)
-    
-    monitor = SignalMonitor()
-    
-    job_queue = application.job_queue
-    
-    # Проверка сигналов каждые N минут
-    job_queue.run_repeating(
-        monitor.check_signals,
-        interval=MONITOR_INTERVAL_MINUTES * 60,
-        first=60
-    )
-    
-    # Ежедневный расчёт индекса страха и жадности в 19:00 МСК (16:00 UTC)
-    job_queue.run_daily(
-        monitor.update_fear_greed_index,
-        time=dt_time(hour=16, minute=0),
-    )
-    
     logger.info(f"🤖 Revushiy Kotenok Bot started!")
     logger.info(f"📊 Signal monitoring every {MONITOR_INTERVAL_MINUTES} minutes")
     logger.info(f"📊 Fear & Greed Index: daily update at 19:00 MSK")
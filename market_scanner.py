@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+
+from moex_api import MoexApiClient, get_http_client
+from indicators import TechnicalIndicators
+from signals import SignalDetector
+from models import SignalType
+from cache import cache
+from instruments import instruments
+from clock import clock
+from singleflight import SingleFlight
+from config import (
+    MOEX_BASE_URL,
+    MOEX_TIMEOUT,
+    MAX_CANDLES,
+    ADX_THRESHOLD,
+    DI_PLUS_THRESHOLD,
+    SCANNER_MIN_TURNOVER,
+    SCANNER_MAX_INSTRUMENTS,
+    SCANNER_CONCURRENCY,
+    SCANNER_TICK_BUDGET_SECONDS,
+    SCANNER_CACHE_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Ключ последнего скана в общем кэше (бот публикует, дашборд читает)
+SCANNER_CACHE_KEY = 'scanner:latest'
+
+_scan_flight = SingleFlight('market_scanner.scan')
+
+
+@dataclass
+class ScannerInstrument:
+    """Акция TQBR в сканере: свечи хранятся массивами high/low/close"""
+    ticker: str
+    name: str
+    lot_size: int
+    hlc: np.ndarray = field(default_factory=lambda: np.empty((3, 0)))
+    last_candle_time: Optional[np.datetime64] = None  # Начало последней свечи
+    loaded_hour: Optional[datetime] = None  # Час, в котором свечи последний раз запрашивались
+    last_price: Optional[float] = None
+    change_percent: Optional[float] = None
+    turnover: float = 0.0
+
+
+class MarketScanner:
+    """
+    Сканер ADX/DI по всем ликвидным акциям TQBR.
+
+    Список акций, цены и обороты приходят одним запросом к доске TQBR.
+    Часовые свечи каждой акции запрашиваются не чаще раза в час (догрузка
+    с даты последней свечи), между запросами текущая свеча обновляется
+    по последней цене. Индикаторы считаются одним проходом по 2-D массиву
+    "акции × последние MAX_CANDLES свечей".
+    """
+
+    def __init__(self):
+        self.moex_client = MoexApiClient()
+        self.base_url = MOEX_BASE_URL
+        self.timeout = MOEX_TIMEOUT
+        self._instruments: Dict[str, ScannerInstrument] = {}
+        self.last_scan: Optional[Dict[str, Any]] = None
+
+    async def scan(self) -> Optional[Dict[str, Any]]:
+        """Скан рынка (одновременные вызовы получают один результат)"""
+        return await _scan_flight.do('scan', self._scan)
+
+    async def get_latest(self) -> Optional[Dict[str, Any]]:
+        """
+        Последний скан из общего кэша (или последний скан этого процесса).
+
+        Только чтение: сканирует задача scan_market, а не HTTP-запрос или
+        команда бота. None — скана ещё нет.
+        """
+        scan = await cache.get(SCANNER_CACHE_KEY)
+        return scan if scan is not None else self.last_scan
+
+    async def _scan(self) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+
+        try:
+            universe = await self._load_universe()
+            if not universe:
+                return self.last_scan
+
+            current_hour = clock.now().replace(minute=0, second=0, microsecond=0)
+            stale = [inst for inst in universe if inst.loaded_hour != current_hour]
+            semaphore = asyncio.Semaphore(SCANNER_CONCURRENCY)
+
+            async def load(inst: ScannerInstrument):
+                async with semaphore:
+                    await self._load_candles(inst, current_hour)
+
+            await asyncio.gather(*(load(inst) for inst in stale))
+            fetched = time.perf_counter()
+
+            for inst in universe:
+                self._apply_last_price(inst, current_hour)
+
+            rows = self._rank(universe)
+            duration = time.perf_counter() - started
+
+            result = {
+                'computed_at': clock.now(),
+                'duration_seconds': round(duration, 3),
+                'instruments': len(universe),
+                'ranked': len(rows),
+                'candle_requests': len(stale),
+                'rows': rows,
+            }
+            self.last_scan = result
+            await cache.set(SCANNER_CACHE_KEY, result, SCANNER_CACHE_TTL_SECONDS)
+
+            logger.info(
+                f"🔭 Market scan: {len(rows)}/{len(universe)} instruments ranked in {duration:.2f}s "
+                f"({len(stale)} candle requests {fetched - started:.2f}s, "
+                f"indicators {duration - (fetched - started):.3f}s)"
+            )
+            if duration > SCANNER_TICK_BUDGET_SECONDS:
+                logger.warning(f"⚠️ Market scan took {duration:.1f}s (budget {SCANNER_TICK_BUDGET_SECONDS}s)")
+
+            return result
+
+        except Exception as e:
+            logger.error(f"Error in market scan: {e}", exc_info=True)
+            return self.last_scan
+
+    async def _load_universe(self) -> Optional[List[ScannerInstrument]]:
+        """Ликвидные акции TQBR с ценой и оборотом за день (один запрос)"""
+        try:
+            url = f"{self.base_url}/engines/stock/markets/shares/boards/TQBR/securities.json"
+            params = {
+                'iss.meta': 'off',
+                'iss.only': 'securities,marketdata',
+                'securities.columns': 'SECID,SHORTNAME,LOTSIZE',
+                'marketdata.columns': 'SECID,LAST,LASTTOPREVPRICE,VALTODAY'
+            }
+
+            response = await get_http_client().get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+
+            securities = {}
+            for row in data['securities']['data']:
+                record = dict(zip(data['securities']['columns'], row))
+                securities[record['SECID']] = record
+
+            market = []
+            for row in data['marketdata']['data']:
+                record = dict(zip(data['marketdata']['columns'], row))
+                if record['SECID'] in securities and (record['VALTODAY'] or 0) >= SCANNER_MIN_TURNOVER:
+                    market.append(record)
+
+            market.sort(key=lambda record: record['VALTODAY'], reverse=True)
+
+            universe = []
+            for record in market[:SCANNER_MAX_INSTRUMENTS]:
+                ticker = record['SECID']
+                inst = self._instruments.get(ticker)
+                if inst is None:
+                    security = securities[ticker]
+                    inst = ScannerInstrument(
+                        ticker=ticker,
+                        name=security['SHORTNAME'],
+                        lot_size=int(security['LOTSIZE'] or 1)
+                    )
+                    self._instruments[ticker] = inst
+
+                inst.last_price = float(record['LAST']) if record['LAST'] else None
+                inst.change_percent = float(record['LASTTOPREVPRICE']) if record['LASTTOPREVPRICE'] is not None else None
+                inst.turnover = float(record['VALTODAY'])
+                universe.append(inst)
+
+            logger.info(f"🔭 Scanner universe: {len(universe)} of {len(securities)} TQBR shares")
+            return universe
+
+        except Exception as e:
+            logger.error(f"Error loading TQBR universe for scanner: {e}")
+            return None
+
+    async def _load_candles(self, inst: ScannerInstrument, current_hour: datetime):
+        """Часовые свечи акции: полная загрузка в первый раз, дальше догрузка с даты последней свечи"""
+        if inst.last_candle_time is None:
+            candles = await self.moex_client.get_historical_candles(inst.ticker)
+        else:
+            since = inst.last_candle_time.astype(datetime).date()
+            candles = await self.moex_client.get_candles_range(inst.ticker, since, current_hour.date())
+
+        if not candles:
+            return
+
+        # Свечи с последней известной включительно заменяются свежими (она могла быть незакрытой)
+        new = np.stack([candles.high, candles.low, candles.close])
+        if inst.last_candle_time is not None:
+            kept = inst.hlc.shape[1] - int(np.count_nonzero(candles.time <= inst.last_candle_time))
+            new = np.concatenate([inst.hlc[:, :max(kept, 0)], new], axis=1)
+
+        inst.hlc = new[:, -MAX_CANDLES:]
+        inst.last_candle_time = candles.time[-1]
+        inst.loaded_hour = current_hour
+
+    @staticmethod
+    def _apply_last_price(inst: ScannerInstrument, current_hour: datetime):
+        """Текущая часовая свеча продолжается по последней цене сделки"""
+        if inst.last_price is None or inst.last_candle_time is None:
+            return
+        if inst.last_candle_time < np.datetime64(current_hour, 's'):
+            return
+
+        high, low, close = inst.hlc[:, -1]
+        inst.hlc[:, -1] = (max(high, inst.last_price), min(low, inst.last_price), inst.last_price)
+
+    @staticmethod
+    def _rank(universe: List[ScannerInstrument]) -> List[Dict[str, Any]]:
+        """
+        Индикаторы по всем акциям одним расчётом и рейтинг сетапов LONG.
+
+        Оценка — запас до порога у самого слабого из условий входа
+        (ADX и DI-): положительная, когда сигнал BUY уже есть, и тем ближе
+        к нулю, чем ближе акция к сигналу.
+        """
+        ready = [inst for inst in universe if inst.hlc.shape[1] >= MAX_CANDLES]
+        if not ready:
+            return []
+
+        hlc = np.stack([inst.hlc[:, -MAX_CANDLES:] for inst in ready])
+        indicators = TechnicalIndicators.calculate_batch(hlc[:, 0], hlc[:, 1], hlc[:, 2])
+        signals = SignalDetector.detect_signal_series(
+            indicators['adx'], indicators['di_plus'], indicators['di_minus'],
+            ema20=indicators['ema20'], price=hlc[:, 2, -1]
+        )
+        scores = np.minimum(indicators['adx'] - ADX_THRESHOLD, indicators['di_minus'] - DI_PLUS_THRESHOLD)
+
+        rows = []
+        for i in np.argsort(-scores, kind='stable'):
+            inst = ready[i]
+            rows.append({
+                'ticker': inst.ticker,
+                'name': inst.name,
+                'emoji': instruments.emoji(inst.ticker),
+                'lot_size': inst.lot_size,
+                'price': inst.last_price if inst.last_price is not None else float(hlc[i, 2, -1]),
+                'change_percent': inst.change_percent,
+                'turnover': inst.turnover,
+                'ema20': float(indicators['ema20'][i]),
+                'adx': float(indicators['adx'][i]),
+                'di_plus': float(indicators['di_plus'][i]),
+                'di_minus': float(indicators['di_minus'][i]),
+                'signal': signals[i] or SignalType.NONE.value,
+                'score': float(scores[i]),
+            })
+        return rows
+
+
+# Глобальный экземпляр
+market_scanner = MarketScanner()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from dataclasses import replace
+from typing import Optional, Dict
+
+from models import MarketSnapshot, StockData, Signal
+from stock_service import StockService
+from signals import SignalDetector
+from cache import cache
+from clock import clock
+from config import SNAPSHOT_REFRESH_AFTER_SECONDS, SNAPSHOT_MAX_STALE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CACHE_PREFIX = 'snapshot:'
+
+
+class MarketSnapshotCache:
+    """
+    Общий кэш снимков рынка по тикерам (stale-while-revalidate).
+
+    Монитор сигналов публикует снимок после каждого расчёта, обработчики
+    Telegram читают его. Снимки лежат в общем кэше (cache.py), так что бот и
+    дашборд в разных процессах видят одни и те же. Свежий снимок отдаётся
+    сразу, устаревший — тоже сразу, но с фоновым обновлением; слишком старый
+    (истёк в кэше) или отсутствующий пересчитывается. Одновременные
+    обновления одного тикера в процессе сводятся в один запрос к MOEX.
+    """
+
+    def __init__(
+        self,
+        refresh_after: float = SNAPSHOT_REFRESH_AFTER_SECONDS,
+        max_stale: float = SNAPSHOT_MAX_STALE_SECONDS
+    ):
+        self.refresh_after = refresh_after
+        self.max_stale = max_stale
+        self.stock_service = StockService()
+        self.signal_detector = SignalDetector()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    async def publish(self, stock_data: StockData, signals: Dict[str, Signal]) -> MarketSnapshot:
+        """Сохранение свежего снимка (вызывается монитором и при обновлении)"""
+        # Копия: тот же StockData single-flight отдаёт всем одновременным
+        # вызывающим (например, тику монитора с сигналами по состояниям)
+        stock_data = replace(stock_data, signals=signals)
+        snapshot = MarketSnapshot(
+            ticker=stock_data.info.ticker,
+            stock_data=stock_data,
+            signals=signals,
+            computed_at=clock.now()
+        )
+        await cache.set(SNAPSHOT_CACHE_PREFIX + snapshot.ticker, snapshot, self.max_stale)
+        return snapshot
+
+    async def get(self, ticker: str) -> Optional[MarketSnapshot]:
+        """Снимок по тикеру с учётом свежести"""
+        ticker = ticker.upper()
+        snapshot = await cache.get(SNAPSHOT_CACHE_PREFIX + ticker)
+
+        if snapshot:
+            age = snapshot.age_seconds(clock.now())
+            if age <= self.refresh_after:
+                return snapshot
+            if age <= self.max_stale:
+                logger.info(f"📸 Snapshot {ticker} is {age:.0f}s old, serving stale and refreshing in background")
+                self._start_refresh(ticker)
+                return snapshot
+
+        return await self.refresh(ticker)
+
+    async def refresh(self, ticker: str) -> Optional[MarketSnapshot]:
+        """
+        Принудительный пересчёт снимка (один на тикер одновременно).
+
+        Если MOEX вернул недостаточно данных, возвращается неопубликованный
+        снимок с невалидными stock_data (is_valid() == False); если запрос
+        не удался — последний снимок из кэша (по computed_at видно, что он старый).
+        """
+        task = self._start_refresh(ticker.upper())
+        return await asyncio.shield(task)
+
+    def _start_refresh(self, ticker: str) -> asyncio.Task:
+        task = self._refreshing.get(ticker)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh(ticker))
+            self._refreshing[ticker] = task
+        return task
+
+    async def _refresh(self, ticker: str) -> Optional[MarketSnapshot]:
+        try:
+            stock_data = await self.stock_service.get_stock_data(ticker)
+            if not stock_data:
+                logger.warning(f"📸 Snapshot refresh for {ticker} returned no data, serving previous snapshot")
+                return await cache.get(SNAPSHOT_CACHE_PREFIX + ticker)
+
+            if not stock_data.is_valid():
+                logger.warning(f"📸 Snapshot refresh for {ticker}: not enough data for indicators")
+                return MarketSnapshot(ticker=ticker, stock_data=stock_data, signals={}, computed_at=clock.now())
+
+            signals = self.signal_detector.detect_signals(stock_data)
+            return await self.publish(stock_data, signals)
+        except Exception as e:
+            logger.error(f"Error refreshing snapshot for {ticker}: {e}, serving previous snapshot", exc_info=True)
+            return await cache.get(SNAPSHOT_CACHE_PREFIX + ticker)
+        finally:
+            self._refreshing.pop(ticker, None)
+
+
+# Глобальный экземпляр
+market_snapshots = MarketSnapshotCache()
@@ -1,10 +1,12 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Dict
 from datetime import datetime
 from enum import Enum
 
 import pandas as pd
 
+from candles import CandleSeries
+
 
 class SignalType(Enum):
     """Типы сигналов"""
@@ -46,12 +48,33 @@ class StockInfo:
     emoji: str
 
 
+@dataclass
+class Instrument:
+    """Инструмент из реестра (метаданные ISS: SHORTNAME, LOTSIZE, BOARDID, STATUS)"""
+    ticker: str
+    name: str
+    lot_size: int
+    board: str = 'TQBR'
+    status: str = 'A'
+    full_name: Optional[str] = None
+    emoji: str = '📊'
+    
+    @property
+    def is_traded(self) -> bool:
+        """Торги по инструменту идут (STATUS = 'A')"""
+        return self.status == 'A'
+
+
 @dataclass
 class StockData:
     """Полные данные по акции"""
     info: StockInfo
     price: StockPrice
     technical: TechnicalData
+    candles: Optional[CandleSeries] = None  # Свечи, по которым посчитаны индикаторы
+    htf_technical: Optional[TechnicalData] = None  # Индикаторы старшего таймфрейма для подтверждения входа
+    htf_timeframe: Optional[str] = None
+    signals: Optional[Dict[str, 'Signal']] = None  # Сигналы правил для карточки (заполняет снимок рынка)
     
     def is_valid(self) -> bool:
         """Проверка на валидность данных"""
@@ -118,3 +141,16 @@ class Position:
                 # SHORT: прибыль при падении цены
                 return ((self.entry_price - current_price) / self.entry_price) * 100
         return self.profit_percent or 0.0
+
+
+@dataclass
+class MarketSnapshot:
+    """Снимок рынка по акции: данные, индикаторы и сигналы на момент расчёта"""
+    ticker: str
+    stock_data: StockData
+    signals: Dict[str, Signal]
+    computed_at: datetime
+    
+    def age_seconds(self, now: datetime) -> float:
+        """Возраст снимка в секундах"""
+        return (now - self.computed_at).total_seconds()
@@ -1,13 +1,40 @@
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Any
 
 import httpx
 
-from config import MOEX_BASE_URL, MOEX_TIMEOUT, HISTORY_DAYS
+from config import MOEX_BASE_URL, MOEX_TIMEOUT, HISTORY_DAYS, MOEX_CANDLES_PAGE_SIZE
+from candles import CandleSeries
+from singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# Общие для всех клиентов группы: одинаковые одновременные запросы к MOEX схлопываются
+_price_flight = SingleFlight('moex.get_current_price')
+_candles_flight = SingleFlight('moex.get_historical_candles')
+
+# Общий HTTP-клиент: keep-alive соединения к ISS переиспользуются между запросами
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """HTTP-клиент к MOEX ISS, общий для бота, монитора и дашборда"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=MOEX_TIMEOUT,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 class MoexApiClient:
     """Клиент для работы с MOEX API"""
@@ -18,6 +45,10 @@ class MoexApiClient:
     
     async def get_current_price(self, ticker: str) -> Optional[float]:
         """Получение актуальной цены акции"""
+        return await _price_flight.do(ticker, lambda: self._fetch_current_price(ticker))
+    
+    async def _fetch_current_price(self, ticker: str) -> Optional[float]:
+        """Запрос актуальной цены акции к MOEX"""
         try:
             url = f"{self.base_url}/engines/stock/markets/shares/boards/TQBR/securities/{ticker}.json"
             params = {
@@ -26,10 +57,9 @@ class MoexApiClient:
                 'marketdata.columns': 'LAST,BID,OFFER,TIME'
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                response.raise_for_status()
-                data = response.json()
+            response = await get_http_client().get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
             
             if 'marketdata' in data and 'data' in data['marketdata'] and data['marketdata']['data']:
                 columns = data['marketdata']['columns']
@@ -51,8 +81,16 @@ class MoexApiClient:
             logger.error(f"Error fetching current {ticker} price: {e}")
             return None
     
-    async def get_historical_candles(self, ticker: str, days: int = HISTORY_DAYS) -> Optional[List[Dict[str, Any]]]:
-        """Получение исторических свечей"""
+    async def get_historical_candles(
+        self, ticker: str, days: int = HISTORY_DAYS, interval: int = 60
+    ) -> Optional[CandleSeries]:
+        """Получение исторических свечей (interval — интервал ISS: 1, 10, 60 минут или 24 — день)"""
+        return await _candles_flight.do(
+            (ticker, days, interval), lambda: self._fetch_historical_candles(ticker, days, interval)
+        )
+    
+    async def _fetch_historical_candles(self, ticker: str, days: int, interval: int) -> Optional[CandleSeries]:
+        """Запрос исторических свечей к MOEX"""
         try:
             to_date = datetime.now()
             from_date = to_date - timedelta(days=days)
@@ -61,36 +99,22 @@ class MoexApiClient:
             params = {
                 'from': from_date.strftime('%Y-%m-%d'),
                 'till': to_date.strftime('%Y-%m-%d'),
-                'interval': '60'  # Часовые свечи
+                'interval': str(interval)
             }
             
             logger.info(f"Запрашиваем исторические данные {ticker} с {from_date.strftime('%Y-%m-%d')} по {to_date.strftime('%Y-%m-%d')}")
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                response.raise_for_status()
-                data = response.json()
+            response = await get_http_client().get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
             
             if 'candles' not in data or not data['candles']['data']:
                 logger.error(f"No candle data received for {ticker}")
                 return None
             
-            columns = data['candles']['columns']
-            candles_raw = data['candles']['data']
-            
-            # Преобразуем в удобный формат
-            candles_data = []
-            for candle in candles_raw:
-                candles_data.append({
-                    'open': float(candle[0]),
-                    'close': float(candle[1]),
-                    'high': float(candle[2]),
-                    'low': float(candle[3]),
-                    'volume': int(candle[5]),
-                    'time': candle[6]
-                })
+            candles_data = CandleSeries.from_iss(data['candles']['data'], data['candles']['columns'])
             
-            logger.info(f"Получено {len(candles_data)} часовых свечей для {ticker}")
+            logger.info(f"Получено {len(candles_data)} свечей {ticker} (интервал {interval})")
             return candles_data
             
         except httpx.HTTPError as e:
@@ -99,3 +123,47 @@ class MoexApiClient:
         except Exception as e:
             logger.error(f"Error fetching {ticker} historical data: {e}")
             return None
+    
+    async def get_candles_range(
+        self, ticker: str, from_date: date, till_date: date, interval: int = 60
+    ) -> Optional[CandleSeries]:
+        """
+        Свечи за произвольный период (для бэктеста).
+        
+        ISS отдаёт свечи страницами по MOEX_CANDLES_PAGE_SIZE, поэтому
+        страницы запрашиваются по очереди через параметр start, а строки
+        всех страниц разбираются в колонки один раз в конце.
+        """
+        try:
+            url = f"{self.base_url}/engines/stock/markets/shares/securities/{ticker}/candles.json"
+            rows: List[List[Any]] = []
+            columns = None
+            
+            while True:
+                params = {
+                    'from': from_date.strftime('%Y-%m-%d'),
+                    'till': till_date.strftime('%Y-%m-%d'),
+                    'interval': str(interval),
+                    'start': len(rows),
+                    'iss.meta': 'off'
+                }
+                response = await get_http_client().get(url, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                block = response.json().get('candles', {})
+                page = block.get('data') or []
+                columns = columns or block.get('columns')
+                
+                rows.extend(page)
+                if len(page) < MOEX_CANDLES_PAGE_SIZE:
+                    break
+            
+            candles_data = CandleSeries.from_iss(rows, columns)
+            logger.info(f"Получено {len(candles_data)} свечей {ticker} с {from_date} по {till_date}")
+            return candles_data
+            
+        except httpx.HTTPError as e:
+            logger.error(f"MOEX API request error for {ticker} candles range: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching {ticker} candles range: {e}")
+            return None
@@ -0,0 +1,315 @@
+"""
+Локальный заменитель MOEX ISS на записанных ответах.
+
+Запись (нужна сеть, один раз):
+    python moex_stub_server.py record --days 30
+
+Сохраняет ответы ISS для эндпоинтов, которые использует бот: marketdata и
+свечи акций из SUPPORTED_STOCKS (часовые, дневные и базового интервала
+CANDLE_BASE_INTERVAL свечного движка), список TQBR (ширина рынка), дневные свечи
+IMOEX и USD000UTSTOM. Файлы лежат в MOEX_FIXTURES_DIR по путям ISS.
+
+Воспроизведение:
+    python moex_stub_server.py serve --port 8200 --latency 0.05 --error-rate 0.05 --page-size 500
+
+Бот, дашборд и бэктест направляются на него через
+MOEX_BASE_URL=http://localhost:8200/iss. Свечи фильтруются по from/till и
+отдаются страницами по --page-size (параметр start), как в ISS; клиенты ждут
+страницы размера MOEX_CANDLES_PAGE_SIZE, поэтому при другом --page-size задайте
+ту же переменную окружения и боту. С --shift-to-today
+записанные свечи сдвигаются на целое число недель к сегодняшнему дню, чтобы
+старые фикстуры подходили под запросы «за последние N дней».
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, List, Tuple
+
+# Заменителю не нужны ключи бота и база — только чтобы config импортировался
+os.environ.setdefault('TELEGRAM_TOKEN', 'moex-stub')
+os.environ.setdefault('DATABASE_URL', 'postgresql://moex-stub')
+os.environ.setdefault('LLM_BACKEND', 'stub')
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from config import SUPPORTED_STOCKS, MOEX_FIXTURES_DIR, MOEX_TIMEOUT, MOEX_CANDLES_PAGE_SIZE, CANDLE_BASE_INTERVAL
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+LIVE_ISS_URL = "https://iss.moex.com/iss"
+LIVE_ISS_PAGE_SIZE = 500
+CANDLES_PATH = re.compile(r'^(?P<base>.+/securities/[^/]+/candles)\.json$')
+
+
+@dataclass
+class MoexStubProfile:
+    """Поведение заменителя ISS"""
+    latency_seconds: float = 0.05
+    jitter_seconds: float = 0.0
+    error_rate: float = 0.0  # Доля ответов с ошибкой error_status
+    error_status: int = 500
+    page_size: int = MOEX_CANDLES_PAGE_SIZE  # Свечей в странице ответа
+    shift_to_today: bool = False
+    seed: Optional[int] = None
+
+
+# ========== ФИКСТУРЫ ==========
+
+def candles_fixture_path(fixtures_dir: str, base: str, interval: int) -> str:
+    """Свечи разных интервалов одного инструмента — отдельные файлы"""
+    return os.path.join(fixtures_dir, f"{base}.{interval}.json")
+
+
+def _write_json(path: str, data: Any):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _merge_candles(path: str, block: Dict[str, Any]) -> int:
+    """Новые свечи дописываются к уже записанным (по времени начала)"""
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            existing = json.load(f)
+    else:
+        existing = {'columns': block['columns'], 'data': []}
+
+    begin = existing['columns'].index('begin')
+    rows = {row[begin]: row for row in existing['data']}
+    rows.update({row[begin]: row for row in block['data']})
+    merged = {'columns': existing['columns'], 'data': [rows[key] for key in sorted(rows)]}
+    _write_json(path, merged)
+    return len(merged['data'])
+
+
+async def _fetch_candles(client: httpx.AsyncClient, path: str, interval: int, days: int) -> Dict[str, Any]:
+    """Все страницы свечей ISS за последние days дней"""
+    till = date.today()
+    since = till - timedelta(days=days)
+    block: Dict[str, Any] = {'columns': [], 'data': []}
+    while True:
+        response = await client.get(f"{LIVE_ISS_URL}/{path}", params={
+            'from': since.isoformat(),
+            'till': till.isoformat(),
+            'interval': interval,
+            'start': len(block['data']),
+            'iss.meta': 'off',
+        })
+        response.raise_for_status()
+        page = response.json()['candles']
+        block['columns'] = page['columns']
+        block['data'].extend(page['data'])
+        if len(page['data']) < LIVE_ISS_PAGE_SIZE:
+            return block
+
+
+async def record(fixtures_dir: str, days: int, index_days: int):
+    """Запись ответов живого ISS для эндпоинтов бота"""
+    async with httpx.AsyncClient(timeout=MOEX_TIMEOUT * 3) as client:
+        snapshots = ['engines/stock/markets/shares/boards/TQBR/securities.json']
+        candles: List[Tuple[str, int, int]] = [
+            ('engines/stock/markets/index/securities/IMOEX/candles.json', 24, index_days),
+            ('engines/currency/markets/selt/boards/CETS/securities/USD000UTSTOM/candles.json', 24, index_days),
+        ]
+        for ticker in SUPPORTED_STOCKS:
+            snapshots.append(f"engines/stock/markets/shares/boards/TQBR/securities/{ticker}.json")
+            candles.append((f"engines/stock/markets/shares/securities/{ticker}/candles.json", 60, days))
+            if CANDLE_BASE_INTERVAL != 60:
+                candles.append((f"engines/stock/markets/shares/securities/{ticker}/candles.json", CANDLE_BASE_INTERVAL, days))
+            candles.append((f"engines/stock/markets/shares/securities/{ticker}/candles.json", 24, index_days))
+
+        for path in snapshots:
+            response = await client.get(f"{LIVE_ISS_URL}/{path}", params={'iss.meta': 'off'})
+            response.raise_for_status()
+            _write_json(os.path.join(fixtures_dir, path), response.json())
+            logger.info(f"💾 {path}")
+
+        for path, interval, period in candles:
+            block = await _fetch_candles(client, path, interval, period)
+            base = CANDLES_PATH.match(path).group('base')
+            total = _merge_candles(candles_fixture_path(fixtures_dir, base, interval), block)
+            logger.info(f"💾 {path} interval={interval}: +{len(block['data'])} candles ({total} recorded)")
+
+
+class FixtureStore:
+    """Записанные ответы ISS в памяти"""
+
+    def __init__(self, fixtures_dir: str, shift_to_today: bool = False):
+        self.fixtures_dir = fixtures_dir
+        self.shift_to_today = shift_to_today
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._candles: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        pattern = re.compile(r'^(?P<base>.+/candles)\.(?P<interval>\d+)\.json$')
+        for root, _, files in os.walk(self.fixtures_dir):
+            for name in files:
+                full = os.path.join(root, name)
+                path = os.path.relpath(full, self.fixtures_dir).replace(os.sep, '/')
+                with open(full, encoding='utf-8') as f:
+                    data = json.load(f)
+
+                match = pattern.match(path)
+                if match:
+                    self._candles[(match.group('base'), int(match.group('interval')))] = self._prepare(data)
+                else:
+                    self._snapshots[path] = data
+
+        logger.info(f"📂 Loaded {len(self._snapshots)} snapshots and {len(self._candles)} candle series from {self.fixtures_dir}")
+
+    def _prepare(self, block: Dict[str, Any]) -> Dict[str, Any]:
+        """Сдвиг свечей к сегодняшнему дню на целое число недель (дни недели сохраняются)"""
+        if not self.shift_to_today or not block['data']:
+            return block
+
+        begin, end = block['columns'].index('begin'), block['columns'].index('end')
+        last = datetime.strptime(block['data'][-1][begin][:10], '%Y-%m-%d').date()
+        shift = timedelta(weeks=(date.today() - last).days // 7)
+        if not shift:
+            return block
+
+        data = []
+        for row in block['data']:
+            row = list(row)
+            for i in (begin, end):
+                moment = datetime.strptime(row[i], '%Y-%m-%d %H:%M:%S') + shift
+                row[i] = moment.strftime('%Y-%m-%d %H:%M:%S')
+            data.append(row)
+        return {'columns': block['columns'], 'data': data}
+
+    def snapshot(self, path: str) -> Optional[Dict[str, Any]]:
+        return self._snapshots.get(path)
+
+    def candles(self, base: str, interval: int, since: Optional[str], till: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Свечи за период [from, till] включительно (даты YYYY-MM-DD, как в ISS)"""
+        block = self._candles.get((base, interval))
+        if block is None:
+            return None
+
+        begin = block['columns'].index('begin')
+        rows = [
+            row for row in block['data']
+            if (not since or row[begin][:10] >= since) and (not till or row[begin][:10] <= till)
+        ]
+        return {'columns': block['columns'], 'data': rows}
+
+
+# ========== СЕРВЕР ==========
+
+def _project(response: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+    """iss.only и <block>.columns, как в ISS"""
+    only = params.get('iss.only')
+    blocks = {name: block for name, block in response.items() if not only or name in only.split(',')}
+
+    for name, block in list(blocks.items()):
+        columns = params.get(f"{name}.columns")
+        if not columns or 'columns' not in block:
+            continue
+        wanted = [c for c in columns.split(',') if c in block['columns']]
+        indexes = [block['columns'].index(c) for c in wanted]
+        blocks[name] = {'columns': wanted, 'data': [[row[i] for i in indexes] for row in block['data']]}
+    return blocks
+
+
+def create_app(store: FixtureStore, profile: MoexStubProfile) -> FastAPI:
+    """FastAPI приложение, отвечающее на пути ISS под /iss"""
+    app = FastAPI(title="MOEX ISS Stub")
+    rng = random.Random(profile.seed)
+    stats: Counter = Counter()
+
+    @app.get("/iss/{path:path}")
+    async def iss(path: str, request: Request):
+        params = dict(request.query_params)
+        delay = profile.latency_seconds + rng.uniform(-profile.jitter_seconds, profile.jitter_seconds)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if rng.random() < profile.error_rate:
+            stats['errors'] += 1
+            return JSONResponse({'error': 'MOEX stub injected failure'}, status_code=profile.error_status)
+
+        match = CANDLES_PATH.match(path)
+        if match:
+            block = store.candles(
+                match.group('base'), int(params.get('interval', 10)), params.get('from'), params.get('till')
+            )
+            if block is None:
+                stats['not_found'] += 1
+                return JSONResponse({'error': f'No fixture for {path}'}, status_code=404)
+
+            stats['candles'] += 1
+            start = int(params.get('start', 0))
+            page = {'columns': block['columns'], 'data': block['data'][start:start + profile.page_size]}
+            return JSONResponse({'candles': page})
+
+        snapshot = store.snapshot(path)
+        if snapshot is None:
+            stats['not_found'] += 1
+            return JSONResponse({'error': f'No fixture for {path}'}, status_code=404)
+
+        stats['snapshots'] += 1
+        return JSONResponse(_project(snapshot, params))
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MOEX ISS stand-in with record/replay fixtures")
+    parser.add_argument('--fixtures', default=MOEX_FIXTURES_DIR, help="Каталог фикстур")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help="Записать ответы живого ISS")
+    record_parser.add_argument('--days', type=int, default=30, help="Дней часовых свечей акций")
+    record_parser.add_argument('--index-days', type=int, default=400, help="Дней дневных свечей")
+
+    serve_parser = commands.add_parser('serve', help="Отдавать записанные ответы")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8200)
+    serve_parser.add_argument('--latency', type=float, default=0.05, help="Задержка ответа, секунды")
+    serve_parser.add_argument('--jitter', type=float, default=0.0, help="Разброс задержки, секунды")
+    serve_parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов с ошибкой")
+    serve_parser.add_argument('--error-status', type=int, default=500, help="HTTP статус ошибки")
+    serve_parser.add_argument('--page-size', type=int, default=MOEX_CANDLES_PAGE_SIZE, help="Свечей в странице")
+    serve_parser.add_argument('--shift-to-today', action='store_true', help="Сдвинуть свечи к сегодняшнему дню")
+    serve_parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        asyncio.run(record(args.fixtures, args.days, args.index_days))
+        return
+
+    profile = MoexStubProfile(
+        latency_seconds=args.latency,
+        jitter_seconds=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        page_size=args.page_size,
+        shift_to_today=args.shift_to_today,
+        seed=args.seed
+    )
+    store = FixtureStore(args.fixtures, profile.shift_to_today)
+    logger.info(f"🧪 MOEX stub on http://{args.host}:{args.port}/iss ({profile})")
+    uvicorn.run(create_app(store, profile), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
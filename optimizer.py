@@ -0,0 +1,473 @@
+"""
+Подбор параметров стратегии: перебор сетки и walk-forward на пуле процессов.
+
+Свечи загружаются один раз (CandleHistory из backtest.py), пишутся в один
+.npy файл и открываются воркерами через memory map только для чтения —
+массивы не сериализуются в каждую задачу. Воркер кэширует индикаторы по
+(тикер, периоды ADX/EMA), поэтому комбинации, отличающиеся только порогами
+и уровнями мани-менеджмента, пересчитывают лишь сигналы и симуляцию.
+
+Результаты дописываются в CSV после каждой выполненной пачки; повторный
+запуск с тем же --out продолжает с места остановки.
+
+Режимы:
+    sweep         — вся сетка на всём периоде
+    walk-forward  — для каждого окна лучшая комбинация на train (по --objective)
+                    проверяется на следующем за ним test
+
+Запуск:
+    python optimizer.py --grid adx_threshold=20:30:2.5 di_threshold=20,25,30 stop_loss_percent=3:7:1
+    python optimizer.py --train-months 12 --test-months 3 --workers 8 --out data/optimizer/wf.csv
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import logging
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import fields, asdict
+from datetime import date, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+# Оптимизатору не нужны ключи бота и GPT — только чтобы config импортировался
+os.environ.setdefault('TELEGRAM_TOKEN', 'optimizer')
+os.environ.setdefault('DATABASE_URL', 'postgresql://optimizer')
+os.environ.setdefault('LLM_BACKEND', 'stub')
+
+import numpy as np
+import pandas as pd
+
+from backtest import CandleHistory, StrategyParams, run_backtest
+from candles import CandleSeries
+from config import SUPPORTED_STOCKS, BACKTEST_DATA_DIR, BACKTEST_DEFAULT_YEARS, OPTIMIZER_RESULTS_DIR
+from moex_api import close_http_client
+
+logger = logging.getLogger(__name__)
+
+PARAM_FIELDS = [field.name for field in fields(StrategyParams)]
+PARAM_TYPES = {field.name: field.type for field in fields(StrategyParams)}
+METRIC_FIELDS = ['trades', 'win_rate', 'total_profit', 'return_percent', 'max_drawdown_percent', 'exposure_percent']
+RESULT_COLUMNS = ['window', 'phase', 'start', 'end'] + PARAM_FIELDS + METRIC_FIELDS
+
+DEFAULT_GRID = {
+    'adx_threshold': [20, 22.5, 25, 27.5, 30],
+    'di_threshold': [20, 22.5, 25, 27.5, 30],
+    'adx_period': [10, 14, 20],
+    'stop_loss_percent': [3, 4, 5, 6, 7],
+    'averaging_level_1': [1.5, 2, 2.5],
+}
+
+# Пачек на воркер: мельче — ровнее загрузка, крупнее — меньше накладных расходов
+CHUNKS_PER_WORKER = 4
+MAX_CHUNK_SIZE = 64
+PROGRESS_LOG_SECONDS = 10
+
+
+# ========== СЕТКА ==========
+
+def parse_grid(specs: List[str]) -> Dict[str, List[Any]]:
+    """
+    Сетка из аргументов вида name=a,b,c или name=start:stop:step (stop включительно).
+    Не указанные параметры берутся из DEFAULT_GRID.
+    """
+    grid = {name: [PARAM_TYPES[name](value) for value in values] for name, values in DEFAULT_GRID.items()}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in PARAM_FIELDS:
+            raise ValueError(f"Unknown parameter {name!r}, expected one of {PARAM_FIELDS}")
+
+        cast = PARAM_TYPES[name]
+        if ':' in values:
+            start, stop, step = (float(v) for v in values.split(':'))
+            count = int(math.floor((stop - start) / step + 1e-9)) + 1
+            grid[name] = [cast(round(start + i * step, 10)) for i in range(count)]
+        else:
+            grid[name] = [cast(float(v)) for v in values.split(',')]
+    return grid
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[StrategyParams]:
+    """Все комбинации сетки; сгруппированы по периодам индикаторов для кэша воркеров"""
+    names = list(grid)
+    combos = [StrategyParams(**dict(zip(names, values))) for values in itertools.product(*grid.values())]
+    # Вторая доливка не может быть выше первой
+    combos = [p for p in combos if p.averaging_level_2 > p.averaging_level_1]
+    combos.sort(key=lambda p: p.indicator_key)
+    return combos
+
+
+def walk_forward_windows(
+    first: pd.Timestamp, last: pd.Timestamp, train_months: int, test_months: int
+) -> List[Tuple[pd.Timestamp, pd.Timestamp, pd.Timestamp, pd.Timestamp]]:
+    """Окна (train_start, train_end, test_start, test_end); test сдвигается на test_months"""
+    windows = []
+    train_start = first.normalize()
+    while True:
+        train_end = train_start + pd.DateOffset(months=train_months)
+        test_end = train_end + pd.DateOffset(months=test_months)
+        if train_end >= last:
+            break
+        windows.append((train_start, train_end, train_end, min(test_end, last + pd.Timedelta(days=1))))
+        train_start = train_start + pd.DateOffset(months=test_months)
+    return windows
+
+
+# ========== ОБЩИЕ СВЕЧИ ==========
+
+def write_shared_history(history: Dict[str, CandleSeries], path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Свечи всех тикеров одним массивом (6, N): колонки CandleSeries,
+    время — в секундах.
+
+    Returns:
+        Раскладка: тикер → (смещение, количество свечей)
+    """
+    layout = {}
+    offset = 0
+    for ticker, candles in history.items():
+        layout[ticker] = (offset, len(candles))
+        offset += len(candles)
+
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(len(CandleSeries.__slots__), offset))
+    for ticker, (start, length) in layout.items():
+        candles = history[ticker]
+        data[0, start:start + length] = candles.time.astype(np.int64)
+        for row, name in enumerate(CandleSeries.__slots__[1:], start=1):
+            data[row, start:start + length] = getattr(candles, name)
+    data.flush()
+    del data
+    return layout
+
+
+def attach_shared_history(path: str, layout: Dict[str, Tuple[int, int]]) -> Dict[str, CandleSeries]:
+    """Свечи из файла write_shared_history: цены — представления memory map без копирования"""
+    data = np.load(path, mmap_mode='r')
+    history = {}
+    for ticker, (start, length) in layout.items():
+        columns = data[:, start:start + length]
+        history[ticker] = CandleSeries(
+            time=columns[0].astype(np.int64).astype('datetime64[s]'),
+            open=columns[1],
+            high=columns[2],
+            low=columns[3],
+            close=columns[4],
+            volume=columns[5]
+        )
+    return history
+
+
+# ========== ВОРКЕР ==========
+
+_worker_history: Optional[Dict[str, CandleSeries]] = None
+_worker_indicators: Dict[Any, Dict[str, np.ndarray]] = {}
+
+
+def _init_worker(path: str, layout: Dict[str, Tuple[int, int]]):
+    global _worker_history
+    logging.disable(logging.WARNING)  # Предупреждения бэктеста от каждого воркера только шумят
+    _worker_history = attach_shared_history(path, layout)
+
+
+def _run_chunk(task: Tuple[int, str, Optional[str], Optional[str], List[StrategyParams]]) -> List[Dict[str, Any]]:
+    """Пачка комбинаций на одном отрезке истории → строки таблицы результатов"""
+    window, phase, start, end, combos = task
+    start_time = np.datetime64(start) if start else None
+    end_time = np.datetime64(end) if end else None
+
+    rows = []
+    for params in combos:
+        metrics = run_backtest(_worker_history, params, start_time, end_time, _worker_indicators)['metrics']
+        row = {'window': window, 'phase': phase, 'start': start or '', 'end': end or ''}
+        row.update(asdict(params))
+        row.update({name: metrics[name] for name in METRIC_FIELDS})
+        rows.append(row)
+    return rows
+
+
+# ========== ТАБЛИЦА РЕЗУЛЬТАТОВ ==========
+
+class ResultTable:
+    """CSV с результатами: дописывается после каждой пачки и служит чекпоинтом"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows: List[Dict[str, Any]] = []
+        self._done = set()
+
+        if os.path.exists(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    self._remember(self._parse(row))
+            logger.info(f"📂 Resuming from {path}: {len(self.rows)} results")
+
+    @staticmethod
+    def _parse(row: Dict[str, str]) -> Dict[str, Any]:
+        parsed: Dict[str, Any] = {'window': int(row['window']), 'phase': row['phase'], 'start': row['start'], 'end': row['end']}
+        for name in PARAM_FIELDS:
+            parsed[name] = PARAM_TYPES[name](float(row[name]))
+        parsed['trades'] = int(row['trades'])
+        for name in METRIC_FIELDS[1:]:
+            parsed[name] = float(row[name])
+        return parsed
+
+    @staticmethod
+    def key(window: int, phase: str, params: StrategyParams) -> Tuple[int, str, StrategyParams]:
+        return window, phase, params
+
+    def _remember(self, row: Dict[str, Any]):
+        self.rows.append(row)
+        params = StrategyParams(**{name: row[name] for name in PARAM_FIELDS})
+        self._done.add(self.key(row['window'], row['phase'], params))
+
+    def is_done(self, window: int, phase: str, params: StrategyParams) -> bool:
+        return self.key(window, phase, params) in self._done
+
+    def append(self, rows: List[Dict[str, Any]]):
+        write_header = not os.path.exists(self.path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+        for row in rows:
+            self._remember(row)
+
+    def select(self, window: int, phase: str) -> List[Dict[str, Any]]:
+        return [row for row in self.rows if row['window'] == window and row['phase'] == phase]
+
+
+def best_row(rows: List[Dict[str, Any]], objective: str, min_trades: int) -> Optional[Dict[str, Any]]:
+    """Лучшая строка по objective среди комбинаций с достаточным числом сделок"""
+    eligible = [row for row in rows if row['trades'] >= min_trades]
+    if not eligible:
+        return None
+    if objective == 'max_drawdown_percent':
+        return min(eligible, key=lambda row: row[objective])
+    return max(eligible, key=lambda row: row[objective])
+
+
+# ========== ЗАПУСК ==========
+
+class Optimizer:
+    """Раздача пачек комбинаций по процессам и сбор результатов"""
+
+    def __init__(
+        self,
+        history: Dict[str, CandleSeries],
+        combos: List[StrategyParams],
+        table: ResultTable,
+        workers: int,
+        objective: str = 'return_percent',
+        min_trades: int = 5,
+        windows: Optional[List[Tuple[pd.Timestamp, pd.Timestamp, pd.Timestamp, pd.Timestamp]]] = None
+    ):
+        self.history = history
+        self.combos = combos
+        self.table = table
+        self.workers = workers
+        self.objective = objective
+        self.min_trades = min_trades
+        self.windows = windows
+
+    def _chunks(self, window: int, phase: str, start: Optional[str], end: Optional[str]) -> List[Tuple]:
+        todo = [p for p in self.combos if not self.table.is_done(window, phase, p)]
+        if not todo:
+            return []
+        size = max(1, min(MAX_CHUNK_SIZE, math.ceil(len(self.combos) / (self.workers * CHUNKS_PER_WORKER))))
+        return [(window, phase, start, end, todo[i:i + size]) for i in range(0, len(todo), size)]
+
+    def _test_task(self, window: int) -> Optional[Tuple]:
+        """Проверка лучшей train-комбинации окна на test-отрезке (None — уже сделана или нечего проверять)"""
+        if self.table.select(window, 'test'):
+            return None
+        best = best_row(self.table.select(window, 'train'), self.objective, self.min_trades)
+        if best is None:
+            logger.warning(f"Window {window}: no combination with >= {self.min_trades} trades")
+            return None
+        params = StrategyParams(**{name: best[name] for name in PARAM_FIELDS})
+        _, _, test_start, test_end = self.windows[window]
+        return window, 'test', _iso(test_start), _iso(test_end), [params]
+
+    def run(self):
+        if self.windows:
+            pending_train = {}
+            tasks = []
+            for window, (train_start, train_end, _, _) in enumerate(self.windows):
+                chunks = self._chunks(window, 'train', _iso(train_start), _iso(train_end))
+                pending_train[window] = len(chunks)
+                tasks.extend(chunks)
+        else:
+            pending_train = {}
+            tasks = self._chunks(0, 'sweep', None, None)
+
+        total = sum(len(task[4]) for task in tasks)
+        logger.info(f"🧮 {total} backtests in {len(tasks)} chunks on {self.workers} workers")
+
+        fd, path = tempfile.mkstemp(suffix='.npy', prefix='optimizer-candles-')
+        os.close(fd)
+        started = time.perf_counter()
+        logged_at = started
+        completed = 0
+
+        try:
+            layout = write_shared_history(self.history, path)
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(path, layout)) as pool:
+                running = {pool.submit(_run_chunk, task): task for task in tasks}
+
+                # Окна, у которых train уже посчитан в прошлом запуске, сразу идут на test
+                for window, count in pending_train.items():
+                    if count == 0:
+                        test = self._test_task(window)
+                        if test:
+                            running[pool.submit(_run_chunk, test)] = test
+
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        window, phase = running.pop(future)[:2]
+                        rows = future.result()
+                        self.table.append(rows)
+                        completed += len(rows)
+
+                        if phase == 'train':
+                            pending_train[window] -= 1
+                            if pending_train[window] == 0:
+                                test = self._test_task(window)
+                                if test:
+                                    running[pool.submit(_run_chunk, test)] = test
+
+                    now = time.perf_counter()
+                    if now - logged_at >= PROGRESS_LOG_SECONDS:
+                        logged_at = now
+                        logger.info(f"⏱️ {completed}/{total} backtests, {completed / (now - started):.1f}/s")
+        finally:
+            os.remove(path)
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"✅ {completed} backtests in {elapsed:.1f}s")
+
+
+def _iso(value: pd.Timestamp) -> str:
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def print_sweep(table: ResultTable, objective: str, min_trades: int, top: int = 10):
+    rows = [row for row in table.select(0, 'sweep') if row['trades'] >= min_trades]
+    reverse = objective != 'max_drawdown_percent'
+    rows.sort(key=lambda row: row[objective], reverse=reverse)
+
+    print(f"\nТоп-{top} из {len(table.select(0, 'sweep'))} комбинаций по {objective}:")
+    for row in rows[:top]:
+        params = ', '.join(f"{name}={row[name]}" for name in PARAM_FIELDS)
+        print(
+            f"  {row['return_percent']:+8.2f}%  сделок {row['trades']:>4}  win {row['win_rate']:5.1f}%  "
+            f"просадка {row['max_drawdown_percent']:6.2f}%  | {params}"
+        )
+
+
+def print_walk_forward(table: ResultTable, windows: List[Tuple]):
+    print(f"\n{'Окно':<6}{'Test':<25}{'Сделок':>8}{'Доходность %':>14}  Параметры (лучшие на train)")
+    tests = []
+    for window, (_, _, test_start, test_end) in enumerate(windows):
+        rows = table.select(window, 'test')
+        if not rows:
+            continue
+        row = rows[0]
+        tests.append(row)
+        params = ', '.join(f"{name}={row[name]}" for name in PARAM_FIELDS)
+        print(
+            f"{window:<6}{test_start:%Y-%m-%d} — {test_end:%Y-%m-%d}  "
+            f"{row['trades']:>8}{row['return_percent']:>14.2f}  {params}"
+        )
+
+    if tests:
+        print(
+            f"\nOut-of-sample: {sum(r['trades'] for r in tests)} сделок, "
+            f"доходность {sum(r['return_percent'] for r in tests):+.2f}%, "
+            f"худшая просадка {max(r['max_drawdown_percent'] for r in tests):.2f}%"
+        )
+
+
+async def load_history(tickers: List[str], start: date, end: date, data_dir: str) -> Dict[str, CandleSeries]:
+    loader = CandleHistory(data_dir)
+    try:
+        loaded = await asyncio.gather(*(loader.load(ticker, start, end) for ticker in tickers))
+    finally:
+        await close_http_client()
+
+    history = {}
+    for ticker, candles in zip(tickers, loaded):
+        if candles is None:
+            logger.error(f"❌ No candles for {ticker}, skipped")
+        else:
+            history[ticker] = candles
+    return history
+
+
+def _parse_date(value: str) -> date:
+    return date.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweep and walk-forward optimizer for the ADX/DI strategy")
+    parser.add_argument('--grid', nargs='*', default=[], help="name=a,b,c или name=start:stop:step")
+    parser.add_argument('--tickers', nargs='*', help="Тикеры (по умолчанию все из SUPPORTED_STOCKS)")
+    parser.add_argument('--start', type=_parse_date, help="Начало периода, YYYY-MM-DD")
+    parser.add_argument('--end', type=_parse_date, help="Конец периода (не включая), YYYY-MM-DD")
+    parser.add_argument('--train-months', type=int, help="Walk-forward: длина train, месяцев")
+    parser.add_argument('--test-months', type=int, default=3, help="Walk-forward: длина test и шаг, месяцев")
+    parser.add_argument('--objective', default='return_percent', choices=METRIC_FIELDS[1:])
+    parser.add_argument('--min-trades', type=int, default=5, help="Меньше сделок — комбинация не выбирается")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--data-dir', default=BACKTEST_DATA_DIR, help="Каталог кэша свечей ISS")
+    parser.add_argument('--out', help="CSV с результатами (он же чекпоинт)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    logging.getLogger('moex_api').setLevel(logging.WARNING)
+
+    tickers = args.tickers or list(SUPPORTED_STOCKS.keys())
+    end = args.end or date.today() + timedelta(days=1)
+    start = args.start or end.replace(year=end.year - BACKTEST_DEFAULT_YEARS)
+    mode = f"wf{args.train_months}x{args.test_months}" if args.train_months else 'sweep'
+    out = args.out or os.path.join(OPTIMIZER_RESULTS_DIR, f"{mode}-{start}-{end}.csv")
+
+    history = asyncio.run(load_history(tickers, start, end, args.data_dir))
+    if not history:
+        return
+
+    windows = None
+    if args.train_months:
+        first = min(pd.Timestamp(c.time[0]) for c in history.values())
+        last = max(pd.Timestamp(c.time[-1]) for c in history.values())
+        windows = walk_forward_windows(first, last, args.train_months, args.test_months)
+        if not windows:
+            logger.error("❌ Period is shorter than one train window")
+            return
+
+    combos = expand_grid(parse_grid(args.grid))
+    table = ResultTable(out)
+    optimizer = Optimizer(history, combos, table, args.workers, args.objective, args.min_trades, windows)
+    optimizer.run()
+
+    if windows:
+        print_walk_forward(table, windows)
+    else:
+        print_sweep(table, args.objective, args.min_trades)
+    print(f"\n💾 Результаты: {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+"""
+Ускоренное воспроизведение торгового дня через настоящий монитор сигналов.
+
+SignalMonitor.check_signals вызывается по расписанию job_queue (каждые
+MONITOR_INTERVAL_MINUTES минут), но во времени виртуальных часов (clock.py),
+идущих в --speed раз быстрее реального. Котировки и свечи берутся из
+записанных часовых свечей ISS (файловый кэш backtest.py): на момент тика
+видны закрытые свечи и текущая свеча, «проигранная» до этого момента.
+Бот только записывает сообщения, GPT — заглушка StubLLMClient.
+
+База по умолчанию в памяти (считаются вызовы методов Database). С --database-url
+используется настоящий Database на отдельной пустой базе и считаются SQL
+запросы, реально отправленные в PostgreSQL. Не указывайте рабочую базу:
+replay создаёт подписки и позиции.
+
+Отчёт: перцентили длительности тиков, опоздавшие тики, запросы к БД,
+уведомления и запросы к LLM.
+
+Запуск:
+    python replay.py --date 2025-03-14
+    python replay.py --date 2025-03-14 --speed 1000 --users 20 --database-url postgresql://localhost/replay
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, time as dt_time
+from types import SimpleNamespace
+from typing import List, Dict, Tuple, Any, Optional
+
+# Воспроизведению не нужны ключи бота и GPT — только чтобы config импортировался
+os.environ.setdefault('TELEGRAM_TOKEN', 'replay')
+os.environ.setdefault('DATABASE_URL', 'postgresql://replay')
+os.environ.setdefault('LLM_BACKEND', 'stub')
+
+import numpy as np
+
+import gpt_analyst as gpt_analyst_module
+import scheduler as scheduler_module
+import stock_service as stock_service_module
+from backtest import CandleHistory
+from candle_engine import CandleEngine
+from candles import CandleSeries
+from clock import clock
+from config import SUPPORTED_STOCKS, MONITOR_INTERVAL_MINUTES, HISTORY_DAYS, BACKTEST_DATA_DIR
+from gpt_analyst import GPTAnalyst
+from llm_backend import StubLLMClient, StubProfile
+from moex_api import close_http_client
+from scheduler import SignalMonitor
+
+logger = logging.getLogger(__name__)
+
+CANDLE_INTERVAL = timedelta(hours=1)
+# Первый тик — через минуту после открытия, как first=60 у job_queue
+SESSION_OPEN = dt_time(6, 51)
+SESSION_CLOSE = dt_time(23, 50)
+# Заголовки уведомлений MessageFormatter → вид уведомления
+NOTIFICATION_KINDS = [
+    ('СИГНАЛ SHORT', 'short'),
+    ('СИГНАЛ COVER', 'cover'),
+    ('STOP LOSS', 'stop_loss'),
+    ('ДОЛИВКА', 'averaging'),
+    ('НА ПРОДАЖУ', 'sell'),
+    ('НА ПОКУПКУ', 'buy'),
+]
+STATEMENT_METHODS = ('execute', 'executemany', 'fetch', 'fetchrow', 'fetchval', 'copy_records_to_table')
+
+
+class ReplayMoexClient:
+    """MoexApiClient поверх записанных часовых свечей, отвечающий на момент clock.now()"""
+
+    def __init__(self, history: Dict[str, CandleSeries]):
+        self.history = history
+        self.requests = 0
+
+    def _visible(self, ticker: str, since: datetime) -> CandleSeries:
+        candles = self.history.get(ticker)
+        if candles is None:
+            return CandleSeries.empty()
+
+        now = np.datetime64(clock.now())
+        visible = candles.since(since).until(now)  # Свечи, начавшиеся не позже now
+        if not visible:
+            return visible
+
+        # Текущая свеча: цена идёт от open к close пропорционально прошедшей части часа
+        elapsed = (now - visible.time[-1]) / np.timedelta64(1, 's') / CANDLE_INTERVAL.total_seconds()
+        if elapsed < 1:
+            visible = visible.copy()
+            open_price = visible.open[-1]
+            close = open_price + (visible.close[-1] - open_price) * elapsed
+            visible.close[-1] = close
+            visible.high[-1] = max(open_price, close)
+            visible.low[-1] = min(open_price, close)
+            visible.volume[-1] = int(visible.volume[-1] * elapsed)
+        return visible
+
+    async def get_current_price(self, ticker: str) -> Optional[float]:
+        self.requests += 1
+        candles = self._visible(ticker, clock.now() - timedelta(days=1))
+        return candles.last_close if candles else None
+
+    async def get_historical_candles(self, ticker: str, days: int = HISTORY_DAYS, interval: int = 60) -> Optional[CandleSeries]:
+        self.requests += 1
+        return self._visible(ticker, clock.now() - timedelta(days=days)) or None
+
+    async def get_candles_range(self, ticker: str, from_date: date, till_date: date, interval: int = 60) -> Optional[CandleSeries]:
+        self.requests += 1
+        return self._visible(ticker, datetime.combine(from_date, dt_time.min)) or None
+
+
+class ReplayDatabase:
+    """База в памяти с методами Database, которые использует монитор; считает вызовы"""
+
+    def __init__(self, tickers: List[str], users: int):
+        self.subscriptions = {ticker: list(range(1, users + 1)) for ticker in tickers}
+        self.signal_states: Dict[tuple, Dict[str, Any]] = {}
+        self.positions: List[Dict[str, Any]] = []
+        self.closed: List[Dict[str, Any]] = []
+        self.gpt_cache: Dict[str, str] = {}
+        self.calls: Counter = Counter()
+
+    def _open(self, user_id: int, ticker: str, position_type: str = None) -> Optional[Dict[str, Any]]:
+        return next((
+            p for p in self.positions
+            if p['user_id'] == user_id and p['ticker'] == ticker
+            and (position_type is None or p['position_type'] == position_type)
+        ), None)
+
+    async def get_all_subscribed_tickers(self) -> List[str]:
+        self.calls['get_all_subscribed_tickers'] += 1
+        return sorted(self.subscriptions)
+
+    async def get_ticker_subscribers(self, ticker: str) -> List[int]:
+        self.calls['get_ticker_subscribers'] += 1
+        return self.subscriptions.get(ticker, [])
+
+    async def get_signal_states(self, tickers: List[str]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        self.calls['get_signal_states'] += 1
+        return {key: state for key, state in self.signal_states.items() if key[0] in tickers}
+
+    async def update_signal_states(self, states):
+        self.calls['update_signal_states'] += 1
+        for ticker, signal_type, signal, adx, di_plus, di_minus, price in states:
+            self.signal_states[(ticker, signal_type)] = {
+                'last_signal': signal, 'last_adx': adx, 'last_di_plus': di_plus,
+                'last_di_minus': di_minus, 'last_price': price, 'updated_at': clock.now()
+            }
+
+    async def has_open_position(self, user_id: int, ticker: str, position_type: str = None) -> bool:
+        self.calls['has_open_position'] += 1
+        return self._open(user_id, ticker, position_type) is not None
+
+    async def get_open_positions(self, user_id: int) -> List[Dict[str, Any]]:
+        self.calls['get_open_positions'] += 1
+        return [dict(p) for p in self.positions if p['user_id'] == user_id]
+
+    async def open_position(self, user_id, ticker, position_type, entry_price, entry_adx, entry_di_plus, entry_di_minus, lots):
+        self.calls['open_position'] += 1
+        position_id = len(self.positions) + len(self.closed) + 1
+        self.positions.append({
+            'id': position_id, 'user_id': user_id, 'ticker': ticker, 'position_type': position_type,
+            'entry_price': entry_price, 'entry_time': clock.now(), 'entry_adx': entry_adx,
+            'entry_di_plus': entry_di_plus, 'entry_di_minus': entry_di_minus, 'lots': lots,
+            'average_price': entry_price, 'averaging_count': 0, 'is_open': True
+        })
+        return position_id
+
+    async def add_to_position(self, user_id, ticker, position_type, add_price, add_lots):
+        self.calls['add_to_position'] += 1
+        position = self._open(user_id, ticker, position_type)
+        if position is None:
+            return
+        total_lots = position['lots'] + add_lots
+        position['average_price'] = (position['lots'] * position['average_price'] + add_lots * add_price) / total_lots
+        position['lots'] = total_lots
+        position['averaging_count'] += 1
+
+    async def close_position(self, user_id, ticker, position_type, exit_price):
+        self.calls['close_position'] += 1
+        position = self._open(user_id, ticker, position_type)
+        if position is None:
+            return
+        self.positions.remove(position)
+        position.update({
+            'exit_price': exit_price,
+            'exit_time': clock.now(),
+            'profit_percent': round((exit_price - position['average_price']) / position['average_price'] * 100, 2),
+            'is_open': False
+        })
+        self.closed.append(position)
+
+    async def get_gpt_analysis(self, cache_key: str) -> Optional[str]:
+        self.calls['get_gpt_analysis'] += 1
+        return self.gpt_cache.get(cache_key)
+
+    async def save_gpt_analysis(self, cache_key, ticker, candle_time, prompt_version, analysis):
+        self.calls['save_gpt_analysis'] += 1
+        self.gpt_cache[cache_key] = analysis
+
+
+class _CountingConnection:
+    """Соединение asyncpg, считающее отправленные запросы"""
+
+    def __init__(self, conn, counter: Counter):
+        self._conn = conn
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in STATEMENT_METHODS:
+            return attr
+
+        async def counted(*args, **kwargs):
+            self._counter[name] += 1
+            return await attr(*args, **kwargs)
+        return counted
+
+
+class _CountingPool:
+    """Обёртка пула Database: acquire() выдаёт считающие соединения"""
+
+    def __init__(self, pool, counter: Counter):
+        self._pool = pool
+        self._counter = counter
+
+    @asynccontextmanager
+    async def _acquire(self):
+        async with self._pool.acquire() as conn:
+            yield _CountingConnection(conn, self._counter)
+
+    def acquire(self):
+        return self._acquire()
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+class RecordingBot:
+    """Бот, который записывает отправленные и отредактированные сообщения"""
+
+    def __init__(self):
+        self.sent: List[Dict[str, Any]] = []
+        self.edited = 0
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: str = None):
+        self.sent.append({'chat_id': chat_id, 'text': text, 'at': clock.now()})
+        return SimpleNamespace(message_id=len(self.sent), chat_id=chat_id)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, parse_mode: str = None):
+        self.edited += 1
+
+    def kinds(self) -> Counter:
+        """Уведомления по видам (по заголовку сообщения)"""
+        kinds = Counter()
+        for message in self.sent:
+            title = message['text'].split('\n', 1)[0]
+            kind = next((kind for marker, kind in NOTIFICATION_KINDS if marker in title), 'other')
+            kinds[kind] += 1
+        return kinds
+
+
+def tick_times(day: date) -> List[datetime]:
+    """Моменты тиков монитора за торговый день"""
+    moment = datetime.combine(day, SESSION_OPEN)
+    close = datetime.combine(day, SESSION_CLOSE)
+    ticks = []
+    while moment < close:
+        ticks.append(moment)
+        moment += timedelta(minutes=MONITOR_INTERVAL_MINUTES)
+    return ticks
+
+
+def _percentile(values: List[float], p: float) -> float:
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+async def _setup_postgres(database_url: str, tickers: List[str], users: int, counter: Counter):
+    """Настоящий Database на отдельной базе: подписчики replay и подсчёт SQL запросов"""
+    from database import Database
+
+    database = Database(database_url)
+    await database.connect()
+    for user_id in range(1, users + 1):
+        await database.add_user(user_id, f"replay{user_id}", "Replay")
+        for ticker in tickers:
+            await database.add_subscription(user_id, ticker)
+    database.pool = _CountingPool(database.pool, counter)
+    return database
+
+
+async def run_replay(
+    history: Dict[str, CandleSeries],
+    day: date,
+    speed: float,
+    users: int,
+    llm_latency: float,
+    database_url: Optional[str] = None
+) -> Dict[str, Any]:
+    tickers = list(history)
+    statements: Counter = Counter()
+
+    if database_url:
+        database = await _setup_postgres(database_url, tickers, users, statements)
+    else:
+        database = ReplayDatabase(tickers, users)
+
+    analyst = GPTAnalyst()
+    analyst.client = StubLLMClient(StubProfile(latency_seconds=llm_latency, jitter_seconds=0, chunk_delay_seconds=0, seed=1))
+
+    # Монитор и аналитик работают с базой replay и заглушкой LLM
+    scheduler_module.db = database
+    scheduler_module.gpt_analyst = analyst
+    gpt_analyst_module.db = database
+
+    monitor = SignalMonitor()
+    moex = ReplayMoexClient(history)
+    monitor.stock_service.moex_client = moex
+    # Записаны часовые свечи: они и есть базовый интервал движка
+    stock_service_module.candle_engine = CandleEngine(moex, base_interval=60, history_days=HISTORY_DAYS)
+    bot = RecordingBot()
+    context = SimpleNamespace(bot=bot)
+
+    ticks = tick_times(day)
+    interval = MONITOR_INTERVAL_MINUTES * 60 / speed
+    latencies: List[float] = []
+    late = 0
+
+    clock.start_virtual(ticks[0], speed)
+    started = time.perf_counter()
+    try:
+        for moment in ticks:
+            await clock.sleep_until(moment)
+            if (clock.now() - moment).total_seconds() / speed > interval:
+                late += 1  # Предыдущий тик занял больше интервала
+
+            tick_started = time.perf_counter()
+            await monitor.check_signals(context)
+            latencies.append(time.perf_counter() - tick_started)
+
+        # Фоновые GPT запросы и дописывание анализа в алерты
+        while monitor._background_tasks or analyst._background_tasks:
+            await asyncio.gather(*monitor._background_tasks, *analyst._background_tasks, return_exceptions=True)
+    finally:
+        clock.reset()
+        if database_url:
+            await database.disconnect()
+
+    if not database_url:
+        statements = database.calls
+
+    return {
+        'day': day,
+        'speed': speed,
+        'ticks': len(latencies),
+        'late_ticks': late,
+        'tick_p50': _percentile(latencies, 50),
+        'tick_p95': _percentile(latencies, 95),
+        'tick_p99': _percentile(latencies, 99),
+        'tick_max': max(latencies, default=0.0),
+        'wall_seconds': time.perf_counter() - started,
+        'db_kind': 'SQL statements' if database_url else 'Database calls',
+        'db_total': sum(statements.values()),
+        'db_by_kind': statements,
+        'notifications': len(bot.sent),
+        'notification_kinds': bot.kinds(),
+        'edits': bot.edited,
+        'moex_requests': moex.requests,
+        'llm_requests': analyst.client.requests,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\nReplay {result['day']} x{result['speed']:g}: {result['ticks']} ticks in {result['wall_seconds']:.1f}s")
+    print(
+        f"Tick, ms: p50 {result['tick_p50'] * 1000:.1f}  p95 {result['tick_p95'] * 1000:.1f}  "
+        f"p99 {result['tick_p99'] * 1000:.1f}  max {result['tick_max'] * 1000:.1f}  (late ticks: {result['late_ticks']})"
+    )
+    print(f"{result['db_kind']}: {result['db_total']} ({result['db_total'] / max(result['ticks'], 1):.1f} per tick)")
+    for name, count in result['db_by_kind'].most_common():
+        print(f"  {name:<28}{count:>8}")
+    kinds = ', '.join(f"{name}: {count}" for name, count in sorted(result['notification_kinds'].items())) or '—'
+    print(f"Notifications: {result['notifications']} ({kinds}), edited with GPT: {result['edits']}")
+    print(f"MOEX requests: {result['moex_requests']}, LLM requests: {result['llm_requests']}")
+
+
+async def main_async(args):
+    tickers = args.tickers or list(SUPPORTED_STOCKS.keys())
+    loader = CandleHistory(args.data_dir)
+    start = args.date - timedelta(days=HISTORY_DAYS + 5)
+    try:
+        loaded = await asyncio.gather(*(loader.load(ticker, start, args.date + timedelta(days=1)) for ticker in tickers))
+    finally:
+        await close_http_client()
+
+    history = {}
+    for ticker, candles in zip(tickers, loaded):
+        if candles is None:
+            logger.error(f"❌ No recorded candles for {ticker}, skipped")
+        else:
+            history[ticker] = candles
+    if not history:
+        return
+
+    result = await run_replay(history, args.date, args.speed, args.users, args.llm_latency, args.database_url)
+    print_report(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accelerated replay of a trading day through SignalMonitor")
+    parser.add_argument('--date', type=date.fromisoformat, required=True, help="Торговый день, YYYY-MM-DD")
+    parser.add_argument('--speed', type=float, default=1000, help="Ускорение виртуального времени")
+    parser.add_argument('--tickers', nargs='*', help="Тикеры (по умолчанию все из SUPPORTED_STOCKS)")
+    parser.add_argument('--users', type=int, default=3, help="Подписчиков на каждый тикер")
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="Задержка заглушки LLM, секунды")
+    parser.add_argument('--data-dir', default=BACKTEST_DATA_DIR, help="Каталог записанных свечей ISS")
+    parser.add_argument('--database-url', help="Отдельная пустая PostgreSQL база (по умолчанию — в памяти)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING
+    )
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, Callable, Awaitable, Optional, TypeVar, List
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(Exception):
+    """Вызов пропущен: предохранитель разомкнут после серии ошибок"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для внешнего сервиса.
+
+    После failure_threshold ошибок подряд вызовы не выполняются reset_timeout
+    секунд (сразу CircuitOpenError). Затем пропускается один пробный вызов:
+    успех замыкает предохранитель, ошибка снова размыкает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Можно ли сейчас вызывать сервис"""
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self._probe_in_flight:
+            self._probe_in_flight = True
+            logger.info(f"🔌 {self.name}: half-open, probing")
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"🔌 {self.name}: closed after successful probe")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probe_in_flight:
+                logger.warning(f"🔌 {self.name}: open for {self.reset_timeout:.0f}s after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release(self):
+        """Вызов отменён без результата: пробный слот освобождается"""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'rejected': self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных вызовов для перцентилей"""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        """p-й перцентиль (0-100) или None, если замеров меньше min_samples"""
+        if len(self._samples) < max(min_samples, 1):
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'samples': len(self._samples),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+        }
+
+
+async def hedged(call: Callable[[], Awaitable[T]], hedge_after: Optional[float]) -> T:
+    """
+    Вызов с подстраховкой: если за hedge_after секунд ответа нет,
+    запускается второй такой же вызов и берётся первый успешный результат.
+
+    Без hedge_after — обычный вызов. Ошибка возвращается, только если
+    не удались оба вызова.
+    """
+    if hedge_after is None:
+        return await call()
+
+    tasks: List[asyncio.Task] = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            logger.info(f"⏱️ No response after {hedge_after:.1f}s, sending hedged request")
+            tasks.append(asyncio.ensure_future(call()))
+
+        error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,280 @@
+import ast
+import json
+import logging
+from dataclasses import dataclass
+from functools import reduce
+from typing import Optional, List, Dict, Tuple, Any
+
+import numpy as np
+
+from models import SignalType
+from config import (
+    ADX_THRESHOLD,
+    DI_PLUS_THRESHOLD,
+    SIGNAL_RULES,
+    SIGNAL_RULES_FILE,
+    SIGNAL_RULES_ENABLED
+)
+
+logger = logging.getLogger(__name__)
+
+# Правило, которое ведёт позиции, Stop Loss и доливки
+POSITION_RULE = 'LONG'
+
+# Значения, доступные в выражениях правил (массивы по тикерам или по барам)
+INDICATOR_NAMES = (
+    'adx', 'di_plus', 'di_minus', 'ema20', 'price',
+    'htf_adx', 'htf_di_plus', 'htf_di_minus', 'has_htf'
+)
+# Значения прошлой проверки для crosses_above/crosses_below
+PREVIOUS_NAMES = {
+    'adx': 'prev_adx',
+    'di_plus': 'prev_di_plus',
+    'di_minus': 'prev_di_minus',
+    'price': 'prev_price',
+}
+# Пороги по умолчанию; бэктест и оптимизатор подставляют свои
+DEFAULT_CONSTANTS = {
+    'ADX_THRESHOLD': ADX_THRESHOLD,
+    'DI_PLUS_THRESHOLD': DI_PLUS_THRESHOLD,
+}
+
+_COMPARE_OPS = (ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq)
+_ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+_FUNCTIONS = {'abs': np.abs, 'min': np.minimum, 'max': np.maximum}
+_CROSSOVERS = {'crosses_above': '_crosses_above', 'crosses_below': '_crosses_below'}
+
+
+def _and(*values):
+    return reduce(np.logical_and, values)
+
+
+def _or(*values):
+    return reduce(np.logical_or, values)
+
+
+def _crosses_above(a, b, prev_a, prev_b):
+    return np.logical_and(prev_a <= prev_b, a > b)
+
+
+def _crosses_below(a, b, prev_a, prev_b):
+    return np.logical_and(prev_a >= prev_b, a < b)
+
+
+_GLOBALS = {
+    '__builtins__': {},
+    '_and': _and,
+    '_or': _or,
+    '_not': np.logical_not,
+    '_crosses_above': _crosses_above,
+    '_crosses_below': _crosses_below,
+    **_FUNCTIONS,
+}
+
+
+def _call(name: str, args: List[ast.expr]) -> ast.Call:
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+
+class _Compiler(ast.NodeTransformer):
+    """
+    Выражение правила → выражение над массивами numpy.
+
+    and/or/not заменяются поэлементными logical_and/or/not, цепочки
+    сравнений — их конъюнкцией, пересечения получают значения прошлой
+    проверки. Всё, чего нет в языке правил, — ошибка компиляции.
+    """
+
+    def __init__(self, names):
+        self.names = set(names)
+
+    def visit_Expression(self, node: ast.Expression) -> ast.Expression:
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.Call:
+        name = '_and' if isinstance(node.op, ast.And) else '_or'
+        return _call(name, [self.visit(value) for value in node.values])
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.expr:
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            return _call('_not', [operand])
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            return ast.UnaryOp(op=node.op, operand=operand)
+        raise ValueError(f"unsupported operator {type(node.op).__name__}")
+
+    def visit_Compare(self, node: ast.Compare) -> ast.expr:
+        operands = [self.visit(node.left)] + [self.visit(item) for item in node.comparators]
+        comparisons = []
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if not isinstance(op, _COMPARE_OPS):
+                raise ValueError(f"unsupported comparison {type(op).__name__}")
+            comparisons.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+        return comparisons[0] if len(comparisons) == 1 else _call('_and', comparisons)
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.BinOp:
+        if not isinstance(node.op, _ARITHMETIC_OPS):
+            raise ValueError(f"unsupported operator {type(node.op).__name__}")
+        return ast.BinOp(left=self.visit(node.left), op=node.op, right=self.visit(node.right))
+
+    def visit_Call(self, node: ast.Call) -> ast.Call:
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if node.keywords or (name not in _FUNCTIONS and name not in _CROSSOVERS):
+            raise ValueError(f"unknown function {ast.unparse(node.func)}")
+
+        args = [self.visit(arg) for arg in node.args]
+        if name in _FUNCTIONS:
+            return _call(name, args)
+
+        if len(args) != 2:
+            raise ValueError(f"{name} takes 2 arguments")
+        previous = [_Previous().visit(ast.parse(ast.unparse(arg), mode='eval')).body for arg in args]
+        return _call(_CROSSOVERS[name], args + previous)
+
+    def visit_Name(self, node: ast.Name) -> ast.Name:
+        if node.id not in self.names:
+            raise ValueError(f"unknown name {node.id}")
+        return node
+
+    def visit_Constant(self, node: ast.Constant) -> ast.Constant:
+        if isinstance(node.value, str):
+            raise ValueError(f"unsupported constant {node.value!r}")
+        return node
+
+    def generic_visit(self, node: ast.AST):
+        raise ValueError(f"unsupported syntax {type(node).__name__}")
+
+
+class _Previous(ast.NodeTransformer):
+    """Аргумент пересечения на прошлой проверке: adx → prev_adx и т.д."""
+
+    def visit_Name(self, node: ast.Name) -> ast.Name:
+        if node.id in PREVIOUS_NAMES:
+            return ast.Name(id=PREVIOUS_NAMES[node.id], ctx=ast.Load())
+        if node.id in DEFAULT_CONSTANTS or node.id in _GLOBALS:
+            return node
+        raise ValueError(f"{node.id} has no previous value for crossovers")
+
+
+@dataclass
+class Predicate:
+    """Скомпилированное выражение правила"""
+    source: str
+    code: Any
+
+    @classmethod
+    def compile(cls, source: str) -> 'Predicate':
+        names = set(INDICATOR_NAMES) | set(PREVIOUS_NAMES.values()) | set(DEFAULT_CONSTANTS)
+        tree = _Compiler(names).visit(ast.parse(source, mode='eval'))
+        return cls(source, compile(ast.fix_missing_locations(tree), f"<rule: {source}>", 'eval'))
+
+    def __call__(self, env: Dict[str, Any]) -> np.ndarray:
+        return eval(self.code, _GLOBALS, env)
+
+
+@dataclass
+class SignalRule:
+    """Правило: сигналы в порядке проверки и сигналы открытия/закрытия позиции"""
+    name: str
+    entry: SignalType
+    exit: SignalType
+    signals: List[Tuple[SignalType, Predicate]]
+
+    @classmethod
+    def from_definition(cls, name: str, definition: Dict[str, Any]) -> 'SignalRule':
+        try:
+            signals = [
+                (SignalType(signal), Predicate.compile(source))
+                for signal, source in definition['signals']
+            ]
+            return cls(
+                name=name,
+                entry=SignalType(definition['entry']),
+                exit=SignalType(definition['exit']),
+                signals=signals
+            )
+        except (KeyError, ValueError, SyntaxError) as e:
+            raise ValueError(f"Invalid signal rule {name}: {e}") from e
+
+    def evaluate(self, env: Dict[str, Any]) -> np.ndarray:
+        """Сигнал по каждому элементу массивов env: первый выполненный, иначе NONE"""
+        shape = np.shape(env['adx'])
+        conditions = [np.broadcast_to(np.asarray(predicate(env), dtype=bool), shape) for _, predicate in self.signals]
+        return np.select(
+            conditions,
+            [signal.value for signal, _ in self.signals],
+            SignalType.NONE.value
+        ).astype(object)
+
+    def is_entry(self, old_signal: Optional[str], new_signal: SignalType) -> bool:
+        """Открытие позиции: переход из exit или NONE в entry (SELL/NONE → BUY)"""
+        return old_signal in (self.exit.value, SignalType.NONE.value) and new_signal == self.entry
+
+    def is_exit(self, old_signal: Optional[str], new_signal: SignalType) -> bool:
+        """Закрытие позиции: переход из entry в exit (BUY → SELL)"""
+        return old_signal == self.entry.value and new_signal == self.exit
+
+
+class RuleEngine:
+    """
+    Правила сигналов, скомпилированные один раз в предикаты над массивами.
+
+    Индикаторы всех тикеров (или всех баров истории) передаются массивами,
+    так что тик монитора — это по одному векторному вычислению на условие
+    каждого правила, сколько бы ни было тикеров.
+    """
+
+    def __init__(self, rules: Dict[str, SignalRule], enabled: List[str]):
+        unknown = [name for name in enabled if name not in rules]
+        if unknown:
+            raise ValueError(f"Unknown signal rules enabled: {', '.join(unknown)}")
+        if POSITION_RULE not in enabled:
+            raise ValueError(f"Signal rule {POSITION_RULE} must be enabled (positions, Stop Loss, averaging)")
+
+        self.rules = rules
+        self.enabled = enabled
+
+    @classmethod
+    def load(cls) -> 'RuleEngine':
+        """Правила из SIGNAL_RULES_FILE или SIGNAL_RULES"""
+        definitions = SIGNAL_RULES
+        if SIGNAL_RULES_FILE:
+            with open(SIGNAL_RULES_FILE, encoding='utf-8') as f:
+                definitions = json.load(f)
+            logger.info(f"📜 Signal rules loaded from {SIGNAL_RULES_FILE}")
+
+        rules = {name: SignalRule.from_definition(name, definition) for name, definition in definitions.items()}
+        return cls(rules, [name.strip() for name in SIGNAL_RULES_ENABLED if name.strip()])
+
+    def evaluate(
+        self,
+        env: Dict[str, Any],
+        previous: Optional[Dict[str, Dict[str, np.ndarray]]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Сигналы всех включённых правил за один проход.
+
+        Args:
+            env: массивы индикаторов (INDICATOR_NAMES) одной длины
+            previous: правило → массивы прошлой проверки (PREVIOUS_NAMES)
+        """
+        return {name: self.evaluate_rule(name, env, (previous or {}).get(name)) for name in self.enabled}
+
+    def evaluate_rule(
+        self,
+        name: str,
+        env: Dict[str, Any],
+        previous: Optional[Dict[str, np.ndarray]] = None
+    ) -> np.ndarray:
+        shape = np.shape(env['adx'])
+        scope = dict(DEFAULT_CONSTANTS)
+        scope.update({key: np.full(shape, np.nan) for key in PREVIOUS_NAMES.values()})
+        scope.update(env)
+        if previous:
+            scope.update(previous)
+        return self.rules[name].evaluate(scope)
+
+
+# Глобальный экземпляр: правила компилируются при импорте, ошибка в правилах — ошибка запуска
+signal_rules = RuleEngine.load()
@@ -1,23 +1,34 @@
+import asyncio
 import logging
-from datetime import datetime
+from functools import partial
+from typing import Optional, List, Dict, Tuple, Any, Callable
 from telegram.ext import ContextTypes
 from telegram import Bot
 
 from database import db
 from stock_service import StockService
-from signals import SignalDetector
+from signals import SignalDetector, calculate_lots
 from formatters import MessageFormatter
-from models import SignalType
+from models import SignalType, StockData, Signal
+from rules import POSITION_RULE
 from config import (
-    SUPPORTED_STOCKS, 
     DEPOSIT, 
     RISK_PERCENT, 
     STOP_LOSS_PERCENT,
     AVERAGING_LEVEL_1,
-    AVERAGING_LEVEL_2
+    AVERAGING_LEVEL_2,
+    ADX_THRESHOLD,
+    DI_PLUS_THRESHOLD,
+    GPT_PRECOMPUTE_MARGIN,
+    GPT_PRECOMPUTE_PRICE_MARGIN_PERCENT
 )
 from gpt_analyst import gpt_analyst
 from fear_greed_index import fear_greed
+from market_snapshots import market_snapshots
+from market_scanner import market_scanner
+from instruments import instruments
+from clock import clock
+import singleflight
 
 logger = logging.getLogger(__name__)
 
@@ -29,10 +40,11 @@ class SignalMonitor:
         self.stock_service = StockService()
         self.signal_detector = SignalDetector()
         self.formatter = MessageFormatter()
+        self._background_tasks = set()
     
     def _is_market_open(self) -> bool:
         """Проверка работает ли биржа (MOEX: 06:50 - 23:50 МСК)"""
-        now = datetime.now()
+        now = clock.now()
         hour = now.hour
         minute = now.minute
         
@@ -47,20 +59,14 @@ class SignalMonitor:
     
     def _calculate_lots(self, ticker: str, entry_price: float) -> int:
         """Расчет количества лотов на основе риска"""
-        stock_info = SUPPORTED_STOCKS.get(ticker, {})
-        lot_size = stock_info.get('lot_size', 1)
-        
-        risk_amount = DEPOSIT * (RISK_PERCENT / 100)
-        loss_per_share = entry_price * (STOP_LOSS_PERCENT / 100)
-        shares_count = risk_amount / loss_per_share
-        lots = int(shares_count / lot_size)
+        lot_size = instruments.lot_size(ticker)
+        lots = calculate_lots(entry_price, lot_size)
         
         logger.info(
             f"💰 Расчет позиции {ticker}: "
             f"Цена={entry_price:.2f} ₽, "
-            f"Риск={risk_amount:,.0f} ₽, "
-            f"Убыток на акцию={loss_per_share:.2f} ₽, "
-            f"Акций={shares_count:,.0f}, "
+            f"Риск={DEPOSIT * (RISK_PERCENT / 100):,.0f} ₽, "
+            f"Убыток на акцию={entry_price * (STOP_LOSS_PERCENT / 100):.2f} ₽, "
             f"Размер лота={lot_size}, "
             f"Лотов={lots:,}"
         )
@@ -85,10 +91,36 @@ class SignalMonitor:
             
             logger.info(f"Checking signals for: {', '.join(subscribed_tickers)}")
             
+            # Сначала данные по всем тикерам: сигналы всех правил считаются одним
+            # проходом, а GPT анализ для всех сменившихся (или близких к смене)
+            # сигналов запрашивается одним пакетом
+            stock_datas = []
             for ticker in subscribed_tickers:
-                await self._check_ticker_signal(ticker, context.bot)
+                stock_data = await self._load_ticker(ticker)
+                if stock_data:
+                    stock_datas.append(stock_data)
+            
+            if not stock_datas:
+                return
+            
+            states = await db.get_signal_states([stock_data.info.ticker for stock_data in stock_datas])
+            loaded = []
+            for stock_data, signals in zip(stock_datas, self.signal_detector.detect_batch(stock_datas, states)):
+                await market_snapshots.publish(stock_data, signals)
+                loaded.append((stock_data.info.ticker, stock_data, signals))
+            
+            await self._prefetch_gpt_analyses(loaded, states)
+            
+            # Состояния всех правил записываются одним запросом в конце тика
+            state_rows = []
+            for ticker, stock_data, signals in loaded:
+                state_rows.extend(await self._check_ticker_signal(ticker, stock_data, signals, states, context.bot))
+            
+            await db.update_signal_states(state_rows)
             
             logger.info("✅ Signal check completed")
+            logger.info(f"🔗 Single-flight stats: {singleflight.get_stats()}")
+            logger.info(f"🔌 GPT stats: {gpt_analyst.get_stats()}")
             
         except Exception as e:
             logger.error(f"Error in check_signals: {e}", exc_info=True)
@@ -107,24 +139,101 @@ class SignalMonitor:
         except Exception as e:
             logger.error(f"❌ Error updating Fear & Greed Index: {e}", exc_info=True)
     
-    async def _check_ticker_signal(self, ticker: str, bot: Bot):
-        """Проверка сигнала для конкретной акции"""
+    async def update_instruments(self, context: ContextTypes.DEFAULT_TYPE):
+        """Ежедневное обновление реестра инструментов из ISS (до открытия торгов)"""
+        logger.info("📇 Refreshing instrument registry...")
+        await instruments.refresh()
+    
+    async def scan_market(self, context: ContextTypes.DEFAULT_TYPE):
+        """Периодический скан всех ликвидных акций TQBR (результат уходит в общий кэш)"""
+        if not self._is_market_open():
+            return
+        
+        await market_scanner.scan()
+    
+    async def _load_ticker(self, ticker: str) -> Optional[StockData]:
+        """Данные по акции (сигналы считаются потом, по всем акциям сразу)"""
         try:
             stock_data = await self.stock_service.get_stock_data(ticker)
             
             if not stock_data or not stock_data.is_valid():
                 logger.warning(f"Invalid data for {ticker}, skipping")
-                return
+                return None
             
-            signals = self.signal_detector.detect_signals(stock_data)
-            long_signal = signals['LONG']
+            return stock_data
             
+        except Exception as e:
+            logger.error(f"Error loading data for {ticker}: {e}", exc_info=True)
+            return None
+    
+    async def _prefetch_gpt_analyses(
+        self,
+        loaded: List[Tuple[str, StockData, Dict[str, Signal]]],
+        states: Dict[Tuple[str, str], Dict[str, Any]]
+    ):
+        """
+        Пакетный GPT анализ в фоне для тикеров, где сигнал сменился на этом тике
+        или близок к смене. Алерты, отправленные без анализа, дождутся этого пакета.
+        """
+        items = []
+        for ticker, stock_data, signals in loaded:
+            if not stock_data.candles:
+                continue
+            try:
+                if self._is_near_signal_threshold(signals[POSITION_RULE]) or any(
+                    self._is_signal_changing(ticker, rule, signal, states) for rule, signal in signals.items()
+                ):
+                    items.append((stock_data, stock_data.candles))
+            except Exception as e:
+                logger.error(f"Error checking GPT prefetch for {ticker}: {e}")
+        
+        if items:
+            gpt_analyst.precompute_batch(items)
+    
+    def _is_signal_changing(self, ticker: str, rule: str, signal: Signal, states: Dict[Tuple[str, str], Dict[str, Any]]) -> bool:
+        previous_state = states.get((ticker, rule))
+        previous_signal = previous_state['last_signal'] if previous_state else None
+        return self.signal_detector.has_signal_changed(previous_signal, signal.signal_type)
+    
+    async def _check_ticker_signal(
+        self,
+        ticker: str,
+        stock_data: StockData,
+        signals: Dict[str, Signal],
+        states: Dict[Tuple[str, str], Dict[str, Any]],
+        bot: Bot
+    ) -> List[Tuple[str, str, str, float, float, float, float]]:
+        """
+        Проверка сигналов для конкретной акции.
+        
+        Stop Loss, доливки и позиции ведёт правило LONG, остальные правила
+        только уведомляют. Returns: строки состояний правил для db.update_signal_states
+        """
+        state_rows = []
+        try:
+            long_signal = signals[POSITION_RULE]
             await self._check_stop_loss(ticker, long_signal, stock_data, bot)
             await self._check_averaging(ticker, long_signal, stock_data, bot)
-            await self._process_long_signals(ticker, long_signal, stock_data, bot)
+            
+            for rule, signal in signals.items():
+                previous_state = states.get((ticker, rule))
+                previous_signal = previous_state['last_signal'] if previous_state else None
+                
+                if rule == POSITION_RULE:
+                    processed = await self._process_long_signals(ticker, signal, previous_signal, stock_data, bot)
+                else:
+                    processed = await self._process_rule_signals(ticker, rule, signal, previous_signal, stock_data, bot)
+                
+                if processed:
+                    state_rows.append((
+                        ticker, rule, signal.signal_type.value,
+                        signal.adx, signal.di_plus, signal.di_minus, signal.price
+                    ))
             
         except Exception as e:
             logger.error(f"Error checking signal for {ticker}: {e}", exc_info=True)
+        
+        return state_rows
     
     async def _check_stop_loss(self, ticker: str, signal, stock_data, bot: Bot):
         """Проверка Stop Loss для всех открытых позиций"""
@@ -172,9 +281,8 @@ class SignalMonitor:
                     
                     await db.close_position(user_id, ticker, 'LONG', current_price)
                     
-                    stock_info = SUPPORTED_STOCKS.get(ticker, {})
-                    stock_name = stock_info.get('name', ticker)
-                    stock_emoji = stock_info.get('emoji', '📊')
+                    stock_name = instruments.name(ticker)
+                    stock_emoji = instruments.emoji(ticker)
                     
                     message = self.formatter.format_stop_loss_notification(
                         signal, stock_name, stock_emoji, entry_price, average_price, 
@@ -222,6 +330,11 @@ class SignalMonitor:
                 averaging_price_1 = entry_price * (1 - AVERAGING_LEVEL_1 / 100)
                 averaging_price_2 = entry_price * (1 - AVERAGING_LEVEL_2 / 100)
                 
+                # Цена подходит к уровню доливки — считаем GPT анализ заранее
+                next_level_price = {0: averaging_price_1, 1: averaging_price_2}.get(averaging_count)
+                if next_level_price and next_level_price < current_price <= next_level_price * (1 + GPT_PRECOMPUTE_PRICE_MARGIN_PERCENT / 100):
+                    self._precompute_gpt_analysis(stock_data)
+                
                 if averaging_count == 0 and current_price <= averaging_price_1:
                     await self._execute_averaging(
                         user_id, ticker, signal, stock_data, bot, 
@@ -277,42 +390,47 @@ class SignalMonitor:
                 f"New average: {new_average_price:.2f}"
             )
             
-            stock_info = SUPPORTED_STOCKS.get(ticker, {})
-            stock_name = stock_info.get('name', ticker)
-            stock_emoji = stock_info.get('emoji', '📊')
+            stock_name = instruments.name(ticker)
+            stock_emoji = instruments.emoji(ticker)
             
-            gpt_analysis = await self._get_gpt_analysis(ticker, stock_data, f"AVERAGING #{averaging_number}")
+            gpt_analysis = await self._get_ready_gpt_analysis(stock_data)
             
-            message = self.formatter.format_averaging_notification(
+            render = partial(
+                self.formatter.format_averaging_notification,
                 signal, stock_name, stock_emoji, entry_price, current_price,
-                add_lots, total_lots, new_average_price, averaging_number, gpt_analysis
+                add_lots, total_lots, new_average_price, averaging_number
             )
+            message = render(gpt_analysis)
             
             try:
-                await bot.send_message(
+                sent = await bot.send_message(
                     chat_id=user_id,
                     text=message,
                     parse_mode='HTML'
                 )
                 logger.info(f"Sent AVERAGING notification to user {user_id} for {ticker}")
+                
+                if not gpt_analysis:
+                    self._attach_gpt_analysis_later(
+                        ticker, stock_data, f"AVERAGING #{averaging_number}", bot,
+                        [(user_id, sent.message_id, render)]
+                    )
             except Exception as e:
                 logger.error(f"Error sending AVERAGING notification to user {user_id}: {e}")
         
         except Exception as e:
             logger.error(f"Error executing averaging for {ticker}: {e}", exc_info=True)
     
-    async def _process_long_signals(self, ticker: str, signal, stock_data, bot: Bot):
-        """Обработка LONG сигналов"""
-        previous_state = await db.get_signal_state(ticker, 'LONG')
-        previous_signal = previous_state['last_signal'] if previous_state else None
+    async def _process_long_signals(self, ticker: str, signal, previous_signal: Optional[str], stock_data, bot: Bot) -> bool:
+        """
+        Обработка LONG сигналов.
         
+        Returns: True, если состояние сигнала можно сохранить (смену без
+        подписчиков оставляем до их появления)
+        """
         if not self.signal_detector.has_signal_changed(previous_signal, signal.signal_type):
             logger.info(f"No LONG signal change for {ticker}")
-            await db.update_signal_state(
-                ticker, 'LONG', signal.signal_type.value,
-                signal.adx, signal.di_plus, signal.di_minus, signal.price
-            )
-            return
+            return True
         
         logger.info(f"🎯 LONG signal changed for {ticker}: {previous_signal} → {signal.signal_type.value}")
         
@@ -320,26 +438,88 @@ class SignalMonitor:
         
         if not subscribers:
             logger.info(f"No subscribers for {ticker}")
-            return
+            return False
         
-        if self.signal_detector.is_sell_to_buy_transition(previous_signal, signal.signal_type):
+        if self.signal_detector.is_entry_transition(POSITION_RULE, previous_signal, signal.signal_type):
             await self._handle_long_buy_signal(ticker, signal, stock_data, subscribers, bot)
         
-        elif self.signal_detector.is_buy_to_sell_transition(previous_signal, signal.signal_type):
+        elif self.signal_detector.is_exit_transition(POSITION_RULE, previous_signal, signal.signal_type):
             await self._handle_long_sell_signal(ticker, signal, stock_data, subscribers, bot)
         
-        await db.update_signal_state(
-            ticker, 'LONG', signal.signal_type.value,
-            signal.adx, signal.di_plus, signal.di_minus, signal.price
+        return True
+    
+    async def _process_rule_signals(
+        self,
+        ticker: str,
+        rule: str,
+        signal,
+        previous_signal: Optional[str],
+        stock_data,
+        bot: Bot
+    ) -> bool:
+        """Обработка сигналов остальных правил (SHORT и т.д.): только уведомления, без позиций"""
+        if not self.signal_detector.has_signal_changed(previous_signal, signal.signal_type):
+            logger.info(f"No {rule} signal change for {ticker}")
+            return True
+        
+        logger.info(f"🎯 {rule} signal changed for {ticker}: {previous_signal} → {signal.signal_type.value}")
+        
+        subscribers = await db.get_ticker_subscribers(ticker)
+        
+        if not subscribers:
+            logger.info(f"No subscribers for {ticker}")
+            return False
+        
+        is_entry = self.signal_detector.is_entry_transition(rule, previous_signal, signal.signal_type)
+        if is_entry or self.signal_detector.is_exit_transition(rule, previous_signal, signal.signal_type):
+            await self._handle_rule_signal(ticker, rule, signal, is_entry, stock_data, subscribers, bot)
+        
+        return True
+    
+    async def _handle_rule_signal(
+        self,
+        ticker: str,
+        rule: str,
+        signal,
+        is_entry: bool,
+        stock_data,
+        subscribers: list,
+        bot: Bot
+    ):
+        """Уведомление о входе/выходе по правилу без открытия позиции"""
+        logger.info(f"📣 {rule} {signal.signal_type.value} signal for {ticker}")
+        
+        stock_name = instruments.name(ticker)
+        stock_emoji = instruments.emoji(ticker)
+        
+        gpt_analysis = await self._get_ready_gpt_analysis(stock_data)
+        
+        render = partial(
+            self.formatter.format_rule_signal_notification,
+            signal, rule, is_entry, stock_name, stock_emoji
         )
+        message = render(gpt_analysis)
+        sent_messages = []
+        
+        for user_id in subscribers:
+            try:
+                sent = await bot.send_message(
+                    chat_id=user_id, text=message, parse_mode='HTML'
+                )
+                sent_messages.append((user_id, sent.message_id, render))
+                logger.info(f"Sent {rule} {signal.signal_type.value} notification to user {user_id} for {ticker}")
+            except Exception as e:
+                logger.error(f"Error sending {rule} notification to user {user_id}: {e}")
+        
+        if not gpt_analysis:
+            self._attach_gpt_analysis_later(ticker, stock_data, f"{rule} {signal.signal_type.value}", bot, sent_messages)
     
     async def _handle_long_buy_signal(self, ticker: str, signal, stock_data, subscribers: list, bot: Bot):
         """Обработка BUY сигнала (открытие LONG)"""
         logger.info(f"🟢 LONG BUY signal for {ticker}")
         
-        stock_info = SUPPORTED_STOCKS.get(ticker, {})
-        stock_name = stock_info.get('name', ticker)
-        stock_emoji = stock_info.get('emoji', '📊')
+        stock_name = instruments.name(ticker)
+        stock_emoji = instruments.emoji(ticker)
         
         lots = self._calculate_lots(ticker, signal.price)
         
@@ -347,11 +527,14 @@ class SignalMonitor:
             logger.warning(f"Cannot open position for {ticker}: calculated lots = {lots}")
             return
         
-        gpt_analysis = await self._get_gpt_analysis(ticker, stock_data, "LONG BUY")
+        gpt_analysis = await self._get_ready_gpt_analysis(stock_data)
         
-        message = self.formatter.format_long_buy_signal_notification(
-            signal, stock_name, stock_emoji, lots, gpt_analysis
+        render = partial(
+            self.formatter.format_long_buy_signal_notification,
+            signal, stock_name, stock_emoji, lots
         )
+        message = render(gpt_analysis)
+        sent_messages = []
         
         for user_id in subscribers:
             try:
@@ -363,25 +546,29 @@ class SignalMonitor:
                         signal.adx, signal.di_plus, signal.di_minus, lots
                     )
                     
-                    await bot.send_message(
+                    sent = await bot.send_message(
                         chat_id=user_id, text=message, parse_mode='HTML'
                     )
+                    sent_messages.append((user_id, sent.message_id, render))
                     logger.info(f"Sent LONG BUY notification to user {user_id} for {ticker}")
                 else:
                     logger.info(f"User {user_id} already has open position for {ticker}")
                     
             except Exception as e:
                 logger.error(f"Error sending LONG BUY notification to user {user_id}: {e}")
+        
+        if not gpt_analysis:
+            self._attach_gpt_analysis_later(ticker, stock_data, "LONG BUY", bot, sent_messages)
     
     async def _handle_long_sell_signal(self, ticker: str, signal, stock_data, subscribers: list, bot: Bot):
         """Обработка SELL сигнала (закрытие LONG)"""
         logger.info(f"🔴 LONG SELL signal for {ticker}")
         
-        stock_info = SUPPORTED_STOCKS.get(ticker, {})
-        stock_name = stock_info.get('name', ticker)
-        stock_emoji = stock_info.get('emoji', '📊')
+        stock_name = instruments.name(ticker)
+        stock_emoji = instruments.emoji(ticker)
         
-        gpt_analysis = await self._get_gpt_analysis(ticker, stock_data, "LONG SELL")
+        gpt_analysis = await self._get_ready_gpt_analysis(stock_data)
+        sent_messages = []
         
         for user_id in subscribers:
             try:
@@ -401,26 +588,98 @@ class SignalMonitor:
                         
                         await db.close_position(user_id, ticker, 'LONG', signal.price)
                         
-                        message = self.formatter.format_long_sell_signal_notification(
+                        render = partial(
+                            self.formatter.format_long_sell_signal_notification,
                             signal, stock_name, stock_emoji, entry_price, average_price,
-                            profit_percent, lots, averaging_count, gpt_analysis
+                            profit_percent, lots, averaging_count
                         )
+                        message = render(gpt_analysis)
                         
-                        await bot.send_message(
+                        sent = await bot.send_message(
                             chat_id=user_id, text=message, parse_mode='HTML'
                         )
+                        sent_messages.append((user_id, sent.message_id, render))
                         logger.info(f"Sent LONG SELL notification to user {user_id} for {ticker}, P/L: {profit_percent:.2f}%")
                 else:
                     logger.info(f"User {user_id} has no open LONG position for {ticker}")
                     
             except Exception as e:
                 logger.error(f"Error sending LONG SELL notification to user {user_id}: {e}")
+        
+        if not gpt_analysis:
+            self._attach_gpt_analysis_later(ticker, stock_data, "LONG SELL", bot, sent_messages)
+    
+    def _is_near_signal_threshold(self, signal) -> bool:
+        """Индикаторы близко к порогам BUY/SELL, но сигнал ещё не сработал"""
+        for di_value, signal_type in ((signal.di_minus, SignalType.BUY), (signal.di_plus, SignalType.SELL)):
+            if signal.signal_type == signal_type:
+                continue
+            shortfall = max(ADX_THRESHOLD - signal.adx, DI_PLUS_THRESHOLD - di_value)
+            if 0 <= shortfall <= GPT_PRECOMPUTE_MARGIN:
+                return True
+        return False
+    
+    def _precompute_gpt_analysis(self, stock_data):
+        """Фоновый расчёт GPT анализа, чтобы алерт ушёл с ним без ожидания"""
+        if stock_data.candles:
+            gpt_analyst.precompute(stock_data, stock_data.candles)
+    
+    async def _get_ready_gpt_analysis(self, stock_data) -> Optional[str]:
+        """Готовый GPT анализ из кэша (без ожидания GPT)"""
+        try:
+            if stock_data.candles:
+                return await gpt_analyst.get_ready_analysis(stock_data, stock_data.candles)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения готового GPT анализа для {stock_data.info.ticker}: {e}")
+        return None
+    
+    def _attach_gpt_analysis_later(
+        self,
+        ticker: str,
+        stock_data,
+        signal_type: str,
+        bot: Bot,
+        sent_messages: List[Tuple[int, int, Callable[[Optional[str]], str]]]
+    ):
+        """Алерт уже отправлен без анализа: дописываем его в сообщения, когда GPT ответит"""
+        if not sent_messages:
+            return
+        
+        task = asyncio.create_task(
+            self._edit_with_gpt_analysis(ticker, stock_data, signal_type, bot, sent_messages)
+        )
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _edit_with_gpt_analysis(
+        self,
+        ticker: str,
+        stock_data,
+        signal_type: str,
+        bot: Bot,
+        sent_messages: List[Tuple[int, int, Callable[[Optional[str]], str]]]
+    ):
+        gpt_analysis = await self._get_gpt_analysis(ticker, stock_data, signal_type)
+        if not gpt_analysis:
+            return
+        
+        for chat_id, message_id, render in sent_messages:
+            try:
+                await bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=render(gpt_analysis),
+                    parse_mode='HTML'
+                )
+                logger.info(f"Added GPT analysis to {signal_type} notification for user {chat_id} ({ticker})")
+            except Exception as e:
+                logger.error(f"Error adding GPT analysis to notification for user {chat_id}: {e}")
     
     async def _get_gpt_analysis(self, ticker: str, stock_data, signal_type: str) -> str:
         """Получение GPT анализа"""
         try:
             logger.info(f"🤖 Получаем GPT анализ для {signal_type} {ticker}...")
-            candles_data = await self.stock_service.moex_client.get_historical_candles(ticker)
+            candles_data = stock_data.candles or await self.stock_service.moex_client.get_historical_candles(ticker)
             if candles_data:
                 gpt_analysis = await gpt_analyst.analyze_stock(stock_data, candles_data)
                 if gpt_analysis:
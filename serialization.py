@@ -0,0 +1,37 @@
+import logging
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+def _default(obj: Any) -> Any:
+    """Типы, которые orjson не сериализует сам (Decimal из asyncpg)"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    Быстрая сериализация в JSON.
+
+    datetime/date сериализуются orjson нативно в ISO 8601,
+    Decimal — в float, ключи словарей могут быть не строками.
+    """
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dumps(obj: Any) -> str:
+    """JSON-строка для встраивания в шаблоны"""
+    return dumps_bytes(obj).decode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ FastAPI на orjson с поддержкой Decimal"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -1,60 +1,181 @@
 import logging
-from datetime import datetime
-from typing import Dict
+from typing import Optional, List, Dict, Tuple, Any
+
+import numpy as np
 
 from models import Signal, SignalType, StockData
-from config import ADX_THRESHOLD, DI_PLUS_THRESHOLD
+from rules import signal_rules, POSITION_RULE, PREVIOUS_NAMES
+from clock import clock
+from config import ADX_THRESHOLD, DI_PLUS_THRESHOLD, DEPOSIT, RISK_PERCENT, STOP_LOSS_PERCENT
 
 logger = logging.getLogger(__name__)
 
+# Значения прошлой проверки (rules.PREVIOUS_NAMES) → колонки signal_states
+_STATE_COLUMNS = {
+    'prev_adx': 'last_adx',
+    'prev_di_plus': 'last_di_plus',
+    'prev_di_minus': 'last_di_minus',
+    'prev_price': 'last_price',
+}
+
+
+def calculate_lots(entry_price: float, lot_size: int, stop_loss_percent: float = STOP_LOSS_PERCENT) -> int:
+    """Количество лотов: риск RISK_PERCENT депозита при срабатывании Stop Loss"""
+    risk_amount = DEPOSIT * (RISK_PERCENT / 100)
+    loss_per_share = entry_price * (stop_loss_percent / 100)
+    return int(risk_amount / loss_per_share / lot_size)
+
 
 class SignalDetector:
-    """Класс для определения торговых сигналов"""
+    """Класс для определения торговых сигналов по правилам из rules.py"""
     
     @staticmethod
-    def detect_signals(stock_data: StockData) -> Dict[str, Signal]:
+    def detect_batch(
+        stock_datas: List[StockData],
+        states: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None
+    ) -> List[Dict[str, Signal]]:
         """
-        Определение сигналов на основе данных акции
+        Сигналы всех включённых правил по всем акциям за один проход.
+        
+        Индикаторы акций собираются в массивы, и каждое условие каждого
+        правила считается одним векторным выражением (SIGNAL_RULES в config.py).
+        По умолчанию:
         
         LONG:
         - BUY:  ADX > 25 AND DI- > 25 (вход в позицию)
         - SELL: ADX > 25 AND DI+ > 25 (выход из позиции)
         
+        SHORT — зеркально (SHORT на DI+, COVER на DI-), только уведомления.
+        
+        Если посчитан старший таймфрейм (HTF_CONFIRMATION_TIMEFRAME), вход
+        требует его подтверждения; выход не задерживается.
+        
+        Args:
+            stock_datas: данные акций
+            states: состояния сигналов из БД (db.get_signal_states) для crosses_above/crosses_below
+        
         Returns:
-            Dict с ключом 'LONG', содержащим Signal объект
+            Для каждой акции Dict: имя правила → Signal
         """
-        adx = stock_data.technical.adx
-        di_plus = stock_data.technical.di_plus
-        di_minus = stock_data.technical.di_minus
-        price = stock_data.price.current_price
+        if not stock_datas:
+            return []
+        
+        technicals = [stock_data.technical for stock_data in stock_datas]
+        htfs = [stock_data.htf_technical for stock_data in stock_datas]
+        nan = float('nan')
+        env = {
+            'adx': np.array([t.adx for t in technicals], dtype=np.float64),
+            'di_plus': np.array([t.di_plus for t in technicals], dtype=np.float64),
+            'di_minus': np.array([t.di_minus for t in technicals], dtype=np.float64),
+            'ema20': np.array([t.ema20 for t in technicals], dtype=np.float64),
+            'price': np.array([s.price.current_price for s in stock_datas], dtype=np.float64),
+            'htf_adx': np.array([h.adx if h else nan for h in htfs], dtype=np.float64),
+            'htf_di_plus': np.array([h.di_plus if h else nan for h in htfs], dtype=np.float64),
+            'htf_di_minus': np.array([h.di_minus if h else nan for h in htfs], dtype=np.float64),
+            'has_htf': np.array([h is not None for h in htfs], dtype=bool),
+        }
         
-        # LONG сигнал
-        if adx > ADX_THRESHOLD and di_minus > DI_PLUS_THRESHOLD:
-            long_signal_type = SignalType.BUY
-        elif adx > ADX_THRESHOLD and di_plus > DI_PLUS_THRESHOLD:
-            long_signal_type = SignalType.SELL
-        else:
-            long_signal_type = SignalType.NONE
+        previous = {}
+        if states:
+            tickers = [stock_data.info.ticker for stock_data in stock_datas]
+            for rule in signal_rules.enabled:
+                rows = [states.get((ticker, rule)) for ticker in tickers]
+                previous[rule] = {
+                    prev_name: np.array(
+                        [float(row[column]) if row and row.get(column) is not None else nan for row in rows],
+                        dtype=np.float64
+                    )
+                    for prev_name, column in _STATE_COLUMNS.items()
+                }
         
-        long_signal = Signal(
-            ticker=stock_data.info.ticker,
-            signal_type=long_signal_type,
-            adx=adx,
-            di_plus=di_plus,
-            di_minus=di_minus,
-            price=price,
-            timestamp=datetime.now()
-        )
+        evaluated = signal_rules.evaluate(env, previous)
+        now = clock.now()
         
-        logger.info(
-            f"🎯 {stock_data.info.ticker} | "
-            f"LONG: {long_signal_type.value} | "
-            f"ADX: {adx:.2f}, DI+: {di_plus:.2f}, DI-: {di_minus:.2f}, Price: {price:.2f}"
-        )
+        results = []
+        for i, stock_data in enumerate(stock_datas):
+            ticker = stock_data.info.ticker
+            technical = technicals[i]
+            price = stock_data.price.current_price
+            signals = {
+                rule: Signal(
+                    ticker=ticker,
+                    signal_type=SignalType(values[i]),
+                    adx=technical.adx,
+                    di_plus=technical.di_plus,
+                    di_minus=technical.di_minus,
+                    price=price,
+                    timestamp=now
+                )
+                for rule, values in evaluated.items()
+            }
+            results.append(signals)
+            
+            rule_text = ' | '.join(f"{rule}: {signal.signal_type.value}" for rule, signal in signals.items())
+            htf = htfs[i]
+            htf_text = f" | {stock_data.htf_timeframe} DI+: {htf.di_plus:.2f}, DI-: {htf.di_minus:.2f}" if htf else ""
+            logger.info(
+                f"🎯 {ticker} | {rule_text} | "
+                f"ADX: {technical.adx:.2f}, DI+: {technical.di_plus:.2f}, DI-: {technical.di_minus:.2f}, "
+                f"Price: {price:.2f}{htf_text}"
+            )
         
-        return {
-            'LONG': long_signal
+        return results
+    
+    @staticmethod
+    def detect_signals(
+        stock_data: StockData,
+        states: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None
+    ) -> Dict[str, Signal]:
+        """
+        Сигналы одной акции (см. detect_batch)
+        
+        Returns:
+            Dict: имя правила ('LONG', 'SHORT', ...) → Signal
+        """
+        return SignalDetector.detect_batch([stock_data], states)[0]
+    
+    @staticmethod
+    def detect_signal_series(
+        adx: np.ndarray,
+        di_plus: np.ndarray,
+        di_minus: np.ndarray,
+        adx_threshold: float = ADX_THRESHOLD,
+        di_threshold: float = DI_PLUS_THRESHOLD,
+        ema20: Optional[np.ndarray] = None,
+        price: Optional[np.ndarray] = None,
+        rule: str = POSITION_RULE
+    ) -> np.ndarray:
+        """
+        То же правило, что в detect_signals, для массивов индикаторов по барам.
+        Пороги можно переопределить (подбор параметров в optimizer.py),
+        прошлая проверка для пересечений — предыдущий бар. Старшего
+        таймфрейма здесь нет (has_htf = False).
+        
+        Returns:
+            Массив значений SignalType (строки); '' там, где индикаторов нет (NaN)
+        """
+        adx = np.asarray(adx, dtype=np.float64)
+        nan = np.full(adx.shape, np.nan)
+        env = {
+            'adx': adx,
+            'di_plus': di_plus,
+            'di_minus': di_minus,
+            'ema20': nan if ema20 is None else ema20,
+            'price': nan if price is None else price,
+            'htf_adx': nan,
+            'htf_di_plus': nan,
+            'htf_di_minus': nan,
+            'has_htf': np.zeros(adx.shape, dtype=bool),
+            'ADX_THRESHOLD': adx_threshold,
+            'DI_PLUS_THRESHOLD': di_threshold,
         }
+        previous = {
+            prev_name: _shift(np.asarray(env[name], dtype=np.float64))
+            for name, prev_name in PREVIOUS_NAMES.items()
+        }
+        signals = signal_rules.evaluate_rule(rule, env, previous)
+        signals[np.isnan(adx)] = ''
+        return signals
     
     @staticmethod
     def has_signal_changed(old_signal: str, new_signal: SignalType) -> bool:
@@ -65,14 +186,19 @@ class SignalDetector:
         return old_signal != new_signal.value
     
     @staticmethod
-    def is_buy_to_sell_transition(old_signal: str, new_signal: SignalType) -> bool:
-        """Проверка перехода BUY → SELL (закрытие LONG)"""
-        return old_signal == SignalType.BUY.value and new_signal == SignalType.SELL
+    def is_entry_transition(rule: str, old_signal: str, new_signal: SignalType) -> bool:
+        """Открытие позиции правила: SELL/NONE → BUY для LONG, COVER/NONE → SHORT для SHORT"""
+        return signal_rules.rules[rule].is_entry(old_signal, new_signal)
     
     @staticmethod
-    def is_sell_to_buy_transition(old_signal: str, new_signal: SignalType) -> bool:
-        """Проверка перехода SELL → BUY или NONE → BUY (открытие LONG)"""
-        return (
-            (old_signal == SignalType.SELL.value or old_signal == SignalType.NONE.value) 
-            and new_signal == SignalType.BUY
-        )
+    def is_exit_transition(rule: str, old_signal: str, new_signal: SignalType) -> bool:
+        """Закрытие позиции правила: BUY → SELL для LONG, SHORT → COVER для SHORT"""
+        return signal_rules.rules[rule].is_exit(old_signal, new_signal)
+
+
+def _shift(values: np.ndarray) -> np.ndarray:
+    """Значения предыдущего бара (NaN на первом)"""
+    shifted = np.empty_like(values)
+    shifted[:1] = np.nan
+    shifted[1:] = values[:-1]
+    return shifted
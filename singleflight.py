@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Dict, Any, Hashable, Callable, Awaitable, TypeVar, List
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Все группы для сбора метрик
+_groups: List['SingleFlight'] = []
+
+
+class SingleFlight:
+    """
+    Схлопывание одинаковых одновременных запросов.
+
+    Пока запрос по ключу выполняется, остальные вызовы с тем же ключом
+    не запускают новый, а ждут результат уже идущего.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        _groups.append(self)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Результат fn() по ключу; одновременные вызовы получают один и тот же результат"""
+        self.calls += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.debug(f"🔗 {self.name}: coalesced call for {key}")
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def is_running(self, key: Hashable) -> bool:
+        """Идёт ли сейчас запрос по ключу"""
+        return key in self._inflight
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._inflight),
+        }
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Метрики всех групп: сколько вызовов было схлопнуто"""
+    return {group.name: group.stats() for group in _groups}
@@ -2,12 +2,19 @@ import logging
 from typing import Optional
 
 from moex_api import MoexApiClient
+from candle_engine import candle_engine
 from indicators import TechnicalIndicators
+from candles import CandleSeries
 from models import StockData, StockPrice, TechnicalData, StockInfo
-from config import SUPPORTED_STOCKS, MAX_CANDLES
+from instruments import instruments
+from config import MAX_CANDLES, SIGNAL_TIMEFRAME, HTF_CONFIRMATION_TIMEFRAME
+from singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# Общая для всех сервисов группа: монитор, дашборд и Telegram получают один расчёт
+_stock_data_flight = SingleFlight('stock_service.get_stock_data')
+
 
 class StockService:
     """Сервис для работы с данными акций"""
@@ -17,26 +24,35 @@ class StockService:
         self.indicators = TechnicalIndicators()
     
     async def get_stock_data(self, ticker: str) -> Optional[StockData]:
-        """Получение полных данных по акции"""
+        """
+        Получение полных данных по акции.
+        
+        None — данных нет (ошибка ISS, нет свечей); если свечей не хватает
+        на индикаторы, возвращается StockData с is_valid() == False.
+        """
         ticker = ticker.upper()
         
         # Проверяем поддержку тикера
-        if ticker not in SUPPORTED_STOCKS:
+        if not instruments.is_supported(ticker):
             logger.error(f"Unsupported ticker: {ticker}")
             return None
         
+        return await _stock_data_flight.do(ticker, lambda: self._load_stock_data(ticker))
+    
+    async def _load_stock_data(self, ticker: str) -> Optional[StockData]:
+        """Загрузка цены и свечей и расчёт индикаторов"""
         try:
             # Получаем актуальную цену
             current_price = await self.moex_client.get_current_price(ticker)
             
-            # Получаем исторические данные
-            candles_data = await self.moex_client.get_historical_candles(ticker)
+            # Свечи всех таймфреймов из одного потока ISS
+            candles_data = await candle_engine.get_candles(ticker, SIGNAL_TIMEFRAME)
             if not candles_data:
                 return None
             
             # Ограничиваем количество свечей
             if len(candles_data) > MAX_CANDLES:
-                candles_data = candles_data[-MAX_CANDLES:]
+                candles_data = candles_data[-MAX_CANDLES:]  # Представление без копирования
             
             # Диагностика данных
             self._log_candles_info(ticker, candles_data)
@@ -44,18 +60,20 @@ class StockService:
             # Расчет технических индикаторов
             technical_data = self.indicators.calculate_all_indicators(candles_data)
             if not technical_data:
-                return None
+                # Свечей меньше, чем нужно индикаторам: данные отдаём невалидными
+                # (is_valid() == False), чтобы показать «недостаточно данных»
+                technical_data = dict.fromkeys(('ema20', 'adx', 'di_plus', 'di_minus'), float('nan'))
             
             # Собираем все данные
             stock_info = StockInfo(
                 ticker=ticker,
-                name=SUPPORTED_STOCKS[ticker]['name'],
-                emoji=SUPPORTED_STOCKS[ticker]['emoji']
+                name=instruments.name(ticker),
+                emoji=instruments.emoji(ticker)
             )
             
             price_data = StockPrice(
-                current_price=current_price if current_price else candles_data[-1]['close'],
-                last_close=candles_data[-1]['close']
+                current_price=current_price if current_price else candles_data.last_close,
+                last_close=candles_data.last_close
             )
             
             technical = TechnicalData(
@@ -68,13 +86,17 @@ class StockService:
             stock_data = StockData(
                 info=stock_info,
                 price=price_data,
-                technical=technical
+                technical=technical,
+                candles=candles_data
             )
             
-            # Проверяем валидность данных
+            if HTF_CONFIRMATION_TIMEFRAME:
+                stock_data.htf_technical = self._calculate_htf(ticker, candle_engine.candles(ticker, HTF_CONFIRMATION_TIMEFRAME))
+                stock_data.htf_timeframe = HTF_CONFIRMATION_TIMEFRAME
+            
+            # Невалидные данные возвращаются: вызывающий проверяет is_valid()
             if not stock_data.is_valid():
-                logger.error(f"Invalid technical data for {ticker}")
-                return None
+                logger.warning(f"Invalid technical data for {ticker}")
             
             return stock_data
             
@@ -82,14 +104,32 @@ class StockService:
             logger.error(f"Error getting stock data for {ticker}: {e}")
             return None
     
-    def _log_candles_info(self, ticker: str, candles_data: list):
+    def _calculate_htf(self, ticker: str, candles_data: Optional[CandleSeries]) -> Optional[TechnicalData]:
+        """Индикаторы старшего таймфрейма по уже загруженным свечам (без запросов к MOEX)"""
+        if not candles_data:
+            return None
+        
+        technical_data = self.indicators.calculate_all_indicators(candles_data[-MAX_CANDLES:])
+        if not technical_data:
+            logger.warning(f"⚠️ Not enough {HTF_CONFIRMATION_TIMEFRAME} bars for {ticker}, entry won't be confirmed by HTF")
+            return None
+        
+        return TechnicalData(
+            ema20=technical_data['ema20'],
+            adx=technical_data['adx'],
+            di_plus=technical_data['di_plus'],
+            di_minus=technical_data['di_minus']
+        )
+    
+    def _log_candles_info(self, ticker: str, candles_data: CandleSeries):
         """Логирование информации о свечах для диагностики"""
         if candles_data:
             logger.info(f"🔍 ПОСЛЕДНИЕ 3 СВЕЧИ {ticker}:")
-            for i, candle in enumerate(candles_data[-3:]):
-                logger.info(f"   {i+1}. {candle['time']} | O:{candle['open']:.2f} H:{candle['high']:.2f} L:{candle['low']:.2f} C:{candle['close']:.2f}")
+            for number, i in enumerate(range(max(len(candles_data) - 3, 0), len(candles_data)), 1):
+                candle = candles_data.record(i)
+                logger.info(f"   {number}. {candle['time']} | O:{candle['open']:.2f} H:{candle['high']:.2f} L:{candle['low']:.2f} C:{candle['close']:.2f}")
             
-            first_time = candles_data[0]['time']
-            last_time = candles_data[-1]['time']
+            first_time = candles_data.time_str(0)
+            last_time = candles_data.time_str(-1)
             logger.info(f"Диапазон: {first_time} → {last_time}")
-            logger.info(f"Цена последней свечи: {candles_data[-1]['close']:.2f} ₽")
+            logger.info(f"Цена последней свечи: {candles_data.last_close:.2f} ₽")
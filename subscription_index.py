@@ -0,0 +1,85 @@
+import logging
+from typing import Dict, Set, List, Iterable, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionIndex:
+    """
+    Подписки в памяти процесса в обе стороны: пользователь → тикеры и тикер → пользователи.
+
+    Заполняется из БД при старте и обновляется при подписке/отписке
+    (в том числе из других процессов через LISTEN/NOTIFY).
+    Пока индекс не загружен (loaded=False), Database читает подписки из БД.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._by_user: Dict[int, Set[str]] = {}
+        self._by_ticker: Dict[str, Set[int]] = {}
+        # События, пришедшие во время загрузки снимка: применяются после неё
+        self._buffer: Optional[List[Tuple[str, int, str]]] = None
+
+    def begin_load(self):
+        self.loaded = False
+        self._buffer = []
+
+    def finish_load(self, pairs: Iterable[Tuple[int, str]]):
+        """Замена индекса снимком из БД и применение событий, пришедших во время загрузки"""
+        self._by_user = {}
+        self._by_ticker = {}
+        for user_id, ticker in pairs:
+            self._add(user_id, ticker)
+
+        for op, user_id, ticker in self._buffer or []:
+            self._apply(op, user_id, ticker)
+        self._buffer = None
+        self.loaded = True
+        logger.info(f"📇 Subscription index loaded: {len(self._by_user)} users, {len(self._by_ticker)} tickers")
+
+    def invalidate(self):
+        """Индекс мог устареть (например, оборвался LISTEN)"""
+        self.loaded = False
+
+    def apply(self, op: str, user_id: int, ticker: str):
+        """Изменение подписки: op = 'add' или 'remove'"""
+        if self._buffer is not None:
+            self._buffer.append((op, user_id, ticker))
+        self._apply(op, user_id, ticker)
+
+    def _apply(self, op: str, user_id: int, ticker: str):
+        if op == 'add':
+            self._add(user_id, ticker)
+        elif op == 'remove':
+            self._remove(user_id, ticker)
+        else:
+            logger.warning(f"Unknown subscription event: {op}")
+
+    def _add(self, user_id: int, ticker: str):
+        self._by_user.setdefault(user_id, set()).add(ticker)
+        self._by_ticker.setdefault(ticker, set()).add(user_id)
+
+    def _remove(self, user_id: int, ticker: str):
+        tickers = self._by_user.get(user_id)
+        if tickers is not None:
+            tickers.discard(ticker)
+            if not tickers:
+                del self._by_user[user_id]
+
+        users = self._by_ticker.get(ticker)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._by_ticker[ticker]
+
+    def is_subscribed(self, user_id: int, ticker: str) -> bool:
+        return ticker in self._by_user.get(user_id, ())
+
+    def user_tickers(self, user_id: int) -> List[str]:
+        return sorted(self._by_user.get(user_id, ()))
+
+    def ticker_users(self, ticker: str) -> List[int]:
+        return sorted(self._by_ticker.get(ticker, ()))
+
+    def tickers(self) -> List[str]:
+        return sorted(self._by_ticker)
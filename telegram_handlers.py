@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
+import html
 import logging
+import time
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, WebAppInfo
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 
 from stock_service import StockService
 from formatters import MessageFormatter
-from config import SUPPORTED_STOCKS
+from config import SUPPORTED_STOCKS, GPT_STREAM_EDIT_INTERVAL_SECONDS, SCANNER_TOP_N
 from database import db
 from gpt_analyst import gpt_analyst
+from market_snapshots import market_snapshots
+from market_scanner import market_scanner
+from instruments import instruments
+from clock import clock
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +78,23 @@ class TelegramHandlers:
         elif text == "💼 Позиции":
             # Показываем позиции
             await self._send_positions(update, user_id)
+        
+        elif instruments.is_supported(text.strip()):
+            # Тикер любой акции TQBR из реестра
+            await self._send_stock_button(update, text.strip().upper())
+    
+    async def _send_stock_button(self, update: Update, ticker: str):
+        """Кнопка карточки акции, найденной по тикеру"""
+        keyboard = [[
+            InlineKeyboardButton(
+                text=f"{instruments.emoji(ticker)} {ticker} - {instruments.name(ticker)}",
+                callback_data=f"stock:{ticker}"
+            )
+        ]]
+        await update.message.reply_text(
+            "🔎 Нашёл акцию:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
     
     async def _open_dashboard(self, update: Update):
         """Открыть веб-дашборд через Telegram Mini App"""
@@ -91,22 +115,28 @@ class TelegramHandlers:
             reply_markup=reply_markup
         )
     
-    async def _send_stocks_list(self, update: Update, user_id: int):
-        """Отправить список акций"""
+    async def _create_stocks_keyboard(self, user_id: int) -> InlineKeyboardMarkup:
+        """Кнопки акций: избранные и остальные подписки пользователя"""
+        subscriptions = await db.get_user_subscriptions(user_id)
+        tickers = list(SUPPORTED_STOCKS) + [ticker for ticker in subscriptions if ticker not in SUPPORTED_STOCKS]
+        
         keyboard = []
         
         # Создаем кнопки для каждой акции с иконками подписки
-        for ticker, info in SUPPORTED_STOCKS.items():
-            is_subscribed = await db.is_subscribed(user_id, ticker)
-            icon = "⭐ " if is_subscribed else ""
+        for ticker in tickers:
+            icon = "⭐ " if ticker in subscriptions else ""
             
             button = InlineKeyboardButton(
-                text=f"{icon}{info['emoji']} {ticker} - {info['name']}",
+                text=f"{icon}{instruments.emoji(ticker)} {ticker} - {instruments.name(ticker)}",
                 callback_data=f"stock:{ticker}"
             )
             keyboard.append([button])
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        return InlineKeyboardMarkup(keyboard)
+    
+    async def _send_stocks_list(self, update: Update, user_id: int):
+        """Отправить список акций"""
+        reply_markup = await self._create_stocks_keyboard(user_id)
         
         message = self.formatter.format_stocks_selection()
         await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
@@ -121,9 +151,9 @@ class TelegramHandlers:
         if open_positions:
             for pos in open_positions:
                 ticker = pos['ticker']
-                stock_data = await self.stock_service.get_stock_data(ticker)
-                if stock_data:
-                    current_prices[ticker] = stock_data.price.current_price
+                snapshot = await market_snapshots.get(ticker)
+                if snapshot:
+                    current_prices[ticker] = snapshot.stock_data.price.current_price
         
         message = self.formatter.format_positions_list(
             open_positions, 
@@ -164,6 +194,17 @@ class TelegramHandlers:
         """Обработчик команды /dashboard - открыть веб-дашборд"""
         await self._open_dashboard(update)
     
+    async def scan_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /scan - рейтинг сетапов ADX/DI по всему рынку"""
+        message = await update.message.reply_text(self.formatter.format_loading_message())
+        
+        scan = await market_scanner.get_latest()
+        if not scan:
+            await message.edit_text(self.formatter.format_error_message("Скан рынка ещё не готов, попробуйте позже"), parse_mode='HTML')
+            return
+        
+        await message.edit_text(self.formatter.format_scanner_results(scan, SCANNER_TOP_N), parse_mode='HTML')
+    
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на inline кнопки"""
         query = update.callback_query
@@ -176,6 +217,10 @@ class TelegramHandlers:
             ticker = query.data.split(":")[1]
             await self._show_stock_data(query, user_id, ticker)
         
+        elif query.data.startswith("refresh:"):
+            ticker = query.data.split(":")[1]
+            await self._show_stock_data(query, user_id, ticker, refresh=True)
+        
         elif query.data.startswith("subscribe:"):
             ticker = query.data.split(":")[1]
             await self._handle_subscribe(query, user_id, ticker)
@@ -193,58 +238,45 @@ class TelegramHandlers:
     
     async def _show_stocks_list_inline(self, query, user_id: int):
         """Показать список акций (для inline callback)"""
-        keyboard = []
-        
-        # Создаем кнопки для каждой акции с иконками подписки
-        for ticker, info in SUPPORTED_STOCKS.items():
-            is_subscribed = await db.is_subscribed(user_id, ticker)
-            icon = "⭐ " if is_subscribed else ""
-            
-            button = InlineKeyboardButton(
-                text=f"{icon}{info['emoji']} {ticker} - {info['name']}",
-                callback_data=f"stock:{ticker}"
-            )
-            keyboard.append([button])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = await self._create_stocks_keyboard(user_id)
         
         message = self.formatter.format_stocks_selection()
         await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
     
-    async def _show_stock_data(self, query, user_id: int, ticker: str):
-        """Показать данные акции с кнопками подписки"""
+    async def _show_stock_data(self, query, user_id: int, ticker: str, refresh: bool = False):
+        """Показать данные акции с кнопками подписки (refresh — пересчитать снимок, а не брать из кэша)"""
         # ИСПРАВЛЕНО: убрали передачу ticker в format_loading_message()
         await query.edit_message_text(self.formatter.format_loading_message())
         
         try:
-            from signals import SignalDetector
-            
-            stock_data = await self.stock_service.get_stock_data(ticker)
+            # Снимок из общего кэша (сигналы уже посчитаны монитором или при обновлении)
+            if refresh:
+                snapshot = await market_snapshots.refresh(ticker)
+            else:
+                snapshot = await market_snapshots.get(ticker)
             
-            if not stock_data:
+            if not snapshot:
                 await query.edit_message_text(
                     self.formatter.format_error_message("Не удалось получить данные")
                 )
                 return
             
+            stock_data = snapshot.stock_data
+            
             if not stock_data.is_valid():
                 await query.edit_message_text(
                     self.formatter.format_error_message("Недостаточно данных для анализа")
                 )
                 return
             
-            # Получаем сигналы
-            signal_detector = SignalDetector()
-            signals = signal_detector.detect_signals(stock_data)
-            
-            # Добавляем сигналы к stock_data
-            stock_data.signals = signals
-            
             # Проверяем подписку
             is_subscribed = await db.is_subscribed(user_id, ticker)
             
             # Формируем сообщение
             message = self.formatter.format_stock_message(stock_data)
+            message += f"\n\n🕒 Данные на {snapshot.computed_at.strftime('%H:%M:%S')}"
+            if refresh and snapshot.age_seconds(clock.now()) > market_snapshots.refresh_after:
+                message += " (обновить не удалось, показаны последние)"
             
             # Создаем кнопки
             keyboard = []
@@ -267,7 +299,7 @@ class TelegramHandlers:
             keyboard.append([
                 InlineKeyboardButton(
                     text="🔄 Обновить",
-                    callback_data=f"stock:{ticker}"
+                    callback_data=f"refresh:{ticker}"
                 )
             ])
             
@@ -301,11 +333,14 @@ class TelegramHandlers:
     
     async def _handle_subscribe(self, query, user_id: int, ticker: str):
         """Обработка подписки"""
+        if not instruments.is_supported(ticker):
+            await query.answer("ℹ️ По этой акции сейчас нет торгов.", show_alert=True)
+            return
+        
         success = await db.add_subscription(user_id, ticker)
         
-        stock_info = SUPPORTED_STOCKS.get(ticker, {})
-        emoji = stock_info.get('emoji', '📊')
-        name = stock_info.get('name', ticker)
+        emoji = instruments.emoji(ticker)
+        name = instruments.name(ticker)
         
         if success:
             message = f"⭐ Вы подписались на {emoji} {ticker} - {name}\n\nВы будете получать уведомления о сигналах LONG!"
@@ -321,9 +356,8 @@ class TelegramHandlers:
         """Обработка отписки"""
         success = await db.remove_subscription(user_id, ticker)
         
-        stock_info = SUPPORTED_STOCKS.get(ticker, {})
-        emoji = stock_info.get('emoji', '📊')
-        name = stock_info.get('name', ticker)
+        emoji = instruments.emoji(ticker)
+        name = instruments.name(ticker)
         
         if success:
             message = f"✖️ Вы отписались от {emoji} {ticker} - {name}"
@@ -340,8 +374,9 @@ class TelegramHandlers:
         await query.edit_message_text("🤖 GPT анализирует свечи...")
         
         try:
-            # Получаем данные акции
-            stock_data = await self.stock_service.get_stock_data(ticker)
+            # Получаем данные акции из кэша снимков
+            snapshot = await market_snapshots.get(ticker)
+            stock_data = snapshot.stock_data if snapshot else None
             
             if not stock_data or not stock_data.is_valid():
                 await query.edit_message_text(
@@ -349,8 +384,8 @@ class TelegramHandlers:
                 )
                 return
             
-            # Получаем свечи для анализа
-            candles_data = await self.stock_service.moex_client.get_historical_candles(ticker)
+            # Свечи для анализа (те же, по которым посчитан снимок)
+            candles_data = stock_data.candles or await self.stock_service.moex_client.get_historical_candles(ticker)
             
             if not candles_data:
                 await query.edit_message_text(
@@ -358,21 +393,11 @@ class TelegramHandlers:
                 )
                 return
             
-            # Запрашиваем GPT анализ
-            gpt_analysis = await gpt_analyst.analyze_stock(stock_data, candles_data)
-            
-            if not gpt_analysis:
-                await query.edit_message_text(
-                    "❌ Не удалось получить анализ от GPT. Попробуйте позже."
-                )
-                return
-            
-            # Формируем сообщение
-            stock_info = SUPPORTED_STOCKS.get(ticker, {})
-            stock_name = stock_info.get('name', ticker)
-            stock_emoji = stock_info.get('emoji', '📊')
+            # Формируем шапку сообщения
+            stock_name = instruments.name(ticker)
+            stock_emoji = instruments.emoji(ticker)
             
-            message = (
+            header = (
                 f"🤖 <b>GPT АНАЛИЗ</b>\n\n"
                 f"{stock_emoji} <b>{ticker} - {stock_name}</b>\n\n"
                 f"💰 <b>Цена:</b> {stock_data.price.current_price:.2f} ₽\n\n"
@@ -380,9 +405,31 @@ class TelegramHandlers:
                 f"• ADX: {stock_data.technical.adx:.2f}\n"
                 f"• DI+: {stock_data.technical.di_plus:.2f}\n"
                 f"• DI-: {stock_data.technical.di_minus:.2f}\n\n"
-                f"📝 <b>Анализ:</b>\n{gpt_analysis}"
+                f"📝 <b>Анализ:</b>\n"
             )
             
+            # Потоковый GPT анализ: промежуточный текст показываем не чаще раза в интервал
+            gpt_analysis = None
+            last_edit_at = time.monotonic()
+            
+            async for text, is_final in gpt_analyst.stream_analysis(stock_data, candles_data):
+                if is_final:
+                    gpt_analysis = text
+                    break
+                
+                if time.monotonic() - last_edit_at >= GPT_STREAM_EDIT_INTERVAL_SECONDS:
+                    last_edit_at = time.monotonic()
+                    delay = await self._edit_progress(query, header + html.escape(text) + " ▌")
+                    last_edit_at += delay
+            
+            if not gpt_analysis:
+                await query.edit_message_text(
+                    "❌ Не удалось получить анализ от GPT. Попробуйте позже."
+                )
+                return
+            
+            message = header + html.escape(gpt_analysis)
+            
             # Кнопка назад
             keyboard = [[InlineKeyboardButton("◀️ Назад к акции", callback_data=f"stock:{ticker}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -399,6 +446,23 @@ class TelegramHandlers:
                 "❌ Произошла ошибка при анализе. Попробуйте позже."
             )
     
+    async def _edit_progress(self, query, text: str) -> float:
+        """Промежуточное редактирование сообщения.
+        
+        Ошибки не прерывают поток; возвращает дополнительную паузу,
+        которую запросил Telegram при превышении лимита редактирований.
+        """
+        try:
+            await query.edit_message_text(text, parse_mode='HTML')
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logger.warning(f"Telegram edit rate limit, retry after {retry_after}s")
+            return float(retry_after)
+        except BadRequest as e:
+            # "Message is not modified" и подобные — пропускаем кадр
+            logger.debug(f"Skip progress edit: {e}")
+        return 0.0
+    
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
         logger.error(f"Update {update} caused error {context.error}", exc_info=True)
@@ -411,6 +475,7 @@ class TelegramHandlers:
             CommandHandler("positions", self.positions_command),
             CommandHandler("stats", self.stats_command),
             CommandHandler("dashboard", self.dashboard_command),
+            CommandHandler("scan", self.scan_command),
             MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message),
             CallbackQueryHandler(self.button_callback),
         ]
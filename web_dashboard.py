@@ -1,19 +1,44 @@
+import asyncio
+import base64
+import csv
+import io
 import logging
-import json
+import hashlib
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List, Dict, Any, Tuple
 
 from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
+from brotli_asgi import BrotliMiddleware
+from telegram import Update
 import uvicorn
 
 from database import db
-from config import SUPPORTED_STOCKS
+from config import (
+    SUPPORTED_STOCKS,
+    CHART_MAX_POINTS,
+    CHART_MAX_POINTS_LIMIT,
+    WEB_WORKERS,
+    WEB_PORT,
+    DASHBOARD_CACHE_TTL_SECONDS,
+    QUOTE_CACHE_TTL_SECONDS,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET
+)
 from stock_service import StockService
 from fear_greed_index import fear_greed
+from downsampling import downsample
+from serialization import dumps, FastJSONResponse
+from cache import cache
+from moex_api import close_http_client
+from market_scanner import market_scanner
+from instruments import instruments
+import singleflight
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -22,35 +47,160 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Lifespan handler: подключение к БД при старте, отключение при остановке.
+# Ключ advisory-блокировки PostgreSQL для бэкфила F&G (один воркер на кластер)
+FG_BACKFILL_LOCK_KEY = 7_310_001
+INSTRUMENTS_REFRESH_LOCK_KEY = 7_310_002
+
+# Минимум записей F&G, при котором бэкфил не нужен
+FG_BACKFILL_MIN_ENTRIES = 30
+
+# Состояние фонового бэкфила для readiness-пробы
+backfill_status: Dict[str, Any] = {
+    'state': 'pending',
+    'processed': 0,
+    'total': 0,
+    'started_at': None,
+    'finished_at': None,
+    'error': None,
+}
+
+
+def _on_backfill_progress(processed: int, total: int):
+    """Колбэк прогресса расчёта исторических значений"""
+    backfill_status['processed'] = processed
+    backfill_status['total'] = total
+
+
+async def run_fear_greed_backfill():
+    """One-shot бэкфил истории Fear & Greed в фоне.
     
-    Также делает one-shot бэкфил истории Fear & Greed если её ещё нет в БД.
+    Выполняется только тем воркером, который взял advisory-блокировку;
+    остальные сразу выходят и продолжают обслуживать запросы.
     """
-    await db.connect()
-    logger.info("✅ Web Dashboard started")
-    
-    # One-shot бэкфил истории F&G при первом запуске
+    backfill_status['started_at'] = datetime.now()
     try:
-        fg_count = await db.get_fear_greed_count()
-        if fg_count < 30:
+        async with db.advisory_lock(FG_BACKFILL_LOCK_KEY) as acquired:
+            if not acquired:
+                backfill_status['state'] = 'locked_by_other_worker'
+                logger.info("📊 F&G backfill is running in another worker, skip")
+                return
+            
+            # Проверяем под блокировкой: другой воркер мог только что закончить
+            fg_count = await db.get_fear_greed_count()
+            if fg_count >= FG_BACKFILL_MIN_ENTRIES:
+                backfill_status['state'] = 'not_needed'
+                logger.info(f"📊 F&G history already populated ({fg_count} entries), skip backfill")
+                return
+            
+            backfill_status['state'] = 'running'
             logger.info(f"📊 F&G history has {fg_count} entries, running one-time backfill...")
-            historical = await fear_greed.backfill_history(days=180)
+            historical = await fear_greed.backfill_history(days=180, on_progress=_on_backfill_progress)
             if historical:
                 await db.save_fear_greed_batch(historical)
                 logger.info(f"✅ Backfilled {len(historical)} historical F&G values")
-        else:
-            logger.info(f"📊 F&G history already populated ({fg_count} entries), skip backfill")
+            backfill_status['state'] = 'done'
+    except asyncio.CancelledError:
+        backfill_status['state'] = 'cancelled'
+        raise
+    except Exception as e:
+        backfill_status['state'] = 'failed'
+        backfill_status['error'] = str(e)
+        logger.error(f"❌ F&G backfill failed: {e}", exc_info=True)
+    finally:
+        backfill_status['finished_at'] = datetime.now()
+
+
+async def start_bot_webhook(app: FastAPI):
+    """Запуск бота в режиме webhook в том же процессе и event loop.
+    
+    Пул БД, HTTP-клиент MOEX и кэши общие с дашбордом; мониторинг сигналов
+    работает через job_queue приложения бота.
+    """
+    from bot_app import build_application
+    
+    application = build_application(webhook=True)
+    await application.initialize()
+    await application.start()
+    await application.bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES
+    )
+    app.state.bot_application = application
+    logger.info(f"🤖 Telegram bot started in webhook mode ({WEBHOOK_PATH})")
+
+
+async def stop_bot_webhook(app: FastAPI):
+    application = getattr(app.state, 'bot_application', None)
+    if application is None:
+        return
+    
+    app.state.bot_application = None
+    await application.stop()
+    await application.shutdown()
+    logger.info("👋 Telegram bot stopped")
+
+
+async def run_instruments_refresh():
+    """Обновление реестра инструментов из ISS в фоне, если он пуст или устарел.
+    
+    Как и бэкфил F&G, выполняется одним воркером под advisory-блокировкой;
+    под ней реестр перечитывается из БД, так что после другого воркера
+    повторного запроса к ISS не будет.
+    """
+    try:
+        async with db.advisory_lock(INSTRUMENTS_REFRESH_LOCK_KEY) as acquired:
+            if not acquired:
+                logger.info("📇 Instrument registry refresh is running in another worker, skip")
+                return
+            await instruments.load()
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        logger.error(f"❌ Backfill on startup failed: {e}", exc_info=True)
+        logger.error(f"❌ Instrument registry refresh failed: {e}", exc_info=True)
+
+
+async def _cancel_task(task: asyncio.Task):
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lifespan handler: подключение к БД при старте, отключение при остановке.
+    
+    Реестр инструментов читается только из БД; обновление из ISS и бэкфил
+    истории Fear & Greed запускаются фоновыми задачами и не задерживают старт.
+    При BOT_MODE=webhook здесь же запускается и останавливается бот.
+    """
+    await db.connect()
+    await instruments.load(refresh_if_stale=False)
+    instruments_task = asyncio.create_task(run_instruments_refresh())
+    backfill_task = asyncio.create_task(run_fear_greed_backfill())
+    if BOT_MODE == 'webhook':
+        await start_bot_webhook(app)
+    logger.info("✅ Web Dashboard started")
     
     yield
+    
+    await stop_bot_webhook(app)
+    await _cancel_task(instruments_task)
+    await _cancel_task(backfill_task)
+    await cache.close()
+    await close_http_client()
     await db.disconnect()
     logger.info("👋 Web Dashboard stopped")
 
 
-app = FastAPI(title="Revushiy Kotenok Dashboard", lifespan=lifespan)
+app = FastAPI(
+    title="Revushiy Kotenok Dashboard",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
 
 # Фильтр по пользователю
 TARGET_USERNAME = 'matve1ch'
@@ -58,14 +208,454 @@ TARGET_USERNAME = 'matve1ch'
 # Дата начала торговли
 TRADING_START_DATE = datetime(2025, 10, 1)
 
+# Период графика F&G по умолчанию (дней)
+FG_DEFAULT_DAYS = 180
+
+# Лента сделок: размер страницы и максимум для API
+FEED_PAGE_SIZE = 50
+FEED_MAX_PAGE_SIZE = 500
+
+# Выгрузка сделок в CSV
+CSV_EXPORT_COLUMNS = [
+    'id', 'ticker', 'position_type', 'entry_time', 'entry_price', 'exit_time', 'exit_price',
+    'profit_percent', 'lots', 'average_price', 'averaging_count'
+]
+CSV_CHUNK_SIZE = 64 * 1024
+
 # Сервис для получения данных акций
 stock_service = StockService()
 
+# Минимальный размер ответа для сжатия (байт)
+COMPRESSION_MIN_SIZE = 1000
+
+# Типы ответов, для которых считаем ETag (стриминговые выгрузки не буферизуем)
+ETAG_CONTENT_TYPES = ('text/html', 'application/json')
+
+# Суффикс ETag для content-coding ответа
+ETAG_CODING_SUFFIXES = {'br': '-br', 'gzip': '-gz'}
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    Сжатие ответа по Accept-Encoding с учётом q-значений: 'br', 'gzip' или ''.
+
+    При равных q предпочитаем brotli; q=0 — кодировка запрещена, '*' задаёт
+    вес для не перечисленных явно.
+    """
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[token] = q
+    
+    default = weights.get('*', 0.0)
+    best, best_q = '', 0.0
+    for coding in ('br', 'gzip'):
+        q = weights.get(coding, default)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class AcceptEncodingMiddleware:
+    """
+    Приводит Accept-Encoding к одной выбранной кодировке (negotiate_encoding).
+
+    BrotliMiddleware выбирает сжатие поиском подстроки ('br' находится и в
+    'br;q=0'), поэтому заголовок нормализуется до неё — тогда и сжатие, и
+    суффикс ETag определяются одним и тем же разбором.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            accept_encoding = ', '.join(
+                value.decode('latin-1') for name, value in scope['headers'] if name == b'accept-encoding'
+            )
+            headers = [(name, value) for name, value in scope['headers'] if name != b'accept-encoding']
+            coding = negotiate_encoding(accept_encoding)
+            if coding:
+                headers.append((b'accept-encoding', coding.encode('latin-1')))
+            scope = dict(scope, headers=headers)
+        await self.app(scope, receive, send)
+
+
+@app.middleware("http")
+async def etag_middleware(request: Request, call_next):
+    """Сильный ETag по содержимому ответа и 304 на совпадающий If-None-Match"""
+    response = await call_next(request)
+    
+    content_type = response.headers.get('content-type', '')
+    if (
+        request.method != 'GET'
+        or response.status_code != 200
+        or 'etag' in response.headers
+        or not content_type.startswith(ETAG_CONTENT_TYPES)
+    ):
+        return response
+    
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    
+    # Сильный ETag различается для каждого content-coding, который выберет BrotliMiddleware
+    coding = ''
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        # Accept-Encoding уже нормализован AcceptEncodingMiddleware до одной кодировки
+        coding = ETAG_CODING_SUFFIXES.get(request.headers.get('accept-encoding', ''), '')
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}{coding}"'
+    
+    headers = dict(response.headers)
+    headers['etag'] = etag
+    headers.pop('content-length', None)
+    
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers={'etag': etag})
+    
+    return Response(
+        content=body,
+        status_code=response.status_code,
+        headers=headers,
+        media_type=response.media_type
+    )
+
+
+# Сжатие: brotli для поддерживающих клиентов, иначе gzip.
+# Добавляется после ETag-мидлвари, поэтому оборачивает её снаружи.
+app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+# Самая внешняя: выбор сжатия один раз для BrotliMiddleware и ETag
+app.add_middleware(AcceptEncodingMiddleware)
+
 # Подключаем статические файлы и шаблоны
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
+def _clamp_points(points: Optional[int]) -> int:
+    """Разрешение графика: число точек на серию в допустимых пределах"""
+    if not points or points <= 0:
+        return CHART_MAX_POINTS
+    return min(points, CHART_MAX_POINTS_LIMIT)
+
+
+def _build_profit_chart_data(chart_data_raw: Dict[str, List[Dict[str, Any]]], max_points: int) -> Dict[str, Any]:
+    """Серии накопленной прибыли по акциям для Chart.js"""
+    chart_data = {}
+    for ticker in [*SUPPORTED_STOCKS, *sorted(chart_data_raw.keys() - SUPPORTED_STOCKS.keys())]:
+        chart_data[ticker] = {
+            'label': f"{instruments.emoji(ticker)} {ticker}",
+            'data': []
+        }
+    
+    for ticker, points in chart_data_raw.items():
+        if ticker in chart_data:
+            points = downsample(points, max_points, 'date', 'cumulative_profit')
+            chart_data[ticker]['data'] = [
+                {
+                    'x': point['date'],
+                    'y': round(point['cumulative_profit'], 2)
+                }
+                for point in points
+            ]
+    
+    return chart_data
+
+
+def _build_fg_chart_data(fg_history: List[Dict[str, Any]], max_points: int) -> List[Dict[str, Any]]:
+    """Точки истории индекса страха и жадности"""
+    fg_history = downsample(fg_history, max_points, 'date', 'value')
+    return [
+        {'date': row['date'], 'value': row['value']}
+        for row in fg_history
+    ]
+
+
+async def _load_imoex_chart_data(days: int, max_points: int) -> List[Dict[str, Any]]:
+    """Дневные свечи IMOEX (цена + объём) для наложения на график F&G"""
+    try:
+        imoex_candles = await fear_greed._get_imoex_daily_candles(days=days)
+        if not imoex_candles:
+            return []
+        
+        points = [
+            {
+                'date': str(day),
+                'close': close,
+                'volume': volume,
+            }
+            for day, close, volume in zip(
+                imoex_candles.dates, imoex_candles.close.tolist(), imoex_candles.volume.tolist()
+            )
+        ]
+        return downsample(points, max_points, 'date', 'close')
+    except Exception as e:
+        logger.error(f"Error loading IMOEX candles for chart: {e}")
+        return []
+
+
+def _feed_position_type(feed_type: Optional[str]) -> Optional[str]:
+    """Фильтр типа позиции для ленты ('all' — без фильтра)"""
+    return feed_type if feed_type and feed_type != 'all' else None
+
+
+def _encode_feed_cursor(exit_time: datetime, position_id: int) -> str:
+    """Непрозрачный keyset-курсор ленты сделок"""
+    raw = f"{exit_time.isoformat()}|{position_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_feed_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Разбор курсора ленты сделок; ValueError при неверном формате"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        exit_time, position_id = raw.split('|')
+        return datetime.fromisoformat(exit_time), int(position_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _next_feed_cursor(positions: List[Dict[str, Any]], limit: int) -> Optional[str]:
+    """Курсор следующей страницы (None если страница неполная — дальше данных нет)"""
+    if len(positions) < limit:
+        return None
+    last = positions[-1]
+    return _encode_feed_cursor(last['exit_time'], last['id'])
+
+
+def _decorate_closed_positions(closed_positions: List[Dict[str, Any]]):
+    """Имя, эмодзи и продолжительность для строк ленты сделок"""
+    for pos in closed_positions:
+        ticker = pos['ticker']
+        pos['stock_name'] = instruments.name(ticker)
+        pos['stock_emoji'] = instruments.emoji(ticker)
+        duration = pos['exit_time'] - pos['entry_time']
+        duration_hours = duration.total_seconds() / 3600
+        if duration_hours < 24:
+            pos['duration_str'] = f"{duration_hours:.1f}ч"
+        else:
+            pos['duration_str'] = f"{duration_hours / 24:.1f}д"
+
+
+async def _build_dashboard_context(
+    year: int,
+    month: int,
+    ticker_year: Optional[int],
+    ticker_month: Optional[int],
+    feed_type: Optional[str],
+    max_points: int
+) -> Dict[str, Any]:
+    """Посчитанные секции дашборда (кэшируются в общем кэше между воркерами)"""
+    # Получаем общую статистику за месяц
+    monthly_stats_all = await db.get_global_monthly_statistics(year, month, username=TARGET_USERNAME)
+    
+    open_positions = await db.get_all_open_positions_web(username=TARGET_USERNAME)
+    
+    # Статистика по акциям с фильтром по месяцу
+    if ticker_year and ticker_month:
+        ticker_stats_all = await db.get_statistics_by_ticker_filtered(
+            username=TARGET_USERNAME, 
+            year=ticker_year, 
+            month=ticker_month
+        )
+        ticker_filter_label = datetime(ticker_year, ticker_month, 1).strftime("%B %Y")
+        
+        chart_data_response = await db.get_cumulative_profit_data(
+            username=TARGET_USERNAME,
+            year=ticker_year,
+            month=ticker_month
+        )
+    else:
+        ticker_stats_all = await db.get_statistics_by_ticker(username=TARGET_USERNAME)
+        ticker_filter_label = "за всё время"
+        
+        chart_data_response = await db.get_cumulative_profit_data(username=TARGET_USERNAME)
+    
+    chart_data_raw = chart_data_response.get('data', {})
+    start_date = chart_data_response.get('start_date')
+    
+    # Лента сделок (первая страница)
+    closed_positions = await db.get_all_closed_positions_web(
+        limit=FEED_PAGE_SIZE, username=TARGET_USERNAME, position_type=_feed_position_type(feed_type)
+    )
+    feed_next_cursor = _next_feed_cursor(closed_positions, FEED_PAGE_SIZE)
+    
+    # Раздел "Дополнительно"
+    best_trade = None
+    worst_trade = None
+    avg_duration_str = "Н/Д"
+    
+    try:
+        async with db.pool.acquire() as conn:
+            best_row = await conn.fetchrow("""
+                SELECT ticker, position_type, profit_percent, exit_time
+                FROM positions
+                WHERE is_open = FALSE
+                ORDER BY profit_percent DESC
+                LIMIT 1
+            """)
+            if best_row:
+                best_trade = dict(best_row)
+    except Exception as e:
+        logger.error(f"Error getting best trade: {e}")
+    
+    try:
+        async with db.pool.acquire() as conn:
+            worst_row = await conn.fetchrow("""
+                SELECT ticker, position_type, profit_percent, exit_time
+                FROM positions
+                WHERE is_open = FALSE
+                ORDER BY profit_percent ASC
+                LIMIT 1
+            """)
+            if worst_row:
+                worst_trade = dict(worst_row)
+    except Exception as e:
+        logger.error(f"Error getting worst trade: {e}")
+    
+    try:
+        async with db.pool.acquire() as conn:
+            avg_hours = await conn.fetchval("""
+                SELECT AVG(EXTRACT(EPOCH FROM (exit_time - entry_time)) / 3600)
+                FROM positions
+                WHERE is_open = FALSE
+            """)
+            if avg_hours:
+                if avg_hours < 24:
+                    avg_duration_str = f"{avg_hours:.1f} часов"
+                else:
+                    avg_duration_str = f"{avg_hours / 24:.1f} дней"
+    except Exception as e:
+        logger.error(f"Error getting avg duration: {e}")
+    
+    # Добавляем имена и эмодзи к акциям
+    for pos in open_positions:
+        ticker = pos['ticker']
+        pos['stock_name'] = instruments.name(ticker)
+        pos['stock_emoji'] = instruments.emoji(ticker)
+    
+    _decorate_closed_positions(closed_positions)
+    
+    for stat in ticker_stats_all:
+        ticker = stat['ticker']
+        stat['stock_name'] = instruments.name(ticker)
+        stat['stock_emoji'] = instruments.emoji(ticker)
+    
+    if best_trade:
+        ticker = best_trade['ticker']
+        best_trade['stock_name'] = instruments.name(ticker)
+        best_trade['stock_emoji'] = instruments.emoji(ticker)
+    
+    if worst_trade:
+        ticker = worst_trade['ticker']
+        worst_trade['stock_name'] = instruments.name(ticker)
+        worst_trade['stock_emoji'] = instruments.emoji(ticker)
+    
+    # Формируем список месяцев
+    months_list = []
+    current_date = datetime.now()
+    temp_date = datetime(current_date.year, current_date.month, 1)
+    
+    while temp_date >= TRADING_START_DATE:
+        months_list.append({
+            'year': temp_date.year,
+            'month': temp_date.month,
+            'label': temp_date.strftime("%B %Y")
+        })
+        
+        if temp_date.month == 1:
+            temp_date = datetime(temp_date.year - 1, 12, 1)
+        else:
+            temp_date = datetime(temp_date.year, temp_date.month - 1, 1)
+    
+    # Данные для графика прибыли
+    chart_data_json = dumps(_build_profit_chart_data(chart_data_raw, max_points))
+    
+    # Fear & Greed Index
+    fg_latest = await db.get_fear_greed_latest()
+    fg_history = await db.get_fear_greed_history(days=FG_DEFAULT_DAYS)
+    fg_yesterday = await db.get_fear_greed_by_offset(1)
+    fg_last_week = await db.get_fear_greed_by_offset(7)
+    fg_last_month = await db.get_fear_greed_by_offset(30)
+    fg_extremes = await db.get_fear_greed_year_extremes()
+    
+    fg_chart_data = dumps(_build_fg_chart_data(fg_history, max_points))
+    
+    # IMOEX candles for chart overlay (price + volume)
+    imoex_chart_data = dumps(await _load_imoex_chart_data(FG_DEFAULT_DAYS, max_points))
+    
+    return {
+        "year": year,
+        "month": month,
+        "month_name": datetime(year, month, 1).strftime("%B %Y"),
+        "months_list": months_list,
+        "monthly_stats_all": monthly_stats_all,
+        "open_positions": open_positions,
+        "closed_positions": closed_positions,
+        "ticker_stats_all": ticker_stats_all,
+        "ticker_filter_label": ticker_filter_label,
+        "ticker_year": ticker_year,
+        "ticker_month": ticker_month,
+        "feed_type": feed_type or 'all',
+        "feed_next_cursor": feed_next_cursor,
+        "best_trade": best_trade,
+        "worst_trade": worst_trade,
+        "avg_duration_str": avg_duration_str,
+        "chart_data_json": chart_data_json,
+        "fg_latest": fg_latest,
+        "fg_chart_data": fg_chart_data,
+        "fg_yesterday": fg_yesterday,
+        "fg_last_week": fg_last_week,
+        "fg_last_month": fg_last_month,
+        "fg_extremes": fg_extremes,
+        "imoex_chart_data": imoex_chart_data,
+        "chart_points": max_points,
+    }
+
+
+async def _fetch_current_price(ticker: str) -> Optional[float]:
+    """Актуальная цена акции с MOEX"""
+    try:
+        return await stock_service.moex_client.get_current_price(ticker)
+    except Exception as e:
+        logger.error(f"Error getting current price for {ticker}: {e}")
+        return None
+
+
+async def _attach_current_prices(open_positions: List[Dict[str, Any]]):
+    """Текущие цены и прибыль открытых позиций (котировки из общего кэша)"""
+    for pos in open_positions:
+        ticker = pos['ticker']
+        current_price = await cache.get_or_set(
+            f"quote:{ticker}",
+            lambda: _fetch_current_price(ticker),
+            QUOTE_CACHE_TTL_SECONDS
+        )
+        
+        if current_price is None:
+            pos['current_price'] = None
+            pos['current_profit'] = None
+            continue
+        
+        pos['current_price'] = current_price
+        entry_price = float(pos['entry_price'])
+        
+        if pos['position_type'] == 'LONG':
+            pos['current_profit'] = ((current_price - entry_price) / entry_price) * 100
+        else:
+            pos['current_profit'] = ((entry_price - current_price) / entry_price) * 100
+
+
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(
     request: Request, 
@@ -73,249 +663,34 @@ async def dashboard(
     month: Optional[int] = None,
     ticker_year: Optional[int] = None,
     ticker_month: Optional[int] = None,
-    feed_type: Optional[str] = None
+    feed_type: Optional[str] = None,
+    points: Optional[int] = None
 ):
     """Главная страница дашборда"""
     
+    max_points = _clamp_points(points)
+    
     if year is None or month is None:
         now = datetime.now()
         year = now.year
         month = now.month
     
     try:
-        # Получаем общую статистику за месяц
-        monthly_stats_all = await db.get_global_monthly_statistics(year, month, username=TARGET_USERNAME)
-        
-        open_positions = await db.get_all_open_positions_web(username=TARGET_USERNAME)
-        
-        # Статистика по акциям с фильтром по месяцу
-        if ticker_year and ticker_month:
-            ticker_stats_all = await db.get_statistics_by_ticker_filtered(
-                username=TARGET_USERNAME, 
-                year=ticker_year, 
-                month=ticker_month
-            )
-            ticker_filter_label = datetime(ticker_year, ticker_month, 1).strftime("%B %Y")
-            
-            chart_data_response = await db.get_cumulative_profit_data(
-                username=TARGET_USERNAME,
-                year=ticker_year,
-                month=ticker_month
-            )
-        else:
-            ticker_stats_all = await db.get_statistics_by_ticker(username=TARGET_USERNAME)
-            ticker_filter_label = "за всё время"
-            
-            chart_data_response = await db.get_cumulative_profit_data(username=TARGET_USERNAME)
-        
-        chart_data_raw = chart_data_response.get('data', {})
-        start_date = chart_data_response.get('start_date')
-        
-        # Лента сделок
-        if feed_type and feed_type != 'all':
-            closed_positions = await db.get_all_closed_positions_web(
-                limit=50, username=TARGET_USERNAME, position_type=feed_type
-            )
-        else:
-            closed_positions = await db.get_all_closed_positions_web(
-                limit=50, username=TARGET_USERNAME
-            )
-        
-        # Раздел "Дополнительно"
-        best_trade = None
-        worst_trade = None
-        avg_duration_str = "Н/Д"
-        
-        try:
-            async with db.pool.acquire() as conn:
-                best_row = await conn.fetchrow("""
-                    SELECT ticker, position_type, profit_percent, exit_time
-                    FROM positions
-                    WHERE is_open = FALSE
-                    ORDER BY profit_percent DESC
-                    LIMIT 1
-                """)
-                if best_row:
-                    best_trade = dict(best_row)
-        except Exception as e:
-            logger.error(f"Error getting best trade: {e}")
-        
-        try:
-            async with db.pool.acquire() as conn:
-                worst_row = await conn.fetchrow("""
-                    SELECT ticker, position_type, profit_percent, exit_time
-                    FROM positions
-                    WHERE is_open = FALSE
-                    ORDER BY profit_percent ASC
-                    LIMIT 1
-                """)
-                if worst_row:
-                    worst_trade = dict(worst_row)
-        except Exception as e:
-            logger.error(f"Error getting worst trade: {e}")
-        
-        try:
-            async with db.pool.acquire() as conn:
-                avg_hours = await conn.fetchval("""
-                    SELECT AVG(EXTRACT(EPOCH FROM (exit_time - entry_time)) / 3600)
-                    FROM positions
-                    WHERE is_open = FALSE
-                """)
-                if avg_hours:
-                    if avg_hours < 24:
-                        avg_duration_str = f"{avg_hours:.1f} часов"
-                    else:
-                        avg_duration_str = f"{avg_hours / 24:.1f} дней"
-        except Exception as e:
-            logger.error(f"Error getting avg duration: {e}")
-        
-        # Добавляем имена и эмодзи к акциям
-        for pos in open_positions:
-            ticker = pos['ticker']
-            pos['stock_name'] = SUPPORTED_STOCKS.get(ticker, {}).get('name', ticker)
-            pos['stock_emoji'] = SUPPORTED_STOCKS.get(ticker, {}).get('emoji', '📊')
-            
-            try:
-                stock_data = await stock_service.get_stock_data(ticker)
-                if stock_data:
-                    pos['current_price'] = stock_data.price.current_price
-                    entry_price = float(pos['entry_price'])
-                    position_type = pos['position_type']
-                    
-                    if position_type == 'LONG':
-                        current_profit = ((pos['current_price'] - entry_price) / entry_price) * 100
-                    else:
-                        current_profit = ((entry_price - pos['current_price']) / entry_price) * 100
-                    
-                    pos['current_profit'] = current_profit
-                else:
-                    pos['current_price'] = None
-                    pos['current_profit'] = None
-            except Exception as e:
-                logger.error(f"Error getting current price for {ticker}: {e}")
-                pos['current_price'] = None
-                pos['current_profit'] = None
-        
-        for pos in closed_positions:
-            ticker = pos['ticker']
-            pos['stock_name'] = SUPPORTED_STOCKS.get(ticker, {}).get('name', ticker)
-            pos['stock_emoji'] = SUPPORTED_STOCKS.get(ticker, {}).get('emoji', '📊')
-            duration = pos['exit_time'] - pos['entry_time']
-            duration_hours = duration.total_seconds() / 3600
-            if duration_hours < 24:
-                pos['duration_str'] = f"{duration_hours:.1f}ч"
-            else:
-                pos['duration_str'] = f"{duration_hours / 24:.1f}д"
-        
-        for stat in ticker_stats_all:
-            ticker = stat['ticker']
-            stat['stock_name'] = SUPPORTED_STOCKS.get(ticker, {}).get('name', ticker)
-            stat['stock_emoji'] = SUPPORTED_STOCKS.get(ticker, {}).get('emoji', '📊')
-        
-        if best_trade:
-            ticker = best_trade['ticker']
-            best_trade['stock_name'] = SUPPORTED_STOCKS.get(ticker, {}).get('name', ticker)
-            best_trade['stock_emoji'] = SUPPORTED_STOCKS.get(ticker, {}).get('emoji', '📊')
-        
-        if worst_trade:
-            ticker = worst_trade['ticker']
-            worst_trade['stock_name'] = SUPPORTED_STOCKS.get(ticker, {}).get('name', ticker)
-            worst_trade['stock_emoji'] = SUPPORTED_STOCKS.get(ticker, {}).get('emoji', '📊')
-        
-        # Формируем список месяцев
-        months_list = []
-        current_date = datetime.now()
-        temp_date = datetime(current_date.year, current_date.month, 1)
-        
-        while temp_date >= TRADING_START_DATE:
-            months_list.append({
-                'year': temp_date.year,
-                'month': temp_date.month,
-                'label': temp_date.strftime("%B %Y")
-            })
-            
-            if temp_date.month == 1:
-                temp_date = datetime(temp_date.year - 1, 12, 1)
-            else:
-                temp_date = datetime(temp_date.year, temp_date.month - 1, 1)
-        
-        # Данные для графика прибыли
-        chart_data = {}
-        for ticker in SUPPORTED_STOCKS.keys():
-            chart_data[ticker] = {
-                'label': f"{SUPPORTED_STOCKS[ticker]['emoji']} {ticker}",
-                'data': []
-            }
-        
-        for ticker, points in chart_data_raw.items():
-            if ticker in chart_data:
-                chart_data[ticker]['data'] = [
-                    {
-                        'x': point['date'].strftime('%Y-%m-%d %H:%M:%S'),
-                        'y': round(point['cumulative_profit'], 2)
-                    }
-                    for point in points
-                ]
-        
-        chart_data_json = json.dumps(chart_data)
-        
-        # Fear & Greed Index
-        fg_latest = await db.get_fear_greed_latest()
-        fg_history = await db.get_fear_greed_history(days=180)
-        fg_yesterday = await db.get_fear_greed_by_offset(1)
-        fg_last_week = await db.get_fear_greed_by_offset(7)
-        fg_last_month = await db.get_fear_greed_by_offset(30)
-        fg_extremes = await db.get_fear_greed_year_extremes()
-        
-        fg_chart_data = json.dumps([
-            {'date': row['date'].strftime('%Y-%m-%d'), 'value': row['value']}
-            for row in fg_history
-        ])
+        cache_key = f"dashboard:{year}:{month}:{ticker_year}:{ticker_month}:{feed_type or 'all'}:{max_points}"
+        context = await cache.get_or_set(
+            cache_key,
+            lambda: _build_dashboard_context(year, month, ticker_year, ticker_month, feed_type, max_points),
+            DASHBOARD_CACHE_TTL_SECONDS
+        )
         
-        # IMOEX candles for chart overlay (price + volume)
-        imoex_chart_data = "[]"
-        try:
-            imoex_candles = await fear_greed._get_imoex_daily_candles(days=200)
-            if imoex_candles:
-                imoex_chart_data = json.dumps([
-                    {
-                        'date': c['date'],
-                        'close': c['close'],
-                        'volume': c['volume'],
-                    }
-                    for c in imoex_candles[-180:]
-                ])
-        except Exception as e:
-            logger.error(f"Error loading IMOEX candles for chart: {e}")
+        # Копия списка, чтобы не менять объект в кэше процесса
+        open_positions = [dict(pos) for pos in context['open_positions']]
+        await _attach_current_prices(open_positions)
         
         return templates.TemplateResponse(
             request,
             "dashboard.html",
-            {
-                "year": year,
-                "month": month,
-                "month_name": datetime(year, month, 1).strftime("%B %Y"),
-                "months_list": months_list,
-                "monthly_stats_all": monthly_stats_all,
-                "open_positions": open_positions,
-                "closed_positions": closed_positions,
-                "ticker_stats_all": ticker_stats_all,
-                "ticker_filter_label": ticker_filter_label,
-                "ticker_year": ticker_year,
-                "ticker_month": ticker_month,
-                "feed_type": feed_type or 'all',
-                "best_trade": best_trade,
-                "worst_trade": worst_trade,
-                "avg_duration_str": avg_duration_str,
-                "chart_data_json": chart_data_json,
-                "fg_latest": fg_latest,
-                "fg_chart_data": fg_chart_data,
-                "fg_yesterday": fg_yesterday,
-                "fg_last_week": fg_last_week,
-                "fg_last_month": fg_last_month,
-                "fg_extremes": fg_extremes,
-                "imoex_chart_data": imoex_chart_data,
-            }
+            {**context, "open_positions": open_positions}
         )
     
     except Exception as e:
@@ -329,12 +704,175 @@ async def dashboard(
         )
 
 
+@app.get("/api/trades")
+async def trades_feed_api(
+    cursor: Optional[str] = None,
+    limit: int = FEED_PAGE_SIZE,
+    feed_type: Optional[str] = None
+):
+    """Страница ленты закрытых сделок с keyset-пагинацией по (exit_time, id)"""
+    limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+    
+    before = None
+    if cursor:
+        try:
+            before = _decode_feed_cursor(cursor)
+        except ValueError as e:
+            return FastJSONResponse(status_code=400, content={"error": str(e)})
+    
+    positions = await db.get_all_closed_positions_web(
+        limit=limit,
+        username=TARGET_USERNAME,
+        position_type=_feed_position_type(feed_type),
+        before=before
+    )
+    _decorate_closed_positions(positions)
+    
+    return {
+        "items": [
+            {
+                "id": pos['id'],
+                "ticker": pos['ticker'],
+                "stock_name": pos['stock_name'],
+                "stock_emoji": pos['stock_emoji'],
+                "position_type": pos['position_type'],
+                "entry_price": pos['entry_price'],
+                "exit_price": pos['exit_price'],
+                "profit_percent": pos['profit_percent'],
+                "entry_time": pos['entry_time'],
+                "exit_time": pos['exit_time'],
+                "duration_str": pos['duration_str'],
+            }
+            for pos in positions
+        ],
+        "next_cursor": _next_feed_cursor(positions, limit),
+    }
+
+
+@app.get("/export/trades.csv")
+async def export_trades_csv(feed_type: Optional[str] = None):
+    """Выгрузка всех закрытых сделок в CSV потоком из серверного курсора"""
+    
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_EXPORT_COLUMNS)
+        
+        async for pos in db.iter_closed_positions_web(
+            username=TARGET_USERNAME, position_type=_feed_position_type(feed_type)
+        ):
+            writer.writerow([pos[column] for column in CSV_EXPORT_COLUMNS])
+            
+            # Отдаём клиенту накопленный кусок, не держа всю выгрузку в памяти
+            if buffer.tell() >= CSV_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        
+        if buffer.tell():
+            yield buffer.getvalue()
+    
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="trades.csv"'}
+    )
+
+
+@app.get("/api/chart/profit")
+async def profit_chart_api(
+    ticker_year: Optional[int] = None,
+    ticker_month: Optional[int] = None,
+    points: Optional[int] = None
+):
+    """Данные графика накопленной прибыли с прореживанием под разрешение клиента"""
+    if ticker_year and ticker_month:
+        chart_data_response = await db.get_cumulative_profit_data(
+            username=TARGET_USERNAME, year=ticker_year, month=ticker_month
+        )
+    else:
+        chart_data_response = await db.get_cumulative_profit_data(username=TARGET_USERNAME)
+    
+    return _build_profit_chart_data(chart_data_response.get('data', {}), _clamp_points(points))
+
+
+@app.get("/api/chart/fear-greed")
+async def fear_greed_chart_api(days: int = FG_DEFAULT_DAYS, points: Optional[int] = None):
+    """История F&G и свечи IMOEX за период (days=0 — вся история) для перезагрузки графика"""
+    max_points = _clamp_points(points)
+    fg_history = await db.get_fear_greed_history(days=days)
+    
+    imoex_days = days
+    if days <= 0:
+        imoex_days = (datetime.now().date() - fg_history[0]['date']).days + 1 if fg_history else FG_DEFAULT_DAYS
+    
+    return {
+        'fg': _build_fg_chart_data(fg_history, max_points),
+        'imoex': await _load_imoex_chart_data(imoex_days, max_points),
+    }
+
+
+@app.get("/api/scanner")
+async def scanner_api(limit: Optional[int] = None):
+    """Последний скан рынка: рейтинг сетапов ADX/DI по всем ликвидным акциям TQBR"""
+    scan = await market_scanner.get_latest()
+    if not scan:
+        return FastJSONResponse(status_code=503, content={"error": "Скан рынка недоступен"})
+    
+    rows = scan['rows'][:limit] if limit else scan['rows']
+    return {**scan, "rows": rows}
+
+
+@app.get("/api/metrics")
+async def metrics_api():
+    """Метрики процесса: схлопнутые запросы к MOEX и расчёты индикаторов"""
+    return {"singleflight": singleflight.get_stats()}
+
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Апдейты Telegram в режиме webhook: кладутся в очередь приложения бота"""
+    application = getattr(request.app.state, 'bot_application', None)
+    if application is None:
+        return Response(status_code=404)
+    
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        logger.warning("Rejected webhook request with invalid secret token")
+        return Response(status_code=403)
+    
+    update = Update.de_json(await request.json(), application.bot)
+    await application.update_queue.put(update)
+    return Response(status_code=200)
+
+
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
-    """Health check endpoint для Railway"""
+    """Liveness-проба (и health check endpoint для Railway)"""
     return {"status": "ok"}
 
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness-проба: доступность БД и прогресс фонового бэкфила F&G"""
+    db_ok = False
+    if db.pool is not None:
+        try:
+            async with db.pool.acquire() as conn:
+                db_ok = await conn.fetchval("SELECT 1") == 1
+        except Exception as e:
+            logger.error(f"Readiness DB check failed: {e}")
+    
+    return FastJSONResponse(
+        status_code=200 if db_ok else 503,
+        content={
+            "status": "ready" if db_ok else "not_ready",
+            "database": db_ok,
+            "fear_greed_backfill": backfill_status,
+        }
+    )
+
+
 @app.get("/top-trades", response_class=HTMLResponse)
 async def top_trades(request: Request, type: str = "best", position_type: str = None):
     """Страница топ-10 лучших или худших сделок"""
@@ -344,8 +882,8 @@ async def top_trades(request: Request, type: str = "best", position_type: str =
         
         for trade in trades:
             ticker = trade['ticker']
-            trade['stock_name'] = SUPPORTED_STOCKS.get(ticker, {}).get('name', ticker)
-            trade['stock_emoji'] = SUPPORTED_STOCKS.get(ticker, {}).get('emoji', '📊')
+            trade['stock_name'] = instruments.name(ticker)
+            trade['stock_emoji'] = instruments.emoji(ticker)
         
         if position_type == 'LONG':
             title_suffix = " (LONG)"
@@ -377,10 +915,101 @@ async def top_trades(request: Request, type: str = "best", position_type: str =
         )
 
 
+@app.get("/scanner", response_class=HTMLResponse)
+async def scanner_page(request: Request):
+    """Страница сканера рынка"""
+    scan = await market_scanner.get_latest()
+    if not scan:
+        return templates.TemplateResponse(
+            request,
+            "error.html",
+            {
+                "error": "Скан рынка недоступен, попробуйте позже"
+            }
+        )
+    
+    return templates.TemplateResponse(
+        request,
+        "scanner.html",
+        {
+            "title": "🔭 Сканер рынка",
+            "scan": scan
+        }
+    )
+
+
+@app.get("/backtest", response_class=HTMLResponse)
+async def backtest_runs(request: Request):
+    """Последний прогон бэктеста (прогоны создаются командой python backtest.py --save)"""
+    try:
+        runs = await db.get_backtest_runs(limit=1)
+    except Exception as e:
+        logger.error(f"Error loading backtest runs: {e}", exc_info=True)
+        runs = []
+    
+    if not runs:
+        return templates.TemplateResponse(
+            request,
+            "error.html",
+            {
+                "error": "Прогонов бэктеста нет: запустите python backtest.py --save"
+            }
+        )
+    return RedirectResponse(url=f"/backtest/{runs[0]['id']}")
+
+
+@app.get("/backtest/{run_id}", response_class=HTMLResponse)
+async def backtest_run(request: Request, run_id: int):
+    """Страница прогона бэктеста: сводка, сделки и другие прогоны"""
+    try:
+        run = await db.get_backtest_run(run_id)
+        if not run:
+            return templates.TemplateResponse(
+                request,
+                "error.html",
+                {
+                    "error": f"Прогон бэктеста #{run_id} не найден"
+                },
+                status_code=404
+            )
+        
+        positions = await db.get_backtest_positions(run_id)
+        for position in positions:
+            ticker = position['ticker']
+            position['stock_name'] = instruments.name(ticker)
+            position['stock_emoji'] = instruments.emoji(ticker)
+        
+        return templates.TemplateResponse(
+            request,
+            "backtest.html",
+            {
+                "title": f"🧪 Бэктест #{run_id}",
+                "run": run,
+                "positions": positions,
+                "runs": await db.get_backtest_runs()
+            }
+        )
+    
+    except Exception as e:
+        logger.error(f"Error loading backtest run {run_id}: {e}", exc_info=True)
+        return templates.TemplateResponse(
+            request,
+            "error.html",
+            {
+                "error": str(e)
+            }
+        )
+
 if __name__ == "__main__":
+    # WEB_WORKERS > 1 — несколько процессов uvicorn; общий кэш задаётся через CACHE_URL.
+    # С ботом в режиме webhook воркер один: иначе мониторинг запустится в каждом процессе
+    workers = 1 if BOT_MODE == 'webhook' else WEB_WORKERS
+    if workers != WEB_WORKERS:
+        logger.warning(f"BOT_MODE=webhook: running 1 worker instead of {WEB_WORKERS}")
     uvicorn.run(
         "web_dashboard:app",
         host="0.0.0.0",
-        port=8000,
-        reload=False
+        port=WEB_PORT,
+        reload=False,
+        workers=workers
     )